@@ -1,6 +1,23 @@
 __all__ = [
+    "assets",
+    "bench",
     "chatbot",
     "chat_store",
+    "codec",
+    "history_cache",
+    "metrics",
+    "middleware",
+    "migrate_codec",
+    "prompt",
+    "redis_pool",
+    "replies",
+    "response_cache",
+    "resumable",
+    "scheduler",
+    "session_bus",
+    "singleflight",
+    "streaming",
     "tcp",
+    "workouts",
 ]
 1
\ No newline at end of file
@@ -1,16 +1,29 @@
+import asyncio
+import json
 import logging
+import os
 import re
 from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 
+from fitbot import assets
 from fitbot import chat_store
+from fitbot import metrics
+from fitbot.history_cache import history_cache
+from fitbot import middleware
 from fitbot import chatbot as chatbot_logic
+from fitbot import prompt
+from fitbot import replies
+from fitbot import resumable
+from fitbot import session_bus
+from fitbot import streaming
+from fitbot import workouts
+from fitbot.scheduler import SchedulerBusy
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
@@ -18,79 +31,189 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(mess
 BASE_DIR = Path(__file__).resolve().parent.parent
 STATIC_DIR = BASE_DIR / "static"
 WELCOME_MESSAGE = "¡Hola! Soy FitBot, tu entrenador personal con IA. ¿En qué te puedo ayudar hoy?"
+BUSY_MESSAGE = "Hay muchas consultas en curso. Esperá unos segundos y volvé a intentar."
 MESSAGE_LIMIT = 4000
-MAX_HISTORY = 20
+# Con un valor > 0 la bienvenida sale antes de leer Redis y el historial llega después en
+# páginas de este tamaño, de la más reciente a la más vieja.
+WS_HISTORY_PAGE_SIZE = int(os.getenv("WS_HISTORY_PAGE_SIZE", "0"))
+HISTORY_PAGE_SIZE = 10
 _CLIENT_ID_RE = re.compile(r"^[a-z0-9_-]{1,64}$")
+CONTENT_SECURITY_POLICY = "; ".join(
+    [
+        "default-src 'self'",
+        "script-src 'self' https://cdn.jsdelivr.net 'unsafe-inline'",
+        "style-src 'self' https://cdn.jsdelivr.net 'unsafe-inline'",
+        "img-src 'self' data: https:",
+        "media-src 'self'",
+        "connect-src 'self' ws: wss: https:",
+    ]
+)
+
+static_assets = assets.AssetStore(STATIC_DIR)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    static_assets.load()
     try:
         await chat_store.init_db()
         logging.info("Base de datos inicializada")
     except Exception as exc:  
         logging.exception("No se pudo inicializar la DB de chats: %s", exc)
+    await chatbot_logic.startup()
+    if session_bus.WS_CLUSTER_MODE:
+        await manager.start_bus()
     try:
         yield
     finally:
+        with suppress(Exception):
+            await manager.close_bus()
+        with suppress(Exception):
+            await prompt.summarizer.drain()
+        with suppress(Exception):
+            await chatbot_logic.shutdown()
         with suppress(Exception):
             await chat_store.close()
 
 
 app = FastAPI(lifespan=lifespan)
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
-
-
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-        csp = "; ".join(
-            [
-                "default-src 'self'",
-                "script-src 'self' https://cdn.jsdelivr.net 'unsafe-inline'",
-                "style-src 'self' https://cdn.jsdelivr.net 'unsafe-inline'",
-                "img-src 'self' data: https:",
-                "media-src 'self'",
-                "connect-src 'self' ws: wss: https:",
-            ]
-        )
-        response.headers.setdefault("Content-Security-Policy", csp)
-        response.headers.setdefault("X-Content-Type-Options", "nosniff")
-        response.headers.setdefault("Referrer-Policy", "no-referrer")
-        return response
 
 
-app.add_middleware(SecurityHeadersMiddleware)
+app.add_middleware(
+    middleware.SecurityHeadersMiddleware,
+    headers=[
+        ("Content-Security-Policy", CONTENT_SECURITY_POLICY),
+        ("X-Content-Type-Options", "nosniff"),
+        ("Referrer-Policy", "no-referrer"),
+    ],
+)
 
 
 class ConnectionManager:
+    """Sockets y estado de conversación por ``client_id``.
+
+    Varias pestañas del mismo cliente comparten historial y reciben los mismos frames.
+    En modo cluster el estado de referencia vive en Redis y los frames se reparten al
+    resto de los nodos por pub/sub.
+    """
+
     def __init__(self) -> None:
-        self._histories: Dict[WebSocket, List[Dict[str, str]]] = {}
+        self._sockets: Dict[str, Set[WebSocket]] = {}
         self._client_ids: Dict[WebSocket, str] = {}
-
-    async def connect(self, websocket: WebSocket, client_id: str) -> None:
+        self._histories: Dict[str, List[Dict[str, str]]] = {}
+        self._summaries: Dict[str, str] = {}
+        self._profiles: Dict[str, str] = {}
+        # Sockets que se están poniendo al día y los frames en vivo que les llegaron mientras tanto.
+        self._held: Dict[WebSocket, List[str]] = {}
+        self.bus: Optional[session_bus.SessionBus] = None
+
+    async def start_bus(self) -> None:
+        self.bus = session_bus.SessionBus(self.deliver)
+        await self.bus.start()
+
+    async def close_bus(self) -> None:
+        if self.bus is not None:
+            await self.bus.close()
+            self.bus = None
+
+    async def connect(self, websocket: WebSocket, client_id: str, hold: bool = False) -> None:
         await websocket.accept()
+        if hold:
+            self.hold(websocket)
         self._client_ids[websocket] = client_id
-        self._histories[websocket] = []
+        sockets = self._sockets.setdefault(client_id, set())
+        sockets.add(websocket)
+        metrics.WS_SESSIONS.inc()
+        if len(sockets) == 1 and self.bus is not None:
+            await self.bus.subscribe(client_id)
+
+    async def disconnect(self, websocket: WebSocket) -> None:
+        self._held.pop(websocket, None)
+        client_id = self._client_ids.pop(websocket, None)
+        if client_id is None:
+            return
+        metrics.WS_SESSIONS.dec()
+        sockets = self._sockets.get(client_id, set())
+        sockets.discard(websocket)
+        if sockets:
+            return
+        self._sockets.pop(client_id, None)
+        self._histories.pop(client_id, None)
+        self._summaries.pop(client_id, None)
+        self._profiles.pop(client_id, None)
+        if self.bus is not None:
+            await self.bus.unsubscribe(client_id)
+
+    async def load_state(self, client_id: str) -> List[Dict[str, Any]]:
+        """Trae historial y resumen desde Redis; devuelve el historial completo guardado."""
+        stored_history, stored_summary, _ = await asyncio.gather(
+            chat_store.get_history(client_id, limit=50),
+            chat_store.get_summary(client_id),
+            self.load_profile(client_id),
+        )
+        self._summaries[client_id] = stored_summary["text"]
+        self._histories[client_id] = prompt.drop_summarized(stored_history, stored_summary["last_digest"])
+        return stored_history
+
+    async def load_profile(self, client_id: str) -> Dict[str, Any]:
+        """Lee las estadísticas de entrenamiento y guarda su versión compacta para el prompt."""
+        try:
+            stats = await chat_store.get_workout_stats(client_id)
+        except Exception as exc:
+            logging.warning("No se pudieron leer las estadísticas de %s: %s", client_id, exc)
+            return {}
+        self._profiles[client_id] = workouts.format_profile(stats)
+        return stats
+
+    def profile(self, client_id: str) -> str:
+        return self._profiles.get(client_id, "")
 
-    def disconnect(self, websocket: WebSocket) -> None:
-        self._histories.pop(websocket, None)
-        self._client_ids.pop(websocket, None)
+    def set_history(self, client_id: str, messages: List[Dict[str, str]]) -> None:
+        self._histories[client_id] = list(messages)
 
-    def set_history(self, websocket: WebSocket, messages: List[Dict[str, str]]) -> None:
-        self._histories[websocket] = list(messages)
+    def history(self, client_id: str) -> List[Dict[str, str]]:
+        return self._histories.setdefault(client_id, [])
 
-    def history(self, websocket: WebSocket) -> List[Dict[str, str]]:
-        return self._histories.setdefault(websocket, [])
+    def summary(self, client_id: str) -> str:
+        return self._summaries.get(client_id, "")
 
-    def trim_history(self, websocket: WebSocket, limit: int = MAX_HISTORY) -> None:
-        history = self._histories.get(websocket)
-        if history is not None and len(history) > limit:
-            self._histories[websocket] = history[-limit:]
+    def set_summary(self, client_id: str, summary: str) -> None:
+        if client_id in self._sockets:
+            self._summaries[client_id] = summary
 
     async def send_json(self, websocket: WebSocket, payload: Dict) -> None:
         await websocket.send_json(payload)
 
+    def hold(self, websocket: WebSocket) -> None:
+        """Guarda los frames en vivo para ``websocket`` en lugar de enviarlos mientras se pone al día."""
+        self._held.setdefault(websocket, [])
+
+    def release(self, websocket: WebSocket) -> List[str]:
+        """Vuelve a enviarle frames en vivo y devuelve los que se guardaron mientras tanto."""
+        return self._held.pop(websocket, [])
+
+    async def deliver(self, client_id: str, frame: str, exclude: Optional[WebSocket] = None) -> None:
+        for websocket in list(self._sockets.get(client_id, ())):
+            if websocket is exclude:
+                continue
+            held = self._held.get(websocket)
+            if held is not None:
+                held.append(frame)
+            else:
+                # Una pestaña caída no debe cortar el envío a las demás.
+                with suppress(Exception):
+                    await websocket.send_text(frame)
+
+    async def broadcast(self, client_id: str, payload: Dict, exclude: Optional[WebSocket] = None) -> None:
+        """Envía ``payload`` a todos los sockets del cliente, en este nodo y en los demás."""
+        frame = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        await self.deliver(client_id, frame, exclude)
+        if self.bus is not None:
+            try:
+                await self.bus.publish(client_id, frame)
+            except Exception as exc:
+                logging.warning("No se pudo publicar el frame de %s: %s", client_id, exc)
+
 
 manager = ConnectionManager()
 
@@ -99,57 +222,266 @@ def _is_valid_client_id(client_id: str) -> bool:
     return bool(_CLIENT_ID_RE.match(client_id))
 
 
-def _build_prompt(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    return [{"role": "system", "content": chatbot_logic.SYSTEM_PROMPT}] + list(history)
+def _page_number(arg: str) -> int:
+    arg = arg.strip()
+    return max(1, int(arg)) if arg.isdigit() else 1
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """Epoch en segundos o fecha ISO 8601 (sin zona se toma UTC)."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _build_prompt(client_id: str) -> List[Dict[str, str]]:
+    history = manager.history(client_id)
+    plan = prompt.build_prompt(history, manager.summary(client_id), profile=manager.profile(client_id))
+    if plan.overflow:
+        manager.set_history(client_id, history[len(plan.overflow) :])
+
+        async def apply_summary(summary: str, last_digest: str) -> None:
+            manager.set_summary(client_id, summary)
+            await chat_store.set_summary(client_id, summary, last_digest)
+
+        # Con el bus el historial se recarga de Redis en cada turno y puede traer de vuelta
+        # turnos que el resumidor todavía no terminó de plegar: no se encolan dos veces.
+        overflow = prompt.drop_summarized(plan.overflow, prompt.summarizer.pending_digest(client_id))
+        prompt.summarizer.schedule(client_id, overflow, lambda: manager.summary(client_id), apply_summary)
+    return plan.messages
+
+
+async def _collect(deltas: AsyncIterator[str], chunks: List[str]) -> AsyncIterator[str]:
+    async for delta in deltas:
+        if delta:
+            chunks.append(delta)
+            yield delta
 
 
 async def _stream_assistant_reply(
     websocket: WebSocket,
     client_id: str,
+    user_message: str,
     prompt_messages: List[Dict[str, str]],
+    settings: streaming.FlushSettings,
 ) -> None:
     fallback = "No pude generar respuesta ahora. Intentá nuevamente."
     chunks: List[str] = []
-    try:
-        async for delta in chatbot_logic.astream_chat_completion(prompt_messages):
-            if not delta:
-                continue
-            chunks.append(delta)
-            await manager.send_json(websocket, {"type": "stream", "delta": delta})
-    except Exception as exc:
-        logging.error("Error generando respuesta para %s: %s", client_id, exc)
-        final_text = fallback
-    else:
-        final_text = "".join(chunks).strip() or fallback
+    frames = 0
+    log = await resumable.streams.open(client_id, user_message, write_through=manager.bus is not None)
+    final_text = ""
 
-    history = manager.history(websocket)
-    history.append({"role": "assistant", "content": final_text})
-    manager.trim_history(websocket)
+    async def notify_queue(position: int) -> None:
+        await manager.broadcast(client_id, {"type": "queue", "position": position})
 
+    # El log se cierra pase lo que pase (también si cancelan la tarea): si no, queda en
+    # memoria y las pestañas que se reconectan esperan un final que nunca llega.
     try:
-        await chat_store.append_message(client_id, "assistant", final_text)
-    except Exception as exc:
-        logging.error("No se pudo guardar la respuesta para %s: %s", client_id, exc)
+        await manager.broadcast(client_id, {"type": "stream_start", "stream_id": log.stream_id})
+        try:
+            deltas = replies.stream_reply(client_id, prompt_messages, on_position=notify_queue)
+            async for batch in streaming.coalesce(_collect(deltas, chunks), settings):
+                frames += 1
+                seq = log.append(batch)
+                await manager.broadcast(
+                    client_id, {"type": "stream", "stream_id": log.stream_id, "delta": batch, "seq": seq}
+                )
+        except SchedulerBusy as exc:
+            logging.warning("Solicitud de %s rechazada por la cola: %s", client_id, exc)
+            metrics.FALLBACK_REPLIES.labels("ws", "busy").inc()
+            final_text = BUSY_MESSAGE
+        except Exception as exc:
+            logging.error("Error generando respuesta para %s: %s", client_id, exc)
+            metrics.FALLBACK_REPLIES.labels("ws", "error").inc()
+            final_text = fallback
+        else:
+            final_text = "".join(chunks).strip()
+            if not final_text:
+                metrics.FALLBACK_REPLIES.labels("ws", "empty").inc()
+                final_text = fallback
+        streaming.frame_stats.record(frames, len(chunks), sum(len(chunk) for chunk in chunks))
+
+        history = manager.history(client_id)
+        history.append({"role": "assistant", "content": final_text})
+
+        try:
+            await chat_store.append_messages(client_id, [("user", user_message), ("assistant", final_text)])
+            if manager.bus is not None:
+                # Redis es el estado de referencia: los otros nodos deben ver el turno ya.
+                await chat_store.flush(client_id)
+        except Exception as exc:
+            logging.error("No se pudo guardar el turno de %s: %s", client_id, exc)
+    finally:
+        await resumable.streams.finish(log, final_text or "".join(chunks).strip())
+    await manager.broadcast(client_id, {"type": "stream_end", "stream_id": log.stream_id, "content": final_text})
+
+
+async def _resume_stream(websocket: WebSocket, client_id: str, stream_id: str, offset: int) -> None:
+    """Envía lo que el cliente no vio de una respuesta en curso y lo vuelve a enganchar al vivo.
 
+    El socket llega retenido desde ``connect``: los frames en vivo de ese lapso se reenvían
+    después del ``stream_resume``, sin los fragmentos que este ya trae.
+    """
+    seq: Optional[int] = None
+    end: Optional[Dict[str, Any]] = None
     try:
-        await manager.send_json(websocket, {"type": "stream_end", "content": final_text})
-    except Exception:
-        pass
+        log = resumable.streams.get(stream_id)
+        if log is None:
+            seq = await _resume_remote_stream(websocket, client_id, stream_id, offset)
+        elif log.client_id != client_id or (log.done and not offset):
+            # Sin nada en pantalla, la respuesta terminada ya llega con el historial.
+            await manager.send_json(websocket, {"type": "stream_gone", "stream_id": stream_id})
+        else:
+            text, seq = await log.since(offset)
+            await manager.send_json(
+                websocket,
+                {"type": "stream_resume", "stream_id": stream_id, "prompt": log.prompt, "delta": text, "seq": seq},
+            )
+            if log.done:
+                end = {"type": "stream_end", "stream_id": stream_id, "content": log.final}
+    finally:
+        held = manager.release(websocket)
+    for frame in held:
+        payload = json.loads(frame)
+        if payload.get("stream_id") == stream_id:
+            # Sin seq la respuesta ya se dio por cerrada; si no, sobra lo que trajo stream_resume.
+            if seq is None or payload["type"] == "stream_start" or payload.get("seq", seq + 1) <= seq:
+                continue
+            if payload["type"] == "stream_end":
+                end = None
+        await websocket.send_text(frame)
+    if end is not None:
+        await manager.send_json(websocket, end)
+
+
+async def _resume_remote_stream(websocket: WebSocket, client_id: str, stream_id: str, offset: int) -> Optional[int]:
+    """Retoma una respuesta de otro nodo desde Redis; devuelve el seq enviado si sigue en curso."""
+    meta = None
+    with suppress(Exception):
+        meta = await chat_store.get_reply_stream(stream_id)
+    done = bool(meta) and meta.get("done") == "1"
+    if not meta or meta.get("client_id") != client_id or (done and not offset):
+        await manager.send_json(websocket, {"type": "stream_gone", "stream_id": stream_id})
+        return None
+    if done:
+        entries = await chat_store.read_reply_deltas(stream_id, 0)
+        content = "".join(delta for _, delta in entries).strip()
+        await manager.send_json(websocket, {"type": "stream_end", "stream_id": stream_id, "content": content})
+        return None
+    # La respuesta se genera en otro nodo: sus frames llegan por el bus y los que se
+    # guardaron mientras el socket estaba retenido se filtran según ``seq``.
+    entries = await chat_store.read_reply_deltas(stream_id, offset)
+    seq = entries[-1][0] if entries else offset
+    await manager.send_json(
+        websocket,
+        {
+            "type": "stream_resume",
+            "stream_id": stream_id,
+            "prompt": meta.get("prompt", ""),
+            "delta": "".join(delta for _, delta in entries),
+            "seq": seq,
+        },
+    )
+    return seq
+
+
+async def _send_history_pages(websocket: WebSocket, messages: List[Dict[str, Any]], page_size: int) -> None:
+    end = len(messages)
+    while end > 0:
+        start = max(0, end - page_size)
+        await manager.send_json(
+            websocket, {"type": "history_page", "messages": messages[start:end], "more": start > 0}
+        )
+        end = start
 
 
 @app.get("/", response_class=HTMLResponse)
-async def get_index() -> HTMLResponse:
-    index_path = STATIC_DIR / "index.html"
-    try:
-        with open(index_path, encoding="utf-8") as fh:
-            return HTMLResponse(content=fh.read(), status_code=200)
-    except FileNotFoundError:
+async def get_index(request: Request) -> Response:
+    index = static_assets.get("index.html")
+    if index is None:
         return HTMLResponse("<h1>FitBot</h1><p>Archivo index.html no encontrado.</p>", status_code=500)
+    return assets.asset_response(request, index, cache_control=assets.NO_CACHE)
+
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def get_static(request: Request, path: str) -> Response:
+    asset = static_assets.get(path)
+    if asset is None or path == "index.html":
+        return Response(status_code=404)
+    return assets.asset_response(request, asset)
 
 
 @app.get("/health")
 async def health() -> JSONResponse:
-    return JSONResponse({"status": "ok", "lm_client_available": chatbot_logic.is_client_available()})
+    payload = {
+        "status": "ok",
+        "lm_client_available": chatbot_logic.is_client_available(),
+        "lm_connections": chatbot_logic.connection_stats(),
+        "ws_stream": streaming.frame_stats.as_dict(),
+        "history_cache": history_cache.stats(),
+    }
+    if middleware.route_latency.enabled:
+        payload["http_latency"] = middleware.route_latency.summary()
+    return JSONResponse(payload)
+
+
+async def _paged_response(
+    fetch: Callable[..., Awaitable[chat_store.HistoryPage]],
+    client_id: str,
+    cursor: Optional[str],
+    limit: int,
+    since: Optional[str],
+    until: Optional[str],
+) -> JSONResponse:
+    if not _is_valid_client_id(client_id):
+        return JSONResponse({"detail": "client_id inválido"}, status_code=404)
+    try:
+        page = await fetch(client_id, cursor, limit, _parse_time(since), _parse_time(until))
+    except ValueError as exc:
+        return JSONResponse({"detail": str(exc) or "Parámetros inválidos"}, status_code=400)
+    return JSONResponse(page.as_dict())
+
+
+@app.get("/api/history/{client_id}")
+async def get_history_page(
+    client_id: str,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> JSONResponse:
+    return await _paged_response(chat_store.get_history_page, client_id, cursor, limit, since, until)
+
+
+@app.get("/api/workouts/{client_id}")
+async def get_workouts_page(
+    client_id: str,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> JSONResponse:
+    return await _paged_response(chat_store.get_workouts_page, client_id, cursor, limit, since, until)
+
+
+@app.get("/api/stats/{client_id}")
+async def get_stats(client_id: str) -> JSONResponse:
+    if not _is_valid_client_id(client_id):
+        return JSONResponse({"detail": "client_id inválido"}, status_code=404)
+    return JSONResponse(await chat_store.get_workout_stats(client_id))
+
+
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
 
 
 @app.websocket("/ws/{client_id}")
@@ -158,21 +490,32 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str) -> None:
         await websocket.close(code=1008)
         return
 
-    await manager.connect(websocket, client_id)
+    # Al retomar una respuesta, los frames en vivo esperan a que el cliente se ponga al día.
+    resume_id = websocket.query_params.get("resume")
+    await manager.connect(websocket, client_id, hold=bool(resume_id))
     logging.info("Nuevo cliente conectado: %s", client_id)
+    settings = streaming.negotiate(websocket.query_params)
+    await manager.send_json(websocket, {"type": "stream_config", **settings.as_dict()})
 
     await chat_store.upsert_session(client_id)
-    stored_history = await chat_store.get_history(client_id, limit=50)
-    if stored_history:
-        manager.set_history(websocket, stored_history)
-        await manager.send_json(websocket, {"type": "history", "messages": stored_history})
-
-    await manager.send_json(
-        websocket,
-        {"type": "message", "role": "assistant", "content": WELCOME_MESSAGE},
-    )
+    welcome = {"type": "message", "role": "assistant", "content": WELCOME_MESSAGE}
+    if WS_HISTORY_PAGE_SIZE > 0:
+        await manager.send_json(websocket, welcome)
+        stored_history = await manager.load_state(client_id)
+        await _send_history_pages(websocket, stored_history, WS_HISTORY_PAGE_SIZE)
+    else:
+        stored_history = await manager.load_state(client_id)
+        if stored_history:
+            await manager.send_json(websocket, {"type": "history", "messages": stored_history})
+        await manager.send_json(websocket, welcome)
 
+    # Cursores de /history por número de página, para no releer las anteriores.
+    workout_cursors: Dict[int, Optional[str]] = {}
     try:
+        if resume_id:
+            offset = websocket.query_params.get("offset", "0")
+            await _resume_stream(websocket, client_id, resume_id, int(offset) if offset.isdigit() else 0)
+
         while True:
             user_message = (await websocket.receive_text()).strip()
             if not user_message:
@@ -193,6 +536,8 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str) -> None:
                 entry = user_message[5:].strip()
                 if entry:
                     await chat_store.log_workout(client_id, entry)
+                    workout_cursors.clear()
+                    await manager.load_profile(client_id)
                     await manager.send_json(
                         websocket,
                         {
@@ -213,20 +558,37 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str) -> None:
                 continue
 
             if user_message.startswith("/history"):
-                workouts = await chat_store.get_workouts(client_id, limit=10)
-                if not workouts:
-                    msg = "No tenés registros aún. Usá /log para agregar."
+                page = _page_number(user_message[len("/history") :])
+                result = await chat_store.page_at(
+                    lambda cursor: chat_store.get_workouts_page(client_id, cursor, limit=HISTORY_PAGE_SIZE),
+                    page,
+                    workout_cursors,
+                )
+                if not result.items:
+                    msg = "No tenés registros aún. Usá /log para agregar." if page == 1 else "No hay más registros."
                 else:
-                    lines = ["Últimos registros:"] + [f"- {w['created_at']}: {w['entry']}" for w in workouts]
+                    title = "Últimos registros:" if page == 1 else f"Registros (página {page}):"
+                    lines = [title] + [f"- {w['created_at']}: {w['entry']}" for w in result.items]
+                    if result.next_cursor:
+                        lines.append(f"Usá /history {page + 1} para ver más.")
                     msg = "\n".join(lines)
                 await manager.send_json(
                     websocket, {"type": "message", "role": "assistant", "content": msg}
                 )
                 continue
 
+            if user_message == "/stats":
+                stats = await manager.load_profile(client_id)
+                await manager.send_json(
+                    websocket, {"type": "message", "role": "assistant", "content": workouts.format_stats(stats)}
+                )
+                continue
+
             if user_message.startswith("/reset"):
+                prompt.summarizer.discard(client_id)
                 await chat_store.clear_history(client_id)
-                manager.set_history(websocket, [])
+                manager.set_history(client_id, [])
+                manager.set_summary(client_id, "")
                 await manager.send_json(
                     websocket, {"type": "message", "role": "assistant", "content": "Conversación borrada."}
                 )
@@ -236,16 +598,14 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str) -> None:
                 )
                 continue
 
-            history = manager.history(websocket)
-            history.append({"role": "user", "content": user_message})
-            manager.trim_history(websocket)
-            try:
-                await chat_store.append_message(client_id, "user", user_message)
-            except Exception as exc:
-                logging.error("No se pudo guardar el mensaje del usuario %s: %s", client_id, exc)
-
-            prompt_messages = _build_prompt(history)
-            await _stream_assistant_reply(websocket, client_id, prompt_messages)
+            if manager.bus is not None:
+                await manager.load_state(client_id)
+            manager.history(client_id).append({"role": "user", "content": user_message})
+            await manager.broadcast(
+                client_id, {"type": "message", "role": "user", "content": user_message}, exclude=websocket
+            )
+            prompt_messages = _build_prompt(client_id)
+            await _stream_assistant_reply(websocket, client_id, user_message, prompt_messages, settings)
 
     except WebSocketDisconnect:
         logging.info("Cliente %s desconectado.", client_id)
@@ -261,4 +621,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str) -> None:
                 },
             )
     finally:
-        manager.disconnect(websocket)
+        with suppress(Exception):
+            await manager.disconnect(websocket)
+        with suppress(Exception):
+            await chat_store.flush(client_id)
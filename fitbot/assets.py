@@ -0,0 +1,167 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional; sin él solo se ofrece gzip.
+    brotli = None
+
+STATIC_COMPRESS_MIN = int(os.getenv("STATIC_COMPRESS_MIN", "512"))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+# Referencias a /static/<archivo> (con o sin ?v=...) dentro de index.html.
+_STATIC_REF_RE = re.compile(r"/static/([A-Za-z0-9_.\-/]+?)(\?v=[^\"'\s>]*)?(?=[\"'\s>])")
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+NO_CACHE = "no-cache"
+IMMUTABLE = f"public, max-age={STATIC_MAX_AGE}, immutable"
+
+
+@dataclass
+class Asset:
+    """Un archivo estático en memoria con sus variantes comprimidas y su ETag fuerte."""
+
+    content: bytes
+    media_type: str
+    digest: str
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def version(self) -> str:
+        return self.digest[:12]
+
+    def etag(self, encoding: str = "identity") -> str:
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        return f'"{self.digest[:32]}{suffix}"'
+
+
+def _compress(content: bytes, media_type: str) -> Dict[str, bytes]:
+    if len(content) < STATIC_COMPRESS_MIN or not media_type.startswith(_COMPRESSIBLE):
+        return {}
+    variants = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(content, quality=11)
+    # Solo vale la pena si la variante efectivamente es más chica.
+    return {name: body for name, body in variants.items() if len(body) < len(content)}
+
+
+def _make_asset(content: bytes, name: str) -> Asset:
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type == "application/javascript":
+        media_type += "; charset=utf-8"
+    return Asset(
+        content=content,
+        media_type=media_type,
+        digest=hashlib.sha256(content).hexdigest(),
+        variants=_compress(content, media_type),
+    )
+
+
+class AssetStore:
+    """Carga ``static/`` en memoria una sola vez y sirve cada archivo desde ahí."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._assets: Dict[str, Asset] = {}
+        self._loaded = False
+
+    def load(self) -> None:
+        assets: Dict[str, Asset] = {}
+        for path in sorted(self.directory.rglob("*")):
+            if path.is_file():
+                name = path.relative_to(self.directory).as_posix()
+                assets[name] = _make_asset(path.read_bytes(), name)
+        index = assets.pop("index.html", None)
+        if index is not None:
+            # index.html apunta a las versiones con huella, que se pueden cachear como inmutables.
+            html = _STATIC_REF_RE.sub(lambda m: self._fingerprint(assets, m), index.content.decode("utf-8-sig"))
+            assets["index.html"] = _make_asset(html.encode("utf-8"), "index.html")
+        self._assets = assets
+        self._loaded = True
+        size = sum(len(asset.content) for asset in assets.values())
+        logging.info("Assets estáticos en memoria: %s archivos, %s KiB", len(assets), size // 1024)
+
+    @staticmethod
+    def _fingerprint(assets: Dict[str, Asset], match: "re.Match[str]") -> str:
+        asset = assets.get(match.group(1))
+        if asset is None:
+            return match.group(0)
+        return f"/static/{match.group(1)}?v={asset.version}"
+
+    def get(self, name: str) -> Optional[Asset]:
+        if not self._loaded:
+            self.load()
+        return self._assets.get(name)
+
+
+def _pick_encoding(asset: Asset, accept_encoding: str) -> str:
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    for encoding in ("br", "gzip"):
+        if encoding in asset.variants and encoding in accepted:
+            return encoding
+    return "identity"
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Interpreta un único rango ``bytes=a-b``; devuelve None si no es satisfacible."""
+    match = _RANGE_RE.match(header.strip())
+    if match is None or size == 0:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def asset_response(request: Request, asset: Asset, cache_control: Optional[str] = None) -> Response:
+    """Respuesta con ETag, 304 condicional, compresión negociada y rangos de bytes."""
+    if cache_control is None:
+        cache_control = IMMUTABLE if request.query_params.get("v") == asset.version else NO_CACHE
+    headers = {"Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if asset.variants:
+        headers["Vary"] = "Accept-Encoding"
+
+    encoding = _pick_encoding(asset, request.headers.get("accept-encoding", ""))
+    headers["ETag"] = asset.etag(encoding)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or {asset.etag(name) for name in ("identity", *asset.variants)} & tags:
+            return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == asset.etag()):
+        headers["ETag"] = asset.etag()
+        size = len(asset.content)
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        body = asset.content if (start, end) == (0, size - 1) else asset.content[start : end + 1]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(body, status_code=206, headers=headers, media_type=asset.media_type)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], headers=headers, media_type=asset.media_type)
+    return Response(asset.content, headers=headers, media_type=asset.media_type)
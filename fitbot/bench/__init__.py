@@ -0,0 +1 @@
+"""Herramientas de benchmark: LLM falso local y generadores de carga WebSocket/TCP."""
@@ -0,0 +1,6 @@
+import sys
+
+from fitbot.bench.load import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,496 @@
+"""Genera carga contra FitBot por WebSocket o TCP y reporta latencias.
+
+Uso:
+    python -m fitbot.bench ws --clients 50 --turns 3
+    python -m fitbot.bench tcp --clients 50 --workers 4 --redis-url redis://localhost:6379/0
+    python -m fitbot.bench tcp-json --clients 50
+
+Sin ``--redis-url`` el servidor corre en este mismo proceso sobre fakeredis, así que
+alcanza con Python para correrlo en CI. Con ``--redis-url`` (o ``--workers`` > 1) se
+lanza como subproceso contra ese Redis.
+"""
+
+import argparse
+import asyncio
+import codecs
+import json
+import logging
+import math
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fitbot.bench.mock_llm import MOCK_MODEL, MockSettings, create_app
+
+_BOT_TAG = "🤖 FitBot"
+_TCP_READY = ("modo invitado activado", "¡bienvenido", "ya podés empezar a chatear")
+# Variables que ``run`` ajusta para apuntar al mock; se restauran al terminar.
+_BENCH_ENV = (
+    "AI_BASE_URL",
+    "AI_API_KEY",
+    "AI_MODEL",
+    "AI_HTTP2",
+    "AI_RPM_LIMIT",
+    "AI_TPM_LIMIT",
+    "TCP_MAX_CONN_PER_IP",
+    "TCP_MSG_RATE",
+    "REDIS_URL",
+)
+
+
+@dataclass
+class TurnSample:
+    ttft: Optional[float]
+    total: float
+    ok: bool
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentil por rango más cercano; 0 si no hay datos."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+@dataclass
+class BenchReport:
+    samples: List[TurnSample] = field(default_factory=list)
+    elapsed: float = 0.0
+    redis_ops: Optional[int] = None
+    redis_ops_source: str = ""
+    connect_errors: int = 0
+
+    def summary(self) -> Dict[str, Any]:
+        ok = [sample for sample in self.samples if sample.ok]
+        ttft = [sample.ttft * 1000 for sample in ok if sample.ttft is not None]
+        total = [sample.total * 1000 for sample in ok]
+        turns = len(self.samples)
+        result: Dict[str, Any] = {
+            "turns": turns,
+            "errors": turns - len(ok),
+            "connect_errors": self.connect_errors,
+            "elapsed_s": round(self.elapsed, 3),
+            "turns_per_s": round(len(ok) / self.elapsed, 2) if self.elapsed else 0.0,
+        }
+        for name, values in (("ttft", ttft), ("e2e", total)):
+            for q in (0.50, 0.95, 0.99):
+                result[f"{name}_p{int(q * 100)}_ms"] = round(percentile(values, q), 1)
+        if self.redis_ops is not None and turns:
+            result["redis_ops_per_turn"] = round(self.redis_ops / turns, 2)
+            result["redis_ops_source"] = self.redis_ops_source
+        return result
+
+
+async def ws_client(base_url: str, index: int, turns: int, think: float, report: BenchReport) -> None:
+    import websockets
+
+    url = f"{base_url}/ws/bench-{index}-{secrets.token_hex(3)}"
+    try:
+        socket_ = await websockets.connect(url, max_size=None)
+    except Exception:
+        report.connect_errors += 1
+        return
+    try:
+        # stream_config, historial y bienvenida: se espera al primer mensaje del asistente.
+        while True:
+            frame = json.loads(await socket_.recv())
+            if frame.get("type") == "message":
+                break
+        for turn in range(turns):
+            started = time.monotonic()
+            first: Optional[float] = None
+            ok = False
+            await socket_.send(f"Cliente {index}, turno {turn}: armame una rutina de piernas")
+            while True:
+                frame = json.loads(await socket_.recv())
+                kind = frame.get("type")
+                if kind == "stream" and first is None:
+                    first = time.monotonic() - started
+                elif kind == "stream_end":
+                    ok = first is not None
+                    break
+                elif kind == "message" and frame.get("role") == "assistant":
+                    break
+            report.samples.append(TurnSample(first, time.monotonic() - started, ok))
+            if think:
+                await asyncio.sleep(think)
+    except websockets.ConnectionClosed:
+        report.connect_errors += 1
+    finally:
+        await socket_.close()
+
+
+async def _read_until(reader: asyncio.StreamReader, predicate: Callable[[str], bool]) -> str:
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("El servidor cerró la conexión")
+        text = line.decode("utf-8", errors="replace")
+        if predicate(text):
+            return text
+
+
+async def _read_tcp_reply(reader: asyncio.StreamReader) -> Tuple[float, str]:
+    """Lee una respuesta transmitida; devuelve el instante del primer fragmento y el texto.
+
+    El mock responde en una sola línea, así que el primer salto tras la etiqueta la cierra.
+    """
+    buffer = ""
+    first: Optional[float] = None
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = await reader.read(4096)
+        if not data:
+            raise ConnectionError("El servidor cerró la conexión")
+        buffer += decoder.decode(data)
+        start = buffer.find(_BOT_TAG)
+        if start < 0:
+            continue
+        if first is None:
+            first = time.monotonic()
+        end = buffer.find("\n", start)
+        if end >= 0:
+            return first, buffer[start:end]
+
+
+async def tcp_client(host: str, port: int, index: int, turns: int, think: float, report: BenchReport) -> None:
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        report.connect_errors += 1
+        return
+    try:
+        # Usuario registrado: el historial se guarda en Redis como en una sesión real.
+        writer.write(f"/register bench{secrets.token_hex(4)}{index} clave\n".encode())
+        await writer.drain()
+        await _read_until(reader, lambda text: any(marker in text.lower() for marker in _TCP_READY))
+        for turn in range(turns):
+            started = time.monotonic()
+            writer.write(f"Cliente {index}, turno {turn}: armame una rutina de piernas\n".encode())
+            await writer.drain()
+            first, reply = await _read_tcp_reply(reader)
+            report.samples.append(TurnSample(first - started, time.monotonic() - started, "No pude generar" not in reply))
+            if think:
+                await asyncio.sleep(think)
+        writer.write(b"/quit\n")
+        await writer.drain()
+        # Se espera a que el servidor cierre para no cortarle la despedida.
+        while await reader.read(4096):
+            pass
+    except (ConnectionError, OSError):
+        report.connect_errors += 1
+    finally:
+        writer.close()
+        with suppress(Exception):
+            await writer.wait_closed()
+
+
+async def tcp_json_client(host: str, port: int, index: int, turns: int, think: float, report: BenchReport) -> None:
+    """Cliente del protocolo de frames JSON: sin ANSI ni detección de texto."""
+    from fitbot.tcp import client, protocol
+
+    try:
+        reader, writer = await client.open_framed(host, port)
+    except (ConnectionError, OSError):
+        report.connect_errors += 1
+        return
+    try:
+        username = f"bench{secrets.token_hex(4)}{index}"
+        writer.write(protocol.encode({"id": 0, "op": "register", "username": username, "password": "clave"}))
+        await writer.drain()
+        if not protocol.decode(await reader.readline()).get("ok"):
+            raise ConnectionError("Registro rechazado")
+        for turn in range(1, turns + 1):
+            started = time.monotonic()
+            first: Optional[float] = None
+            text = f"Cliente {index}, turno {turn}: armame una rutina de piernas"
+            writer.write(protocol.encode({"id": turn, "op": "chat", "text": text}))
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("El servidor cerró la conexión")
+                frame = protocol.decode(line)
+                if frame.get("type") == "delta" and first is None:
+                    first = time.monotonic() - started
+                elif frame.get("type") in {"done", "error"}:
+                    break
+            report.samples.append(TurnSample(first, time.monotonic() - started, frame["type"] == "done"))
+            if think:
+                await asyncio.sleep(think)
+        writer.write(protocol.encode({"id": turns + 1, "op": "quit"}))
+        await writer.drain()
+        while await reader.read(4096):
+            pass
+    except (ConnectionError, OSError):
+        report.connect_errors += 1
+    finally:
+        writer.close()
+        with suppress(Exception):
+            await writer.wait_closed()
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def _wait_port(host: str, port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Nada escucha en {host}:{port}")
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return
+
+
+async def _serve_uvicorn(app: Any, port: int, **kwargs: Any) -> Callable[[], Awaitable[None]]:
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", **kwargs))
+    task = asyncio.create_task(server.serve())
+    await _wait_port("127.0.0.1", port)
+
+    async def stop() -> None:
+        server.should_exit = True
+        await task
+
+    return stop
+
+
+def _chat_store_ops() -> int:
+    """Operaciones de chat_store contadas por las métricas del proceso."""
+    from prometheus_client import REGISTRY
+
+    total = 0
+    for metric in REGISTRY.collect():
+        if metric.name == "fitbot_redis_op_seconds":
+            total += sum(int(sample.value) for sample in metric.samples if sample.name.endswith("_count"))
+    return total
+
+
+async def _redis_commands(url: str) -> int:
+    import redis.asyncio as redis
+
+    client = redis.from_url(url)
+    try:
+        return int((await client.info("stats"))["total_commands_processed"])
+    finally:
+        await client.aclose()
+
+
+def _swap(module: Any, values: Dict[str, Any]) -> Callable[[], None]:
+    """Reemplaza atributos de ``module`` y devuelve la función que los restaura."""
+    previous = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+
+    def restore() -> None:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+    return restore
+
+
+async def _start_in_process(target: str, port: int) -> Callable[[], Awaitable[None]]:
+    """Levanta la app o el servidor TCP en este proceso, con fakeredis."""
+    import fakeredis.aioredis
+
+    from fitbot import chat_store, chatbot, scheduler
+    from fitbot.tcp import flow, server as tcp_server
+
+    # Estos módulos leen el entorno al importarse; si ya estaban importados, los valores
+    # del entorno no les llegan y se reemplazan acá (y se restauran al terminar).
+    restores = [
+        _swap(
+            chatbot,
+            {
+                "AI_BASE_URL": os.environ["AI_BASE_URL"],
+                "AI_API_KEY": os.environ["AI_API_KEY"],
+                "AI_MODEL": os.environ["AI_MODEL"],
+            },
+        ),
+        _swap(
+            scheduler.llm_scheduler,
+            {
+                "requests": scheduler.TokenBucket(int(os.environ["AI_RPM_LIMIT"])),
+                "tokens": scheduler.TokenBucket(int(os.environ["AI_TPM_LIMIT"])),
+            },
+        ),
+        _swap(
+            tcp_server,
+            {
+                "connection_limiter": flow.ConnectionLimiter(int(os.environ["TCP_MAX_CONN_PER_IP"])),
+                "message_limiter": flow.RateLimiter(float(os.environ["TCP_MSG_RATE"])),
+            },
+        ),
+    ]
+    await chat_store.init_db(client=fakeredis.aioredis.FakeRedis(decode_responses=True))
+    await chatbot.startup()
+    await chatbot.model_registry.refresh()
+    if target == "ws":
+        from fitbot.app import app
+
+        stop_server = await _serve_uvicorn(app, port, lifespan="off")
+    else:
+        server = await asyncio.start_server(tcp_server.handle_client, host="127.0.0.1", port=port)
+
+        async def stop_server() -> None:
+            server.close()
+            await server.wait_closed()
+
+    async def stop() -> None:
+        try:
+            await stop_server()
+            await chatbot.shutdown()
+            await chat_store.close()
+        finally:
+            for restore in restores:
+                restore()
+            # El registro de modelos quedó resuelto contra el mock.
+            chatbot.model_registry.invalidate()
+
+    return stop
+
+
+async def _start_subprocess(target: str, port: int, workers: int) -> Callable[[], Awaitable[None]]:
+    if target == "ws":
+        command = ["-m", "uvicorn", "fitbot.app:app", "--host", "127.0.0.1", "--port", str(port)]
+        command += ["--workers", str(workers), "--log-level", "warning"]
+    else:
+        command = ["-m", "fitbot.tcp.server", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    process = subprocess.Popen([sys.executable, *command], env=os.environ.copy())
+    try:
+        await _wait_port("127.0.0.1", port)
+    except TimeoutError:
+        process.kill()
+        raise
+
+    async def stop() -> None:
+        process.terminate()
+        with suppress(subprocess.TimeoutExpired):
+            await asyncio.to_thread(process.wait, 10)
+        if process.poll() is None:
+            process.kill()
+
+    return stop
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    mock_port = _free_port()
+    settings = MockSettings(args.tokens_per_sec, args.first_token_ms, args.error_rate, args.reply_tokens)
+    saved_env = {name: os.environ.get(name) for name in _BENCH_ENV}
+    os.environ.update(
+        {
+            "AI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+            "AI_API_KEY": "bench",
+            "AI_MODEL": MOCK_MODEL,
+            "AI_HTTP2": "0",
+        }
+    )
+    # Todos los clientes salen de 127.0.0.1: los límites por IP del servidor TCP no aplican acá.
+    os.environ.setdefault("TCP_MAX_CONN_PER_IP", "0")
+    os.environ.setdefault("TCP_MSG_RATE", "0")
+    # El mock no tiene cuota por minuto; exportalas para emular la de un proveedor real.
+    os.environ.setdefault("AI_RPM_LIMIT", "1000000")
+    os.environ.setdefault("AI_TPM_LIMIT", "1000000000")
+    in_process = not args.redis_url and args.workers <= 1
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    report = BenchReport()
+    try:
+        await _run_against_mock(args, settings, mock_port, in_process, report)
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return report.summary()
+
+
+async def _run_against_mock(
+    args: argparse.Namespace, settings: MockSettings, mock_port: int, in_process: bool, report: "BenchReport"
+) -> None:
+    stop_mock = await _serve_uvicorn(create_app(settings), mock_port)
+    port = args.port or _free_port()
+    try:
+        if in_process:
+            stop_target = await _start_in_process(args.target, port)
+        else:
+            if not args.redis_url:
+                raise SystemExit("Con --workers > 1 hace falta --redis-url: fakeredis no se comparte entre procesos")
+            stop_target = await _start_subprocess(args.target, port, args.workers)
+        try:
+            ops_before = await _redis_commands(args.redis_url) if args.redis_url else _chat_store_ops()
+            started = time.monotonic()
+            think = args.think_ms / 1000
+            if args.target == "tcp-json":
+                clients = [
+                    tcp_json_client("127.0.0.1", port, index, args.turns, think, report) for index in range(args.clients)
+                ]
+            elif args.target == "ws":
+                clients = [
+                    ws_client(f"ws://127.0.0.1:{port}", index, args.turns, think, report) for index in range(args.clients)
+                ]
+            else:
+                clients = [tcp_client("127.0.0.1", port, index, args.turns, think, report) for index in range(args.clients)]
+            await asyncio.gather(*clients)
+            report.elapsed = time.monotonic() - started
+            if args.redis_url:
+                report.redis_ops = await _redis_commands(args.redis_url) - ops_before
+                report.redis_ops_source = "redis_commands"
+            else:
+                report.redis_ops = _chat_store_ops() - ops_before
+                report.redis_ops_source = "chat_store_ops"
+        finally:
+            await stop_target()
+    finally:
+        await stop_mock()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark de carga de FitBot con un LLM falso local")
+    parser.add_argument("target", choices=["ws", "tcp", "tcp-json"], help="Transporte a medir")
+    parser.add_argument("--clients", type=int, default=20, help="Clientes concurrentes (default: %(default)s)")
+    parser.add_argument("--turns", type=int, default=3, help="Mensajes por cliente (default: %(default)s)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pausa entre mensajes de un cliente")
+    parser.add_argument("--workers", type=int, default=1, help="Workers del servidor (requiere --redis-url)")
+    parser.add_argument("--redis-url", default="", help="Redis real; sin esto se usa fakeredis en proceso")
+    parser.add_argument("--port", type=int, default=0, help="Puerto del servidor bajo prueba (default: libre)")
+    parser.add_argument("--tokens-per-sec", type=float, default=MockSettings.tokens_per_sec)
+    parser.add_argument("--first-token-ms", type=float, default=MockSettings.first_token_ms)
+    parser.add_argument("--error-rate", type=float, default=MockSettings.error_rate)
+    parser.add_argument("--reply-tokens", type=int, default=MockSettings.reply_tokens)
+    parser.add_argument("--json", default="", help="Además de imprimirlo, guarda el reporte en este archivo")
+    parser.add_argument("--max-p99-ms", type=float, default=0.0, help="Falla (exit 1) si el p99 e2e lo supera")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    args = build_parser().parse_args(argv)
+    summary = asyncio.run(run(args))
+    text = json.dumps(summary, indent=2, ensure_ascii=False)
+    print(text)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    if args.max_p99_ms and summary["e2e_p99_ms"] > args.max_p99_ms:
+        logging.error("p99 e2e %.1f ms supera el límite de %.1f ms", summary["e2e_p99_ms"], args.max_p99_ms)
+        return 1
+    return 1 if summary["errors"] or summary["connect_errors"] else 0
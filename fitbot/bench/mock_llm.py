@@ -0,0 +1,133 @@
+"""Servidor local compatible con la API de OpenAI para benchmarks, sin red ni claves.
+
+Uso: python -m fitbot.bench.mock_llm --port 8100 --tokens-per-sec 80 --first-token-ms 300
+y luego ``AI_BASE_URL=http://127.0.0.1:8100/v1 AI_API_KEY=bench``.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+MOCK_MODEL = "mock-fitbot"
+_WORDS = (
+    "Para empezar hacé una entrada en calor de diez minutos. Después trabajá sentadillas, "
+    "zancadas y peso muerto rumano en tres series de diez a doce repeticiones, descansando "
+    "noventa segundos entre series. Terminá con movilidad de cadera y estiramientos suaves."
+).split()
+
+
+@dataclass
+class MockSettings:
+    tokens_per_sec: float = 80.0
+    first_token_ms: float = 300.0
+    error_rate: float = 0.0
+    reply_tokens: int = 60
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    errors: int = 0
+    streamed_tokens: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"requests": self.requests, "errors": self.errors, "streamed_tokens": self.streamed_tokens}
+
+
+def _token(index: int) -> str:
+    return ("" if index == 0 else " ") + _WORDS[index % len(_WORDS)]
+
+
+def _chunk(completion_id: str, content: str, finish_reason: object = None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": MOCK_MODEL,
+        "choices": [{"index": 0, "delta": {"content": content} if content else {}, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def create_app(settings: MockSettings) -> Starlette:
+    stats = MockStats()
+
+    async def models(request: Request) -> Response:
+        return JSONResponse({"object": "list", "data": [{"id": MOCK_MODEL, "object": "model", "owned_by": "bench"}]})
+
+    async def stream_tokens(completion_id: str, count: int) -> AsyncIterator[str]:
+        await asyncio.sleep(settings.first_token_ms / 1000)
+        # Los tokens salen a ritmo fijo desde el primero, sin acumular el atraso de cada sleep.
+        started = time.monotonic()
+        for index in range(count):
+            delay = started + index / settings.tokens_per_sec - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            stats.streamed_tokens += 1
+            yield _chunk(completion_id, _token(index))
+        yield _chunk(completion_id, "", "stop")
+        yield "data: [DONE]\n\n"
+
+    async def completions(request: Request) -> Response:
+        body = await request.json()
+        stats.requests += 1
+        if random.random() < settings.error_rate:
+            stats.errors += 1
+            return JSONResponse({"error": {"message": "error simulado", "type": "server_error"}}, status_code=500)
+        count = max(1, min(settings.reply_tokens, int(body.get("max_tokens") or settings.reply_tokens)))
+        completion_id = f"chatcmpl-{stats.requests}"
+        if body.get("stream"):
+            return StreamingResponse(stream_tokens(completion_id, count), media_type="text/event-stream")
+        await asyncio.sleep(settings.first_token_ms / 1000 + count / settings.tokens_per_sec)
+        text = "".join(_token(index) for index in range(count))
+        return JSONResponse(
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": MOCK_MODEL,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": count, "total_tokens": count},
+            }
+        )
+
+    async def get_stats(request: Request) -> Response:
+        return JSONResponse(stats.as_dict())
+
+    app = Starlette(
+        routes=[
+            Route("/v1/models", models),
+            Route("/v1/chat/completions", completions, methods=["POST"]),
+            Route("/stats", get_stats),
+        ]
+    )
+    app.state.stats = stats
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="LLM falso compatible con OpenAI para benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--tokens-per-sec", type=float, default=MockSettings.tokens_per_sec)
+    parser.add_argument("--first-token-ms", type=float, default=MockSettings.first_token_ms)
+    parser.add_argument("--error-rate", type=float, default=MockSettings.error_rate)
+    parser.add_argument("--reply-tokens", type=int, default=MockSettings.reply_tokens)
+    args = parser.parse_args()
+    settings = MockSettings(args.tokens_per_sec, args.first_token_ms, args.error_rate, args.reply_tokens)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,486 @@
+import asyncio
 import json
+import logging
 import os
+import re
 import secrets
+import time
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 
 import redis.asyncio as redis
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+from fitbot import codec
+from fitbot import metrics
+from fitbot import workouts
+from fitbot.history_cache import history_cache
+from fitbot.redis_pool import REDIS_HASH_TAGS, REDIS_URL, RedisConnector
+
+CHAT_HISTORY_MAX = int(os.getenv("CHAT_HISTORY_MAX", "500"))
+CHAT_WORKOUTS_MAX = int(os.getenv("CHAT_WORKOUTS_MAX", "2000"))
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", str(90 * 24 * 3600)))
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "1").lower() in {"1", "true", "yes", "on"}
+CHAT_FLUSH_SIZE = int(os.getenv("CHAT_FLUSH_SIZE", "64"))
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "0.05"))
+CHAT_BUFFER_MAX_PENDING = int(os.getenv("CHAT_BUFFER_MAX_PENDING", "10000"))
+# Largo de los streams que indexan mensajes y entrenamientos para paginar (0 = sin índice).
+CHAT_LOG_MAX = int(os.getenv("CHAT_LOG_MAX", "10000"))
+CHAT_PAGE_MAX = int(os.getenv("CHAT_PAGE_MAX", "100"))
 
 _SESSIONS_KEY = "fitbot:sessions"
 _USERS_KEY = "fitbot:users"
 _MESSAGES_KEY_FMT = "fitbot:session:{client_id}:messages"
 _WORKOUTS_KEY_FMT = "fitbot:session:{client_id}:workouts"
+_SUMMARY_KEY_FMT = "fitbot:session:{client_id}:summary"
+_VERSION_KEY_FMT = "fitbot:session:{client_id}:version"
+_MESSAGES_LOG_KEY_FMT = "fitbot:session:{client_id}:messages:log"
+_WORKOUTS_LOG_KEY_FMT = "fitbot:session:{client_id}:workouts:log"
+_STATS_KEY_FMT = "fitbot:session:{client_id}:stats"
+_STATS_WEEKLY_KEY_FMT = "fitbot:session:{client_id}:stats:weekly"
+_STATS_RECORDS_KEY_FMT = "fitbot:session:{client_id}:stats:pr:{kind}"
+_RECORD_KINDS = ("weight", "reps", "duration")
+_STATS_WEEKS = 4
+_STATS_TOP_RECORDS = 5
 _USER_KEY_FMT = "fitbot:user:{username}"
+_REPLY_CACHE_KEY_FMT = "fitbot:cache:reply:{digest}"
+_REPLY_CACHE_INDEX_KEY = "fitbot:cache:replies"
+_REPLY_STREAM_KEY_FMT = "fitbot:stream:{stream_id}"
+_REPLY_STREAM_META_KEY_FMT = "fitbot:stream:{stream_id}:meta"
+
+_CURSOR_RE = re.compile(r"^\d+-\d+$")
 
 _redis: Optional[redis.Redis] = None
+_connector: Optional[RedisConnector] = None
+_buffer: Optional["WriteBehindBuffer"] = None
+_codec: Any = codec.JsonCodec()
+_text_client_warned = False
+
+
+def _session_tag(client_id: str) -> str:
+    # Con hash tags todas las claves de la sesión caen en el mismo slot del Cluster.
+    return f"{{{client_id}}}" if REDIS_HASH_TAGS else client_id
 
 
 def _messages_key(client_id: str) -> str:
-    return _MESSAGES_KEY_FMT.format(client_id=client_id)
+    return _MESSAGES_KEY_FMT.format(client_id=_session_tag(client_id))
 
 
 def _workouts_key(client_id: str) -> str:
-    return _WORKOUTS_KEY_FMT.format(client_id=client_id)
+    return _WORKOUTS_KEY_FMT.format(client_id=_session_tag(client_id))
+
+
+def _summary_key(client_id: str) -> str:
+    return _SUMMARY_KEY_FMT.format(client_id=_session_tag(client_id))
+
+
+def _messages_log_key(client_id: str) -> str:
+    return _MESSAGES_LOG_KEY_FMT.format(client_id=_session_tag(client_id))
+
+
+def _workouts_log_key(client_id: str) -> str:
+    return _WORKOUTS_LOG_KEY_FMT.format(client_id=_session_tag(client_id))
+
+
+def _stats_keys(client_id: str) -> Tuple[str, str, Dict[str, str]]:
+    tag = _session_tag(client_id)
+    records = {kind: _STATS_RECORDS_KEY_FMT.format(client_id=tag, kind=kind) for kind in _RECORD_KINDS}
+    return _STATS_KEY_FMT.format(client_id=tag), _STATS_WEEKLY_KEY_FMT.format(client_id=tag), records
+
+
+def _version_key(client_id: str) -> str:
+    return _VERSION_KEY_FMT.format(client_id=_session_tag(client_id))
 
 
 def _user_key(username: str) -> str:
     return _USER_KEY_FMT.format(username=username)
 
 
+def _reply_cache_key(digest: str) -> str:
+    return _REPLY_CACHE_KEY_FMT.format(digest=digest)
+
+
+def _reply_stream_keys(stream_id: str) -> Tuple[str, str]:
+    tag = _session_tag(stream_id)
+    return _REPLY_STREAM_KEY_FMT.format(stream_id=tag), _REPLY_STREAM_META_KEY_FMT.format(stream_id=tag)
+
+
 def _utc_now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def _text(value: Any) -> str:
+    """Normaliza lecturas de texto: con un codec binario el cliente devuelve bytes."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value or ""
+
+
+def _decodes_responses(conn: Any) -> bool:
+    with suppress(Exception):
+        return bool(conn.get_encoder().decode_responses)
+    return True
+
+
+def _select_codec(conn: Any) -> Any:
+    global _text_client_warned
+    selected = codec.configured_codec()
+    if selected.binary and _decodes_responses(conn):
+        # ``_codec_for`` lo consulta en cada escritura con un cliente explícito: se avisa una vez.
+        if not _text_client_warned:
+            logging.warning("El cliente Redis decodifica respuestas como texto; chat_store usa JSON")
+            _text_client_warned = True
+        return codec.JsonCodec()
+    return selected
+
+
+@dataclass
+class _PendingWrites:
+    session: bool = False
+    messages: List[codec.Raw] = field(default_factory=list)
+    workouts: List[codec.Raw] = field(default_factory=list)
+
+    def size(self) -> int:
+        return len(self.messages) + len(self.workouts) + int(self.session)
+
+
+def _queue_list_writes(pipe: Any, key: str, payloads: List[codec.Raw], max_len: int, ttl: int) -> None:
+    if not payloads:
+        return
+    pipe.rpush(key, *payloads)
+    if max_len > 0:
+        pipe.ltrim(key, -max_len, -1)
+    if ttl > 0:
+        pipe.expire(key, ttl)
+
+
+def _queue_log_writes(pipe: Any, key: str, payloads: List[codec.Raw], ttl: int) -> None:
+    """Copia las entradas al stream que sirve de índice: el id (ms-seq) es el cursor y la marca de tiempo."""
+    if not payloads or CHAT_LOG_MAX <= 0:
+        return
+    for payload in payloads:
+        pipe.xadd(key, {"p": payload}, maxlen=CHAT_LOG_MAX, approximate=True)
+    if ttl > 0:
+        pipe.expire(key, ttl)
+
+
+def _queue_pending(pipe: Any, client_id: str, pending: _PendingWrites) -> None:
+    if pending.session:
+        pipe.sadd(_SESSIONS_KEY, client_id)
+    _queue_list_writes(pipe, _messages_key(client_id), pending.messages, CHAT_HISTORY_MAX, CHAT_SESSION_TTL)
+    if pending.messages:
+        # La versión cuenta mensajes agregados y se sube *después* del RPUSH: quien lea
+        # la versión antes que la lista nunca asocia una lista vieja a una versión nueva.
+        pipe.incrby(_version_key(client_id), len(pending.messages))
+        if CHAT_SESSION_TTL > 0:
+            pipe.expire(_version_key(client_id), CHAT_SESSION_TTL)
+    _queue_list_writes(pipe, _workouts_key(client_id), pending.workouts, CHAT_WORKOUTS_MAX, 0)
+    _queue_log_writes(pipe, _messages_log_key(client_id), pending.messages, CHAT_SESSION_TTL)
+    _queue_log_writes(pipe, _workouts_log_key(client_id), pending.workouts, 0)
+
+
+class WriteBehindBuffer:
+    """Agrupa escrituras por client_id y las vuelca en pipelines por tamaño o por tiempo."""
+
+    def __init__(self, flush_size: Optional[int] = None, flush_interval: Optional[float] = None) -> None:
+        self.flush_size = max(1, CHAT_FLUSH_SIZE if flush_size is None else flush_size)
+        self.flush_interval = CHAT_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._pending: Dict[str, _PendingWrites] = {}
+        self._size = 0
+        # Un lock por client_id: solo se serializan los volcados y lecturas de una misma
+        # sesión (para no reordenar sus escrituras), no los de todo el proceso.
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    def pending(self) -> int:
+        return self._size
+
+    def add(
+        self,
+        client_id: str,
+        *,
+        session: bool = False,
+        messages: Iterable[codec.Raw] = (),
+        workouts: Iterable[codec.Raw] = (),
+    ) -> None:
+        entry = self._pending.setdefault(client_id, _PendingWrites())
+        before = entry.size()
+        entry.session = entry.session or session
+        entry.messages.extend(messages)
+        entry.workouts.extend(workouts)
+        self._size += entry.size() - before
+        if self._size >= self.flush_size:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._spawn_flush)
+
+    def discard_messages(self, client_id: str) -> None:
+        entry = self._pending.get(client_id)
+        if entry is not None:
+            self._size -= len(entry.messages)
+            entry.messages.clear()
+
+    def _spawn_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take(self, client_ids: Iterable[str]) -> Dict[str, _PendingWrites]:
+        taken = {}
+        for client_id in client_ids:
+            entry = self._pending.pop(client_id, None)
+            if entry is not None:
+                taken[client_id] = entry
+        self._size -= sum(entry.size() for entry in taken.values())
+        return taken
+
+    def _restore(self, taken: Dict[str, _PendingWrites]) -> None:
+        for client_id, entry in taken.items():
+            if self._size >= CHAT_BUFFER_MAX_PENDING:
+                logging.error("Buffer de escritura lleno; se descartan %s entradas de %s", entry.size(), client_id)
+                continue
+            current = self._pending.get(client_id)
+            if current is not None:
+                entry.session = entry.session or current.session
+                entry.messages.extend(current.messages)
+                entry.workouts.extend(current.workouts)
+                self._size -= current.size()
+            self._pending[client_id] = entry
+            self._size += entry.size()
+        if self._pending and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(max(self.flush_interval, 1.0), self._spawn_flush)
+
+    async def execute(
+        self,
+        client_id: Optional[str] = None,
+        reads: Optional[Callable[[Any], None]] = None,
+    ) -> List[Any]:
+        """Vuelca lo pendiente (de ``client_id`` o de todos) y, en el mismo pipeline, encola ``reads``.
+
+        Devuelve solo los resultados de las lecturas.
+        """
+        conn = _require_client()
+        client_ids = sorted(self._pending) if client_id is None else [client_id]
+        async with self._locked(client_ids):
+            taken = self._take(client_ids)
+            async with conn.pipeline(transaction=False) as pipe:
+                for pending_id, entry in taken.items():
+                    _queue_pending(pipe, pending_id, entry)
+                writes = len(pipe)
+                if reads is not None:
+                    reads(pipe)
+                if not len(pipe):
+                    return []
+                try:
+                    results = await pipe.execute()
+                except Exception:
+                    self._restore(taken)
+                    raise
+        return results[writes:]
+
+    @asynccontextmanager
+    async def _locked(self, client_ids: List[str]) -> AsyncIterator[None]:
+        # Siempre en el mismo orden (ids ordenados) para que dos volcados no se bloqueen entre sí.
+        locks = []
+        for client_id in client_ids:
+            self._lock_users[client_id] = self._lock_users.get(client_id, 0) + 1
+            locks.append(self._locks.setdefault(client_id, asyncio.Lock()))
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in acquired:
+                lock.release()
+            for client_id in client_ids:
+                users = self._lock_users[client_id] - 1
+                if users:
+                    self._lock_users[client_id] = users
+                else:
+                    del self._lock_users[client_id]
+                    del self._locks[client_id]
+
+    async def flush(self, client_id: Optional[str] = None) -> None:
+        try:
+            await self.execute(client_id)
+        except Exception as exc:
+            logging.error("No se pudieron volcar las escrituras pendientes a Redis: %s", exc)
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+
 async def init_db(url: Optional[str] = None, client: Optional[redis.Redis] = None) -> None:
-    global _redis
+    """Configura la conexión global.
+
+    Si Redis no responde se lanza la excepción, pero el conector queda activo y
+    reintenta en segundo plano: no hace falta reiniciar el proceso.
+    """
+    global _redis, _buffer, _connector, _codec
+    _buffer = WriteBehindBuffer() if CHAT_WRITE_BEHIND else None
+    history_cache.clear()
     if client is not None:
         _redis = client
+        _connector = None
+        _codec = _select_codec(client)
         return
 
-    redis_url = url or REDIS_URL
-    _redis = redis.from_url(redis_url, encoding="utf-8", decode_responses=True)
-    await _redis.ping()
+    _connector = RedisConnector(url or REDIS_URL, decode_responses=not codec.configured_codec().binary)
+    _redis = _connector.client
+    _codec = _select_codec(_redis)
+    ok = await _connector.ping()
+    _connector.start()
+    if not ok:
+        raise RuntimeError("Redis no respondió al iniciar; se reintentará en segundo plano")
+
+
+@metrics.redis_timed("flush")
+async def flush(client_id: Optional[str] = None) -> None:
+    """Fuerza el volcado de las escrituras pendientes (p. ej. al desconectarse un cliente)."""
+    if _buffer is not None and _redis is not None:
+        await _buffer.flush(client_id)
 
 
 async def close() -> None:
-    global _redis
+    global _redis, _buffer, _connector
+    if _buffer is not None and _redis is not None:
+        await _buffer.close()
+    _buffer = None
     if _redis is not None:
         try:
-            await _redis.close()
+            if _connector is not None:
+                await _connector.close()
+            else:
+                await _redis.close()
         finally:
             _redis = None
+            _connector = None
 
 
 def _require_client(client: Optional[redis.Redis] = None) -> redis.Redis:
     conn = client or _redis
     if conn is None:
         raise RuntimeError("Redis no inicializado. Llamá chat_store.init_db() en el arranque.")
+    if client is None and _connector is not None:
+        _connector.check_available()
     return conn
 
 
+def _buffered(client: Optional[redis.Redis]) -> Optional[WriteBehindBuffer]:
+    """El buffer solo aplica a la conexión global; un ``client`` explícito escribe directo."""
+    if client is None and _redis is not None:
+        return _buffer
+    return None
+
+
+async def _write_now(conn: redis.Redis, client_id: str, pending: _PendingWrites) -> None:
+    async with conn.pipeline(transaction=False) as pipe:
+        _queue_pending(pipe, client_id, pending)
+        await pipe.execute()
+
+
+async def _run_after_flush(client_id: str, client: Optional[redis.Redis], reads: Callable[[Any], None]) -> List[Any]:
+    """Ejecuta comandos después de volcar lo pendiente del cliente, en un único pipeline."""
+    buffer = _buffered(client)
+    if buffer is not None:
+        return await buffer.execute(client_id, reads)
+    conn = _require_client(client)
+    async with conn.pipeline(transaction=False) as pipe:
+        reads(pipe)
+        return await pipe.execute()
+
+
+def _version(raw: Any) -> int:
+    return int(_text(raw) or 0)
+
+
+def _codec_for(client: Optional[redis.Redis]) -> Any:
+    return _codec if client is None or client is _redis else _select_codec(client)
+
+
+@metrics.redis_timed("upsert_session")
 async def upsert_session(client_id: str, client: Optional[redis.Redis] = None) -> None:
+    buffer = _buffered(client)
+    if buffer is not None:
+        buffer.add(client_id, session=True)
+        return
     conn = _require_client(client)
     await conn.sadd(_SESSIONS_KEY, client_id)
 
 
+@metrics.redis_timed("append_messages")
+async def append_messages(
+    client_id: str,
+    messages: Iterable[Tuple[str, str]],
+    client: Optional[redis.Redis] = None,
+) -> None:
+    encoder, now = _codec_for(client), int(time.time())
+    payloads = [encoder.encode_message(role, content, now) for role, content in messages]
+    if not payloads:
+        return
+    if client is None:
+        history_cache.append(
+            client_id, [{"role": role, "content": content} for role, content in messages], CHAT_HISTORY_MAX
+        )
+    buffer = _buffered(client)
+    if buffer is not None:
+        buffer.add(client_id, messages=payloads)
+        return
+    await _write_now(_require_client(client), client_id, _PendingWrites(messages=payloads))
+
+
 async def append_message(
     client_id: str,
     role: str,
     content: str,
     client: Optional[redis.Redis] = None,
 ) -> None:
-    conn = _require_client(client)
-    payload = json.dumps(
-        {
-            "role": role,
-            "content": content,
-            "created_at": _utc_now(),
-        }
-    )
-    await conn.rpush(_messages_key(client_id), payload)
+    await append_messages(client_id, [(role, content)], client=client)
 
 
+@metrics.redis_timed("get_history")
 async def get_history(
     client_id: str,
     limit: int = 50,
     client: Optional[redis.Redis] = None,
 ) -> List[Dict[str, Any]]:
-    conn = _require_client(client)
-    raw_messages = await conn.lrange(_messages_key(client_id), -limit, -1)
-    history: List[Dict[str, Any]] = []
-    for raw in raw_messages:
-        try:
-            entry = json.loads(raw)
-        except json.JSONDecodeError:
-            continue
-        history.append({"role": entry.get("role", "assistant"), "content": entry.get("content", "")})
-    return history
-
-
+    """Últimos ``limit`` mensajes; con la conexión global usa ``history_cache`` si la versión no cambió."""
+    cache = history_cache if client is None and history_cache.enabled else None
+    entry = cache.lookup(client_id, limit) if cache is not None else None
+    if entry is not None:
+        (version,) = await _run_after_flush(client_id, client, lambda pipe: pipe.get(_version_key(client_id)))
+        if _version(version) == entry.version:
+            cache.hits += 1
+            return [dict(message) for message in entry.messages[-limit:]]
+
+    fetch = max(limit, cache.max_entries) if cache is not None else limit
+
+    def reads(pipe: Any) -> None:
+        pipe.get(_version_key(client_id))
+        pipe.lrange(_messages_key(client_id), -fetch, -1)
+
+    version, raw_messages = await _run_after_flush(client_id, client, reads)
+    messages = [{"role": entry["role"], "content": entry["content"]} for entry in codec.decode_messages(raw_messages)]
+    if cache is not None:
+        cache.misses += 1
+        cache.store(client_id, _version(version), messages, complete=len(messages) < fetch)
+    return [dict(message) for message in messages[-limit:]]
+
+
+@metrics.redis_timed("register_user")
 async def register_user(
     username: str,
     password_hash: str,
@@ -130,6 +512,7 @@ async def register_user(
     return assigned_client_id
 
 
+@metrics.redis_timed("get_user")
 async def get_user(username: str, client: Optional[redis.Redis] = None) -> Optional[Dict[str, Any]]:
     conn = _require_client(client)
     raw = await conn.get(_user_key(username))
@@ -142,34 +525,383 @@ async def get_user(username: str, client: Optional[redis.Redis] = None) -> Optio
     return data
 
 
+@metrics.redis_timed("clear_history")
 async def clear_history(client_id: str, client: Optional[redis.Redis] = None) -> None:
+    history_cache.discard(client_id)
+    buffer = _buffered(client)
+    if buffer is not None:
+        buffer.discard_messages(client_id)
+
+    def writes(pipe: Any) -> None:
+        pipe.delete(_messages_key(client_id), _messages_log_key(client_id), _summary_key(client_id))
+        pipe.incr(_version_key(client_id))
+
+    await _run_after_flush(client_id, client, writes)
+
+
+@metrics.redis_timed("get_summary")
+async def get_summary(client_id: str, client: Optional[redis.Redis] = None) -> Dict[str, str]:
     conn = _require_client(client)
-    await conn.delete(_messages_key(client_id))
+    data = {_text(key): _text(value) for key, value in (await conn.hgetall(_summary_key(client_id))).items()}
+    return {"text": data.get("text", ""), "last_digest": data.get("last_digest", "")}
+
+
+@metrics.redis_timed("set_summary")
+async def set_summary(
+    client_id: str,
+    text: str,
+    last_digest: str,
+    client: Optional[redis.Redis] = None,
+) -> None:
+    conn = _require_client(client)
+    key = _summary_key(client_id)
+    async with conn.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping={"text": text, "last_digest": last_digest, "updated_at": _utc_now()})
+        if CHAT_SESSION_TTL > 0:
+            pipe.expire(key, CHAT_SESSION_TTL)
+        await pipe.execute()
+
+
+@metrics.redis_timed("log_workouts")
+async def log_workouts(client_id: str, entries: Iterable[str], client: Optional[redis.Redis] = None) -> None:
+    """Guarda las entradas y actualiza en el momento los agregados que lee ``get_workout_stats``."""
+    entries = list(entries)
+    encoder, now = _codec_for(client), int(time.time())
+    payloads = [encoder.encode_workout(entry, now) for entry in entries]
+    if not payloads:
+        return
+    buffer = _buffered(client)
+    if buffer is not None:
+        buffer.add(client_id, workouts=payloads)
+    else:
+        await _write_now(_require_client(client), client_id, _PendingWrites(workouts=payloads))
+    try:
+        records = [workouts.parse(entry) for entry in entries]
+        await _update_workout_stats(_require_client(client), client_id, records, now)
+    except Exception as exc:
+        logging.error("No se pudieron actualizar las estadísticas de %s: %s", client_id, exc)
 
 
 async def log_workout(client_id: str, entry: str, client: Optional[redis.Redis] = None) -> None:
+    await log_workouts(client_id, [entry], client=client)
+
+
+# Aplica un lote de registros a los agregados en un solo paso atómico. La racha depende
+# del último día guardado (misma regla que ``workouts.next_streak``); en Lua no hace
+# falta WATCH/MULTI, que RedisCluster no soporta. Todas las claves comparten hash tag.
+# KEYS: stats, weekly, récords de weight, reps y duration.
+# ARGV: day, now, week, workouts, sets, reps, duration_s, volume_kg, distance_km y
+# luego ternas (tipo de récord 1-3, ejercicio, valor).
+_STATS_SCRIPT = """
+local day = tonumber(ARGV[1])
+local stats = KEYS[1]
+local state = redis.call('HMGET', stats, 'last_day', 'streak', 'best_streak')
+local last_day = tonumber(state[1]) or 0
+local streak = tonumber(state[2]) or 0
+local best = tonumber(state[3]) or 0
+if day == last_day + 1 then
+    streak = streak + 1
+elseif day > last_day then
+    streak = 1
+end
+if day > last_day then
+    last_day = day
+    best = math.max(best, streak)
+end
+redis.call('HINCRBY', stats, 'workouts', ARGV[4])
+redis.call('HINCRBY', stats, 'sets', ARGV[5])
+redis.call('HINCRBY', stats, 'reps', ARGV[6])
+redis.call('HINCRBY', stats, 'duration_s', ARGV[7])
+redis.call('HINCRBYFLOAT', stats, 'volume_kg', ARGV[8])
+redis.call('HINCRBYFLOAT', stats, 'distance_km', ARGV[9])
+redis.call('HSET', stats, 'last_day', last_day, 'streak', streak, 'best_streak', best, 'last_at', ARGV[2])
+redis.call('HINCRBYFLOAT', KEYS[2], ARGV[3] .. ':volume_kg', ARGV[8])
+redis.call('HINCRBY', KEYS[2], ARGV[3] .. ':workouts', ARGV[4])
+for i = 10, #ARGV, 3 do
+    redis.call('ZADD', KEYS[2 + tonumber(ARGV[i])], 'GT', ARGV[i + 2], ARGV[i + 1])
+end
+return streak
+"""
+
+
+async def _update_workout_stats(
+    conn: redis.Redis, client_id: str, records: List[workouts.WorkoutRecord], now: int
+) -> None:
+    """Suma los registros a los agregados de la sesión con un script Lua atómico."""
+    if not records:
+        return
+    stats_key, weekly_key, record_keys = _stats_keys(client_id)
+    day = workouts.local_day(now)
+    args: List[Any] = [
+        day,
+        now,
+        workouts.week_key(day),
+        len(records),
+        sum(record.sets for record in records),
+        sum(record.total_reps for record in records),
+        sum(record.duration_s for record in records),
+        repr(float(sum(record.volume_kg for record in records))),
+        repr(float(sum(record.distance_km for record in records))),
+    ]
+    for record in records:
+        for index, value in enumerate((record.weight_kg, record.reps, record.duration_s), start=1):
+            if value:
+                args.extend((index, record.exercise, value))
+    keys = [stats_key, weekly_key, *(record_keys[kind] for kind in _RECORD_KINDS)]
+    await conn.register_script(_STATS_SCRIPT)(keys=keys, args=args)
+
+
+@metrics.redis_timed("get_workout_stats")
+async def get_workout_stats(client_id: str, client: Optional[redis.Redis] = None) -> Dict[str, Any]:
+    """Agregados precalculados: una lectura de tamaño acotado, sin recorrer el registro."""
     conn = _require_client(client)
-    payload = json.dumps({"entry": entry, "created_at": _utc_now()})
-    await conn.rpush(_workouts_key(client_id), payload)
+    stats_key, weekly_key, record_keys = _stats_keys(client_id)
+    weeks = workouts.recent_weeks(workouts.current_day(), _STATS_WEEKS)
+    fields = [f"{week}:{name}" for week in weeks for name in ("volume_kg", "workouts")]
+    async with conn.pipeline(transaction=False) as pipe:
+        pipe.hgetall(stats_key)
+        pipe.hmget(weekly_key, fields)
+        for kind in _RECORD_KINDS:
+            pipe.zrevrange(record_keys[kind], 0, _STATS_TOP_RECORDS - 1, withscores=True)
+        raw_stats, weekly, *tops = await pipe.execute()
+
+    data = {_text(key): _text(value) for key, value in raw_stats.items()}
+
+    def number(name: str) -> float:
+        return float(data.get(name) or 0)
+
+    streak = int(number("streak"))
+    if workouts.current_day() - int(number("last_day")) > 1:
+        streak = 0  # pasó más de un día sin registrar: la racha se cortó
+    return {
+        "workouts": int(number("workouts")),
+        "sets": int(number("sets")),
+        "reps": int(number("reps")),
+        "volume_kg": round(number("volume_kg"), 2),
+        "duration_s": int(number("duration_s")),
+        "distance_km": round(number("distance_km"), 2),
+        "streak": streak,
+        "best_streak": int(number("best_streak")),
+        "last_at": datetime.fromtimestamp(number("last_at"), timezone.utc).isoformat() if data.get("last_at") else None,
+        "weeks": [
+            {
+                "week": week,
+                "volume_kg": round(float(_text(weekly[2 * index]) or 0), 2),
+                "workouts": int(_text(weekly[2 * index + 1]) or 0),
+            }
+            for index, week in enumerate(weeks)
+        ],
+        "records": {
+            kind: [{"exercise": _text(member), "value": score} for member, score in top]
+            for kind, top in zip(_RECORD_KINDS, tops)
+        },
+    }
 
 
+@metrics.redis_timed("get_workouts")
 async def get_workouts(
     client_id: str,
     limit: int = 10,
     client: Optional[redis.Redis] = None,
 ) -> List[Dict[str, Any]]:
+    (raw_entries,) = await _run_after_flush(
+        client_id, client, lambda pipe: pipe.lrange(_workouts_key(client_id), -limit, -1)
+    )
+    return codec.decode_workouts(raw_entries)
+
+
+@dataclass
+class HistoryPage:
+    """Una página en orden cronológico; ``next_cursor`` apunta a las entradas más viejas."""
+
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"items": self.items, "next_cursor": self.next_cursor}
+
+
+def _stream_bound(ts: Optional[float], default: str) -> str:
+    # Un id sin secuencia cubre todo el milisegundo: "-0" como mínimo y el máximo como tope.
+    return default if ts is None else str(max(0, int(ts * 1000)))
+
+
+async def _read_log_page(
+    client_id: str,
+    key: str,
+    decode: Callable[[List[codec.Raw]], List[Dict[str, Any]]],
+    cursor: Optional[str],
+    limit: int,
+    since: Optional[float],
+    until: Optional[float],
+    client: Optional[redis.Redis],
+) -> HistoryPage:
+    if cursor is not None and not _CURSOR_RE.match(cursor):
+        raise ValueError("Cursor inválido")
+    limit = max(1, min(limit, CHAT_PAGE_MAX))
+    upper = f"({cursor}" if cursor else _stream_bound(until, "+")
+    lower = _stream_bound(since, "-")
+    # Se pide una entrada de más para saber si queda otra página sin hacer otra consulta.
+    (entries,) = await _run_after_flush(
+        client_id, client, lambda pipe: pipe.xrevrange(key, max=upper, min=lower, count=limit + 1)
+    )
+    more = len(entries) > limit
+    entries = entries[:limit]
+    items: List[Dict[str, Any]] = []
+    for entry_id, fields in reversed(entries):
+        raw = fields.get("p", fields.get(b"p"))
+        decoded = decode([raw]) if raw is not None else []
+        if decoded:
+            items.append({"id": _text(entry_id), **decoded[0]})
+    next_cursor = _text(entries[-1][0]) if more and entries else None
+    return HistoryPage(items, next_cursor)
+
+
+@metrics.redis_timed("get_history_page")
+async def get_history_page(
+    client_id: str,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    client: Optional[redis.Redis] = None,
+) -> HistoryPage:
+    """Mensajes de la sesión de a páginas, del más nuevo al más viejo.
+
+    ``since``/``until`` son epoch en segundos; ``cursor`` es el ``next_cursor`` de la página anterior.
+    """
+    return await _read_log_page(
+        client_id, _messages_log_key(client_id), codec.decode_messages, cursor, limit, since, until, client
+    )
+
+
+@metrics.redis_timed("get_workouts_page")
+async def get_workouts_page(
+    client_id: str,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    client: Optional[redis.Redis] = None,
+) -> HistoryPage:
+    return await _read_log_page(
+        client_id, _workouts_log_key(client_id), codec.decode_workouts, cursor, limit, since, until, client
+    )
+
+
+async def page_at(
+    fetch: Callable[[Optional[str]], Awaitable[HistoryPage]],
+    page: int,
+    cursors: Dict[int, Optional[str]],
+) -> HistoryPage:
+    """Página ``page`` (desde 1) siguiendo cursores; ``cursors`` guarda los ya vistos entre llamadas."""
+    number = max((known for known in cursors if known <= page), default=1)
+    current = await fetch(cursors.get(number))
+    while number < page:
+        if current.next_cursor is None:
+            return HistoryPage([])
+        number += 1
+        cursors[number] = current.next_cursor
+        current = await fetch(current.next_cursor)
+    return current
+
+
+@metrics.redis_timed("get_cached_reply")
+async def get_cached_reply(digest: str, client: Optional[redis.Redis] = None) -> Optional[str]:
     conn = _require_client(client)
-    raw_entries = await conn.lrange(_workouts_key(client_id), -limit, -1)
-    workouts: List[Dict[str, Any]] = []
-    for raw in raw_entries:
-        try:
-            entry = json.loads(raw)
-        except json.JSONDecodeError:
-            continue
-        workouts.append(
-            {
-                "entry": entry.get("entry", ""),
-                "created_at": entry.get("created_at"),
-            }
-        )
-    return workouts
+    async with conn.pipeline(transaction=False) as pipe:
+        pipe.get(_reply_cache_key(digest))
+        # Solo refresca la marca LRU si la entrada sigue indexada.
+        pipe.zadd(_REPLY_CACHE_INDEX_KEY, {digest: time.time()}, xx=True)
+        cached, _ = await pipe.execute()
+    return _text(cached) or None
+
+
+@metrics.redis_timed("store_cached_reply")
+async def store_cached_reply(
+    digest: str,
+    content: str,
+    ttl: int,
+    max_entries: int,
+    client: Optional[redis.Redis] = None,
+) -> None:
+    conn = _require_client(client)
+    now = time.time()
+    async with conn.pipeline(transaction=False) as pipe:
+        pipe.set(_reply_cache_key(digest), content, ex=ttl)
+        pipe.zadd(_REPLY_CACHE_INDEX_KEY, {digest: now})
+        pipe.zremrangebyscore(_REPLY_CACHE_INDEX_KEY, "-inf", now - ttl)
+        pipe.zcard(_REPLY_CACHE_INDEX_KEY)
+        *_, size = await pipe.execute()
+
+    overflow = size - max_entries
+    if overflow > 0:
+        evicted = await conn.zpopmin(_REPLY_CACHE_INDEX_KEY, overflow)
+        if evicted:
+            await conn.delete(*(_reply_cache_key(_text(member)) for member, _ in evicted))
+
+
+@metrics.redis_timed("start_reply_stream")
+async def start_reply_stream(
+    stream_id: str,
+    client_id: str,
+    prompt: str,
+    ttl: int,
+    client: Optional[redis.Redis] = None,
+) -> None:
+    conn = _require_client(client)
+    _, meta_key = _reply_stream_keys(stream_id)
+    async with conn.pipeline(transaction=False) as pipe:
+        pipe.hset(meta_key, mapping={"client_id": client_id, "prompt": prompt, "done": "0"})
+        pipe.expire(meta_key, ttl)
+        await pipe.execute()
+
+
+@metrics.redis_timed("append_reply_deltas")
+async def append_reply_deltas(
+    stream_id: str,
+    entries: Iterable[Tuple[int, str]],
+    ttl: int,
+    client: Optional[redis.Redis] = None,
+) -> None:
+    """Agrega fragmentos numerados al stream de Redis; el id de cada entrada es ``0-<seq>``."""
+    conn = _require_client(client)
+    key, _ = _reply_stream_keys(stream_id)
+    async with conn.pipeline(transaction=False) as pipe:
+        for seq, delta in entries:
+            pipe.xadd(key, {"d": delta}, id=f"0-{seq}")
+        pipe.expire(key, ttl)
+        await pipe.execute()
+
+
+@metrics.redis_timed("read_reply_deltas")
+async def read_reply_deltas(
+    stream_id: str,
+    after_seq: int,
+    client: Optional[redis.Redis] = None,
+) -> List[Tuple[int, str]]:
+    conn = _require_client(client)
+    key, _ = _reply_stream_keys(stream_id)
+    entries = await conn.xrange(key, min=f"0-{after_seq + 1}")
+    deltas = []
+    for entry_id, fields in entries:
+        data = {_text(name): _text(value) for name, value in fields.items()}
+        deltas.append((int(_text(entry_id).split("-", 1)[1]), data.get("d", "")))
+    return deltas
+
+
+@metrics.redis_timed("get_reply_stream")
+async def get_reply_stream(stream_id: str, client: Optional[redis.Redis] = None) -> Optional[Dict[str, str]]:
+    conn = _require_client(client)
+    _, meta_key = _reply_stream_keys(stream_id)
+    data = await conn.hgetall(meta_key)
+    if not data:
+        return None
+    return {_text(name): _text(value) for name, value in data.items()}
+
+
+@metrics.redis_timed("finish_reply_stream")
+async def finish_reply_stream(stream_id: str, client: Optional[redis.Redis] = None) -> None:
+    conn = _require_client(client)
+    _, meta_key = _reply_stream_keys(stream_id)
+    await conn.hset(meta_key, "done", "1")
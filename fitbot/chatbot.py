@@ -1,11 +1,19 @@
+import asyncio
+import importlib.util
 import logging
 import os
+import random
 import time
+from collections import deque
 from contextlib import suppress
-from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
 
+import httpx
 from dotenv import load_dotenv
-from openai import AsyncOpenAI, OpenAI
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+
+from fitbot import metrics
 
 load_dotenv()
 
@@ -27,6 +35,18 @@ AI_TEMPERATURE = float(os.getenv("AI_TEMPERATURE") or os.getenv("LM_TEMPERATURE"
 AI_MAX_TOKENS = int(os.getenv("AI_MAX_TOKENS") or os.getenv("LM_MAX_TOKENS", "1500"))
 AI_CLIENT_TIMEOUT = float(os.getenv("AI_CLIENT_TIMEOUT") or os.getenv("LM_CLIENT_TIMEOUT", "120.0"))
 CLIENT_CHECK_TTL = float(os.getenv("AI_CLIENT_CHECK_TTL") or os.getenv("LM_CLIENT_CHECK_TTL", "10.0"))
+AI_MODELS_REFRESH_INTERVAL = float(os.getenv("AI_MODELS_REFRESH_INTERVAL", "60.0"))
+AI_POOL_MAX_CONNECTIONS = int(os.getenv("AI_POOL_MAX_CONNECTIONS", "100"))
+AI_POOL_MAX_KEEPALIVE = int(os.getenv("AI_POOL_MAX_KEEPALIVE", "20"))
+AI_POOL_KEEPALIVE_EXPIRY = float(os.getenv("AI_POOL_KEEPALIVE_EXPIRY", "60.0"))
+AI_HTTP2 = os.getenv("AI_HTTP2", "1").lower() in {"1", "true", "yes", "on"}
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.25"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "4.0"))
+AI_MODEL_COOLDOWN = float(os.getenv("AI_MODEL_COOLDOWN", "30.0"))
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "0").lower() in {"1", "true", "yes", "on"}
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "1.5"))
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "0.95"))
 
 SYSTEM_PROMPT = """
 Eres 'FitBot', un Entrenador Personal virtual. Tu tono es motivador, amigable y profesional.
@@ -47,11 +67,74 @@ No respondas a temas fuera de fitness, salud o nutrición.
 """.strip()
 
 
-def _build_sync_client() -> OpenAI:
-    return OpenAI(
-        base_url=AI_BASE_URL,
-        api_key=AI_API_KEY,
+@dataclass
+class ConnectionStats:
+    requests: int = 0
+    new_connections: int = 0
+    reused_connections: int = 0
+
+    def record(self, reused: bool) -> None:
+        self.requests += 1
+        if reused:
+            self.reused_connections += 1
+        else:
+            self.new_connections += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["reuse_ratio"] = round(self.reused_connections / self.requests, 3) if self.requests else 0.0
+        return data
+
+
+_async_client: Optional[AsyncOpenAI] = None
+_connection_stats = ConnectionStats()
+
+
+def _http2_enabled() -> bool:
+    if not AI_HTTP2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logging.warning("AI_HTTP2 activo pero el paquete 'h2' no está instalado; se usa HTTP/1.1")
+        return False
+    return True
+
+
+async def _trace_request(request: httpx.Request) -> None:
+    state = {"new_connection": False}
+
+    async def trace(event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            state["new_connection"] = True
+
+    request.extensions["trace"] = trace
+    request.extensions["fitbot_conn"] = state
+
+
+async def _record_response(response: httpx.Response) -> None:
+    state = response.request.extensions.get("fitbot_conn")
+    if state is None:
+        return
+    reused = not state["new_connection"]
+    _connection_stats.record(reused)
+    logging.debug(
+        "LLM %s %s (http=%s, conexión reutilizada=%s)",
+        response.request.method,
+        response.request.url.path,
+        response.http_version,
+        reused,
+    )
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
         timeout=AI_CLIENT_TIMEOUT,
+        http2=_http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=AI_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=AI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=AI_POOL_KEEPALIVE_EXPIRY,
+        ),
+        event_hooks={"request": [_trace_request], "response": [_record_response]},
     )
 
 
@@ -60,12 +143,39 @@ def _build_async_client() -> AsyncOpenAI:
         base_url=AI_BASE_URL,
         api_key=AI_API_KEY,
         timeout=AI_CLIENT_TIMEOUT,
+        # Los reintentos los maneja astream_chat_completion (con failover de modelo).
+        max_retries=0,
+        http_client=_build_http_client(),
     )
 
 
-_last_check_ts: float = 0.0
-_last_check_ok: bool = False
-_resolved_model: Optional[str] = None
+def get_async_client() -> AsyncOpenAI:
+    """Devuelve el cliente compartido del proceso, creándolo si hace falta."""
+    global _async_client
+    if _async_client is None:
+        _async_client = _build_async_client()
+    return _async_client
+
+
+async def startup() -> None:
+    """Prepara el pool de conexiones compartido hacia el proveedor."""
+    if AI_API_KEY:
+        get_async_client()
+        model_registry.start()
+
+
+async def shutdown() -> None:
+    """Cierra el cliente compartido y libera las conexiones abiertas."""
+    global _async_client
+    await model_registry.stop()
+    client, _async_client = _async_client, None
+    if client is not None:
+        with suppress(Exception):
+            await client.close()
+
+
+def connection_stats() -> Dict[str, Any]:
+    return _connection_stats.as_dict()
 
 
 def _extract_model_ids(items: Iterable) -> List[str]:
@@ -80,102 +190,372 @@ def _extract_model_ids(items: Iterable) -> List[str]:
     return ids
 
 
-def _list_available_models() -> Sequence[str]:
-    client = _build_sync_client()
-    try:
-        response = client.models.list()
-    finally:
-        with suppress(Exception):
-            client.close()
+async def _list_available_models() -> Sequence[str]:
+    response = await get_async_client().models.list()
     data = getattr(response, "data", response)
     if isinstance(data, Sequence):
         return _extract_model_ids(data)
     return _extract_model_ids(list(data))
 
 
-def _resolve_model() -> str:
-    global _resolved_model
-    if _resolved_model:
-        return _resolved_model
-
-    seen = set()
-    candidates: List[str] = []
-    for name in PREFERRED_MODELS:
-        if not name or name in seen:
-            continue
-        candidates.append(name)
-        seen.add(name)
-    available = set(_list_available_models())
-    for candidate in candidates:
-        if candidate in available:
-            if AI_MODEL and candidate != AI_MODEL:
-                logging.warning(
-                    "Modelo preferido %s no disponible, usando %s", AI_MODEL, candidate
-                )
-            _resolved_model = candidate
+def _pick_model(available: Sequence[str]) -> Optional[str]:
+    available_set = set(available)
+    for candidate in dict.fromkeys(name for name in PREFERRED_MODELS if name):
+        if candidate in available_set:
             return candidate
+    if available_set:
+        return sorted(available_set)[0]
+    return None
 
-    if available:
-        fallback = sorted(available)[0]
-        logging.warning(
-            "Ninguno de los modelos preferidos está disponible; usando %s", fallback
-        )
-        _resolved_model = fallback
-        return fallback
 
-    raise RuntimeError("Groq no publicó modelos disponibles para esta API key")
+class ModelRegistry:
+    """Catálogo de modelos en memoria, revalidado en segundo plano (stale-while-revalidate)."""
+
+    def __init__(self, ttl: float = CLIENT_CHECK_TTL, refresh_interval: float = AI_MODELS_REFRESH_INTERVAL) -> None:
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._available: Sequence[str] = ()
+        self._resolved: Optional[str] = None
+        self._ok = False
+        self._checked_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._cooldowns: Dict[str, float] = {}
+
+    @property
+    def available(self) -> bool:
+        return self._ok
+
+    @property
+    def resolved(self) -> Optional[str]:
+        return self._resolved
+
+    def models(self) -> Sequence[str]:
+        return self._available
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._checked_at > self.ttl
+
+    def invalidate(self, model: Optional[str] = None) -> None:
+        """Descarta la resolución cacheada (o solo si coincide con ``model``)."""
+        if model is None or model == self._resolved:
+            self._resolved = None
+            self._checked_at = 0.0
+
+    def mark_failed(self, model: str, cooldown: float = AI_MODEL_COOLDOWN) -> None:
+        """Saca a ``model`` de la rotación durante ``cooldown`` segundos."""
+        self._cooldowns[model] = time.monotonic() + cooldown
+
+    def current(self) -> str:
+        """Modelo que atendería una solicitud ahora: el resuelto, salvo que esté en cooldown."""
+        candidates = self.candidates()
+        return candidates[0] if candidates else AI_MODEL
+
+    def candidates(self) -> List[str]:
+        """Modelos a intentar, en orden: el resuelto y luego los preferidos publicados."""
+        published = set(self._available)
+        ordered = [self._resolved] if self._resolved else []
+        ordered.extend(name for name in PREFERRED_MODELS if name and (not published or name in published))
+        ordered = list(dict.fromkeys(ordered))
+        now = time.monotonic()
+        healthy = [name for name in ordered if self._cooldowns.get(name, 0.0) <= now]
+        return healthy or ordered
+
+    async def _do_refresh(self) -> None:
+        try:
+            available = await _list_available_models()
+        except Exception as exc:
+            logging.debug("No se pudo consultar los modelos del proveedor: %s", exc)
+            self._ok = False
+        else:
+            self._available = tuple(available)
+            picked = _pick_model(self._available)
+            if picked is None and self._resolved:
+                # Un catálogo vacío suele ser un problema pasajero del proveedor: se conserva
+                # el modelo anterior, pero queda registrado.
+                logging.warning("El proveedor no publicó modelos; se mantiene %s", self._resolved)
+            if picked and picked != self._resolved:
+                if picked not in PREFERRED_MODELS:
+                    logging.warning("Ninguno de los modelos preferidos está disponible; usando %s", picked)
+                elif AI_MODEL and picked != AI_MODEL:
+                    logging.warning("Modelo preferido %s no disponible, usando %s", AI_MODEL, picked)
+                self._resolved = picked
+            self._ok = self._resolved is not None
+        finally:
+            self._checked_at = time.monotonic()
+
+    async def refresh(self) -> None:
+        """Consulta el catálogo remoto; llamadas concurrentes comparten la misma petición."""
+        task = self._refresh_task
+        if task is None or task.done():
+            task = asyncio.create_task(self._do_refresh())
+            self._refresh_task = task
+        await asyncio.shield(task)
+
+    def schedule_refresh(self) -> None:
+        if not AI_API_KEY:
+            return
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refresh_task = loop.create_task(self._do_refresh())
+
+    async def resolve(self) -> str:
+        if self._resolved:
+            if self.is_stale():
+                self.schedule_refresh()
+            return self._resolved
+        await self.refresh()
+        if self._resolved:
+            return self._resolved
+        raise RuntimeError("Groq no publicó modelos disponibles para esta API key")
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        if not AI_API_KEY or (self._loop_task is not None and not self._loop_task.done()):
+            return
+        self._loop_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        tasks = [task for task in (self._loop_task, self._refresh_task) if task is not None]
+        self._loop_task = None
+        self._refresh_task = None
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError, Exception):
+                await task
+
+
+model_registry = ModelRegistry()
+
+
+async def _resolve_model() -> str:
+    return await model_registry.resolve()
 
 
 def is_client_available() -> bool:
-    """Devuelve True si el proveedor remoto de IA estuvo disponible recientemente."""
-    global _last_check_ts, _last_check_ok
-    now = time.monotonic()
-    if now - _last_check_ts <= CLIENT_CHECK_TTL:
-        return _last_check_ok
+    """Devuelve el último estado conocido del proveedor sin hacer I/O.
 
+    Si el dato está vencido se agenda una revalidación en segundo plano.
+    """
     if not AI_API_KEY:
         logging.debug("AI_API_KEY no configurada; el proveedor remoto queda deshabilitado")
-        _last_check_ok = False
-        _last_check_ts = now
         return False
+    if model_registry.is_stale():
+        model_registry.schedule_refresh()
+    return model_registry.available
+
+
+class _LatencyTracker:
+    """Ventana deslizante de tiempos al primer token, usada para decidir el hedging."""
+
+    def __init__(self, size: int = 200) -> None:
+        self._samples: deque = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < 20:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self) -> float:
+        observed = self.percentile(AI_HEDGE_PERCENTILE)
+        return max(AI_HEDGE_MIN_DELAY, observed or 0.0)
+
+
+first_token_latency = _LatencyTracker()
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    return exc.status_code if isinstance(exc, APIStatusError) else None
+
+
+def _is_transient(exc: BaseException) -> bool:
+    status = _status_code(exc)
+    return isinstance(exc, APIConnectionError) or status in {408, 409, 429} or (status or 0) >= 500
+
+
+def _should_failover(exc: BaseException) -> bool:
+    status = _status_code(exc)
+    return status in {404, 429} or (status or 0) >= 500
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * (2 ** attempt)))
 
+
+def _chunk_text(chunk: Any) -> str:
+    with suppress(Exception):
+        return chunk.choices[0].delta.content or ""
+    return ""
+
+
+@dataclass
+class _OpenedStream:
+    model: str
+    first_delta: str
+    stream: Any
+    iterator: Any
+    first_token_at: float = 0.0
+
+
+async def _open_stream(model: str, messages: List[Dict[str, str]]) -> _OpenedStream:
+    """Abre el stream y espera el primer fragmento con texto."""
+    started = time.monotonic()
+    stream = await get_async_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=AI_TEMPERATURE,
+        max_tokens=AI_MAX_TOKENS,
+        stream=True,
+    )
+    iterator = stream.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return _OpenedStream(model, "", stream, iterator)
+            delta = _chunk_text(chunk)
+            if delta:
+                now = time.monotonic()
+                first_token_latency.record(now - started)
+                metrics.LLM_TIME_TO_FIRST_TOKEN.labels(model).observe(now - started)
+                return _OpenedStream(model, delta, stream, iterator, first_token_at=now)
+    except BaseException:
+        with suppress(Exception):
+            await stream.close()
+        raise
+
+
+async def _close_opened(task: "asyncio.Task[_OpenedStream]") -> None:
+    if not task.done():
+        task.cancel()
+    with suppress(Exception, asyncio.CancelledError):
+        opened = await task
+        await opened.stream.close()
+
+
+async def _open_with_hedge(
+    models: List[str],
+    messages: List[Dict[str, str]],
+    failures: Optional[List[Tuple[str, BaseException]]] = None,
+) -> _OpenedStream:
+    """Lanza un segundo intento si el primer token tarda más que el p95 observado.
+
+    Los intentos que fallan se agregan a ``failures`` como ``(modelo, error)``.
+    """
+    failures = failures if failures is not None else []
+    primary = asyncio.create_task(_open_stream(models[0], messages))
+    task_models = {primary: models[0]}
+    if not AI_HEDGE_ENABLED:
+        try:
+            return await primary
+        except Exception as exc:
+            failures.append((models[0], exc))
+            raise
+
+    pending = {primary}
+    winner: Optional[_OpenedStream] = None
     try:
-        _resolve_model()
-        _last_check_ok = True
-    except Exception as exc: 
-        logging.debug("No se pudo conectar al cliente local de IA: %s", exc)
-        _last_check_ok = False
-    _last_check_ts = now
-    return _last_check_ok
+        done, pending = await asyncio.wait(pending, timeout=first_token_latency.hedge_delay())
+        if not done:
+            hedge_model = models[1] if len(models) > 1 else models[0]
+            logging.info("Primer token demorado en %s; lanzando hedge con %s", models[0], hedge_model)
+            hedge = asyncio.create_task(_open_stream(hedge_model, messages))
+            task_models[hedge] = hedge_model
+            pending.add(hedge)
+        while True:
+            for task in done:
+                error = task.exception()
+                if error is not None:
+                    failures.append((task_models[task], error))
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    # Ambos intentos abrieron en la misma vuelta: el que sobra se cierra.
+                    with suppress(Exception):
+                        await task.result().stream.close()
+            if winner is not None:
+                return winner
+            if not pending:
+                raise failures[-1][1]
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            await _close_opened(task)
+
+
+def _record_generation(opened: _OpenedStream, chunks: int) -> None:
+    metrics.LLM_COMPLETION_TOKENS.labels(opened.model).inc(chunks)
+    elapsed = time.monotonic() - opened.first_token_at
+    if chunks > 1 and opened.first_token_at and elapsed > 0:
+        # Cada fragmento del stream trae aproximadamente un token.
+        metrics.LLM_TOKENS_PER_SECOND.labels(opened.model).observe((chunks - 1) / elapsed)
 
 
 async def astream_chat_completion(messages: List[Dict[str, str]]) -> AsyncIterator[str]:
-    """Itera fragmentos de texto del modelo de manera asíncrona."""
+    """Itera fragmentos de texto del modelo de manera asíncrona.
+
+    Antes del primer token reintenta errores transitorios con backoff y, ante 404/429/5xx,
+    pasa al siguiente modelo de ``PREFERRED_MODELS``. Una vez emitido texto, los errores
+    se propagan para no duplicar contenido.
+    """
     if not AI_API_KEY:
         raise RuntimeError(
             "AI_API_KEY no está configurada. Registrate en Groq (gratuito) y exporta AI_API_KEY o GROQ_API_KEY."
         )
-    client: Optional[AsyncOpenAI] = None
-    stream = None
+    await _resolve_model()
+    models = model_registry.candidates()
+    opened: Optional[_OpenedStream] = None
+    attempt = 0
+    while opened is None:
+        failures: List[Tuple[str, BaseException]] = []
+        try:
+            opened = await _open_with_hedge(models, messages, failures)
+        except Exception as exc:
+            # Un 404 (modelo dado de baja) no es transitorio, pero sí se resuelve con otro modelo.
+            failed = list(dict.fromkeys(model for model, error in failures if _should_failover(error)))
+            can_failover = bool(failed) and len(models) > len(failed)
+            if not (_is_transient(exc) or can_failover) or attempt >= AI_MAX_RETRIES:
+                logging.exception("Error durante el stream de respuesta del LLM: %s", exc)
+                raise
+            for model in failed:
+                model_registry.mark_failed(model)
+            if can_failover:
+                models = [name for name in models if name not in failed] + failed
+                logging.warning("Modelo %s falló (%s); probando %s", ", ".join(failed), exc, models[0])
+            delay = _backoff(attempt)
+            attempt += 1
+            logging.warning("Error transitorio del proveedor (%s); reintento %s en %.2fs", exc, attempt, delay)
+            await asyncio.sleep(delay)
+
+    chunks = 0
     try:
-        client = _build_async_client()
-        model_name = _resolve_model()
-        stream = await client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            temperature=AI_TEMPERATURE,
-            max_tokens=AI_MAX_TOKENS,
-            stream=True,
-        )
-        async for chunk in stream:
-            with suppress(Exception):
-                delta = chunk.choices[0].delta.content or ""
-                if delta:
-                    yield delta
+        if opened.first_delta:
+            chunks += 1
+            yield opened.first_delta
+        async for chunk in opened.iterator:
+            delta = _chunk_text(chunk)
+            if delta:
+                chunks += 1
+                yield delta
     except Exception as exc:
-        logging.exception("Error durante el stream de respuesta del LLM: %s", exc)
+        logging.exception("Error durante el stream de respuesta del LLM (%s): %s", opened.model, exc)
         raise
     finally:
-        if client:
-            with suppress(Exception):
-                await client.close()
+        _record_generation(opened, chunks)
+        # Devuelve la conexión al pool aunque el consumidor corte el stream antes de tiempo.
+        with suppress(Exception):
+            await opened.stream.close()
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional; sin él se sigue usando JSON.
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHAT_STORE_CODEC = os.getenv("CHAT_STORE_CODEC", "json").lower()
+CHAT_STORE_COMPRESSION = os.getenv("CHAT_STORE_COMPRESSION", "zlib").lower()
+CHAT_STORE_COMPRESS_MIN = int(os.getenv("CHAT_STORE_COMPRESS_MIN", "512"))
+
+Raw = Union[str, bytes]
+
+# Primer byte de los registros binarios. Los registros JSON empiezan con "{".
+_MSGPACK = 0x01
+_MSGPACK_ZLIB = 0x02
+_MSGPACK_ZSTD = 0x03
+
+_ROLE_CODES = {"user": 0, "assistant": 1, "system": 2}
+_ROLE_NAMES = {code: name for name, code in _ROLE_CODES.items()}
+
+
+def _iso(ts: Optional[int]) -> Optional[str]:
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class JsonCodec:
+    """Formato histórico: un objeto JSON por entrada con ``created_at`` ISO."""
+
+    name = "json"
+    binary = False
+
+    def encode_message(self, role: str, content: str, ts: int) -> Raw:
+        return json.dumps({"role": role, "content": content, "created_at": _iso(ts)})
+
+    def encode_workout(self, entry: str, ts: int) -> Raw:
+        return json.dumps({"entry": entry, "created_at": _iso(ts)})
+
+
+class MsgpackCodec:
+    """Registros binarios compactos: ``[rol, contenido, epoch]`` / ``[entrada, epoch]``."""
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self, compression: str = CHAT_STORE_COMPRESSION, compress_min: int = CHAT_STORE_COMPRESS_MIN) -> None:
+        if compression == "zstd" and zstandard is None:
+            logging.warning("CHAT_STORE_COMPRESSION=zstd pero 'zstandard' no está instalado; se usa zlib")
+            compression = "zlib"
+        self.compression = compression
+        self.compress_min = compress_min
+        self._zstd = zstandard.ZstdCompressor(level=3) if compression == "zstd" else None
+
+    def _pack(self, record: List[Any]) -> bytes:
+        body = msgpack.packb(record, use_bin_type=True)
+        if self.compression == "none" or len(body) < self.compress_min:
+            return bytes([_MSGPACK]) + body
+        if self._zstd is not None:
+            return bytes([_MSGPACK_ZSTD]) + self._zstd.compress(body)
+        return bytes([_MSGPACK_ZLIB]) + zlib.compress(body, 6)
+
+    def encode_message(self, role: str, content: str, ts: int) -> Raw:
+        return self._pack([_ROLE_CODES.get(role, 1), content, ts])
+
+    def encode_workout(self, entry: str, ts: int) -> Raw:
+        return self._pack([entry, ts])
+
+
+def _unpack(raw: bytes) -> Optional[List[Any]]:
+    tag, body = raw[0], raw[1:]
+    if tag == _MSGPACK_ZLIB:
+        body = zlib.decompress(body)
+    elif tag == _MSGPACK_ZSTD:
+        if zstandard is None:
+            raise ValueError("registro zstd sin el paquete 'zstandard' instalado")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif tag != _MSGPACK:
+        return None
+    if msgpack is None:
+        raise ValueError("registro msgpack sin el paquete 'msgpack' instalado")
+    return msgpack.unpackb(body, raw=False)
+
+
+def _epoch(iso: Optional[str]) -> int:
+    try:
+        return int(datetime.fromisoformat(iso).timestamp()) if iso else 0
+    except ValueError:
+        return 0
+
+
+def _decode_records(raws: Iterable[Raw]) -> List[Any]:
+    """Decodifica una lista mixta de registros JSON y binarios, salteando los corruptos.
+
+    Los JSON se parsean en un único ``json.loads`` en lugar de uno por elemento.
+    """
+    raws = list(raws)
+    if raws and all(isinstance(raw, str) for raw in raws):
+        try:
+            return json.loads("[" + ",".join(raws) + "]")
+        except json.JSONDecodeError:
+            pass
+    records: List[Any] = []
+    for raw in raws:
+        try:
+            if isinstance(raw, bytes) and raw[:1] != b"{":
+                record = _unpack(raw)
+            else:
+                record = json.loads(raw)
+        except Exception:
+            continue
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def decode_messages(raws: Iterable[Raw]) -> List[Dict[str, Any]]:
+    messages: List[Dict[str, Any]] = []
+    for record in _decode_records(raws):
+        if isinstance(record, dict):
+            messages.append(
+                {
+                    "role": record.get("role", "assistant"),
+                    "content": record.get("content", ""),
+                    "created_at": record.get("created_at"),
+                }
+            )
+        elif isinstance(record, list) and len(record) >= 3:
+            messages.append(
+                {"role": _ROLE_NAMES.get(record[0], "assistant"), "content": record[1], "created_at": _iso(record[2])}
+            )
+    return messages
+
+
+def decode_workouts(raws: Iterable[Raw]) -> List[Dict[str, Any]]:
+    workouts: List[Dict[str, Any]] = []
+    for record in _decode_records(raws):
+        if isinstance(record, dict):
+            workouts.append({"entry": record.get("entry", ""), "created_at": record.get("created_at")})
+        elif isinstance(record, list) and len(record) >= 2:
+            workouts.append({"entry": record[0], "created_at": _iso(record[1])})
+    return workouts
+
+
+def reencode_messages(raws: Iterable[Raw], target: Any) -> List[Raw]:
+    return [
+        target.encode_message(item["role"], item["content"], _epoch(item["created_at"]))
+        for item in decode_messages(raws)
+    ]
+
+
+def reencode_workouts(raws: Iterable[Raw], target: Any) -> List[Raw]:
+    return [target.encode_workout(item["entry"], _epoch(item["created_at"])) for item in decode_workouts(raws)]
+
+
+def configured_codec(name: str = CHAT_STORE_CODEC) -> Any:
+    if name == "msgpack":
+        if msgpack is not None:
+            return MsgpackCodec()
+        logging.warning("CHAT_STORE_CODEC=msgpack pero 'msgpack' no está instalado; se usa JSON")
+    elif name != "json":
+        logging.warning("CHAT_STORE_CODEC desconocido (%s); se usa JSON", name)
+    return JsonCodec()
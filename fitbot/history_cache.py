@@ -0,0 +1,110 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+CHAT_HISTORY_CACHE_BYTES = int(os.getenv("CHAT_HISTORY_CACHE_BYTES", str(8 * 1024 * 1024)))
+CHAT_HISTORY_CACHE_ENTRIES = int(os.getenv("CHAT_HISTORY_CACHE_ENTRIES", "50"))
+
+# Costo fijo aproximado de cada mensaje en memoria (dict, claves y objetos str).
+_MESSAGE_OVERHEAD = 200
+
+Message = Dict[str, str]
+
+
+def _message_size(message: Message) -> int:
+    return _MESSAGE_OVERHEAD + len(message["role"]) + len(message["content"])
+
+
+@dataclass
+class _Entry:
+    version: int
+    # True si ``messages`` contiene todo lo guardado en Redis y no solo la cola.
+    complete: bool
+    messages: List[Message] = field(default_factory=list)
+    size: int = 0
+
+
+class HistoryCache:
+    """LRU en proceso del historial decodificado, acotado por tamaño en bytes.
+
+    Cada entrada guarda la versión de la sesión con la que se leyó; quien la use debe
+    comparar contra la versión actual en Redis antes de confiar en ella.
+    """
+
+    def __init__(self, max_bytes: int = CHAT_HISTORY_CACHE_BYTES, max_entries: int = CHAT_HISTORY_CACHE_ENTRIES) -> None:
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, client_id: str, limit: int) -> Optional[_Entry]:
+        """Entrada que alcanza para responder ``limit`` mensajes, o None."""
+        entry = self._entries.get(client_id)
+        if entry is None or (len(entry.messages) < limit and not entry.complete):
+            return None
+        self._entries.move_to_end(client_id)
+        return entry
+
+    def store(self, client_id: str, version: int, messages: List[Message], complete: bool) -> None:
+        if not self.enabled:
+            return
+        self.discard(client_id)
+        entry = _Entry(version=version, complete=complete)
+        self._entries[client_id] = entry
+        self._extend(entry, list(messages))
+        self._bytes += entry.size
+        self._evict()
+
+    def append(self, client_id: str, messages: Iterable[Message], max_len: int) -> None:
+        """Agrega mensajes escritos por este proceso y adelanta la versión esperada."""
+        entry = self._entries.get(client_id)
+        if entry is None:
+            return
+        added = list(messages)
+        entry.version += len(added)
+        self._bytes -= entry.size
+        self._extend(entry, added, max_len)
+        self._bytes += entry.size
+        self._entries.move_to_end(client_id)
+        self._evict()
+
+    def discard(self, client_id: str) -> None:
+        entry = self._entries.pop(client_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _extend(self, entry: _Entry, messages: List[Message], max_len: int = 0) -> None:
+        entry.messages.extend(messages)
+        if 0 < max_len < len(entry.messages):
+            # Redis recorta la lista a ``max_len``: lo más viejo ya no está guardado.
+            entry.complete = False
+            del entry.messages[:-max_len]
+        if len(entry.messages) > self.max_entries:
+            entry.messages = entry.messages[-self.max_entries :]
+            entry.complete = False
+        entry.size = sum(_message_size(message) for message in entry.messages)
+
+    def _evict(self) -> None:
+        while self._entries and self._bytes > self.max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+history_cache = HistoryCache()
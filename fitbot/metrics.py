@@ -0,0 +1,143 @@
+import functools
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple, TypeVar
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        multiprocess,
+        start_http_server,
+    )
+except ImportError:  # prometheus_client es opcional; sin él las métricas no hacen nada.
+    CollectorRegistry = Counter = Gauge = Histogram = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Con varios procesos (uvicorn --workers o el servidor TCP con --workers) cada proceso
+# escribe sus valores en este directorio y el endpoint los agrega al exponer.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+class _NoopMetric:
+    def labels(self, *args: Any, **kwargs: Any) -> "_NoopMetric":
+        return self
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+
+def _metric(kind: Any, name: str, documentation: str, labels: Tuple[str, ...] = (), **kwargs: Any) -> Any:
+    if kind is None:
+        return _NoopMetric()
+    if kind is Gauge:
+        kwargs.setdefault("multiprocess_mode", "livesum")
+    return kind(name, documentation, labels, **kwargs)
+
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0, 30.0)
+_REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+_RATE_BUCKETS = (10, 25, 50, 100, 200, 400, 800, 1600)
+
+LLM_TIME_TO_FIRST_TOKEN = _metric(
+    Histogram,
+    "fitbot_llm_time_to_first_token_seconds",
+    "Tiempo hasta el primer fragmento con texto",
+    ("model",),
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS_PER_SECOND = _metric(
+    Histogram,
+    "fitbot_llm_tokens_per_second",
+    "Velocidad de generación después del primer token (fragmentos por segundo)",
+    ("model",),
+    buckets=_RATE_BUCKETS,
+)
+LLM_COMPLETION_TOKENS = _metric(
+    Counter, "fitbot_llm_completion_tokens", "Fragmentos de texto recibidos del modelo", ("model",)
+)
+LLM_QUEUE_DEPTH = _metric(Gauge, "fitbot_llm_queue_depth", "Solicitudes esperando turno en el planificador")
+LLM_ACTIVE = _metric(Gauge, "fitbot_llm_active_completions", "Completions en curso")
+WS_SESSIONS = _metric(Gauge, "fitbot_ws_sessions", "Sesiones WebSocket abiertas")
+TCP_SESSIONS = _metric(Gauge, "fitbot_tcp_sessions", "Sesiones TCP abiertas")
+FALLBACK_REPLIES = _metric(
+    Counter,
+    "fitbot_fallback_replies",
+    "Respuestas de reemplazo enviadas en lugar del modelo",
+    ("transport", "reason"),
+)
+REDIS_OP_SECONDS = _metric(
+    Histogram,
+    "fitbot_redis_op_seconds",
+    "Latencia de las operaciones de chat_store",
+    ("op",),
+    buckets=_REDIS_BUCKETS,
+)
+
+
+def redis_timed(op: str) -> Callable[[F], F]:
+    """Mide la duración de una función async de ``chat_store``."""
+
+    def decorator(func: F) -> F:
+        histogram = REDIS_OP_SECONDS.labels(op)
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def _registry() -> Any:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    from prometheus_client import REGISTRY
+
+    return REGISTRY
+
+
+def render() -> Tuple[bytes, str]:
+    """Devuelve el cuerpo y el content-type para exponer las métricas."""
+    if CollectorRegistry is None:
+        return b"# prometheus_client no instalado\n", CONTENT_TYPE_LATEST
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int, host: str = "0.0.0.0") -> bool:
+    """Expone /metrics por HTTP en un hilo aparte (para el servidor TCP)."""
+    if CollectorRegistry is None:
+        logging.warning("Exporter de métricas deshabilitado: falta prometheus_client")
+        return False
+    start_http_server(port, addr=host, registry=_registry())
+    logging.info("Métricas Prometheus en http://%s:%s/metrics", host, port)
+    return True
+
+
+def mark_process_dead(pid: Optional[int]) -> None:
+    """Descarta los gauges 'live' de un worker que terminó."""
+    if PROMETHEUS_MULTIPROC_DIR and CollectorRegistry is not None and pid:
+        multiprocess.mark_process_dead(pid)
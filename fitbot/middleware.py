@@ -0,0 +1,166 @@
+import bisect
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+HTTP_LATENCY_ENABLED = os.getenv("HTTP_LATENCY_ENABLED", "0").lower() in {"1", "true", "yes", "on"}
+HTTP_PROFILE_SAMPLE_RATE = float(os.getenv("HTTP_PROFILE_SAMPLE_RATE", "0"))
+HTTP_PROFILE_MIN_MS = float(os.getenv("HTTP_PROFILE_MIN_MS", "50"))
+
+# Límites de los buckets en ms: crecen ~19% por bucket, de 0,1 ms a ~100 s.
+_BUCKET_BOUNDS = [0.1 * 2 ** (i / 4) for i in range(81)]
+
+ProfileHook = Callable[[str, float, pstats.Stats], None]
+
+
+class LatencyHistogram:
+    """Histograma de latencias con buckets fijos; los percentiles se leen de los conteos."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS, ms)] += 1
+        self.total += 1
+        self.sum_ms += ms
+
+    def percentile(self, q: float) -> float:
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return _BUCKET_BOUNDS[min(index, len(_BUCKET_BOUNDS) - 1)]
+        return _BUCKET_BOUNDS[-1]
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.total,
+            "mean_ms": round(self.sum_ms / self.total, 2) if self.total else 0.0,
+            "p50_ms": round(self.percentile(0.50), 2),
+            "p95_ms": round(self.percentile(0.95), 2),
+            "p99_ms": round(self.percentile(0.99), 2),
+        }
+
+
+def log_profile(route: str, ms: float, stats: pstats.Stats) -> None:
+    """Hook por defecto: registra las funciones con más tiempo acumulado de la solicitud muestreada."""
+    buffer = io.StringIO()
+    stats.stream = buffer
+    stats.sort_stats("cumulative").print_stats(15)
+    logging.info("Perfil de %s (%.1f ms):\n%s", route, ms, buffer.getvalue())
+
+
+def _route_name(scope: Scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return f"{scope.get('method', 'GET')} {path}"
+    return "sin ruta"
+
+
+class RouteLatency:
+    """Histogramas por ruta y muestreo opcional con cProfile."""
+
+    def __init__(
+        self,
+        enabled: bool = HTTP_LATENCY_ENABLED,
+        profile_sample_rate: float = HTTP_PROFILE_SAMPLE_RATE,
+        profile_min_ms: float = HTTP_PROFILE_MIN_MS,
+        profile_hook: Optional[ProfileHook] = log_profile,
+    ) -> None:
+        self.enabled = enabled
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_min_ms = profile_min_ms
+        self.profile_hook = profile_hook
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._profiling = False
+
+    def observe(self, route: str, ms: float) -> None:
+        self.histograms.setdefault(route, LatencyHistogram()).observe(ms)
+
+    def start_profiler(self) -> Optional[cProfile.Profile]:
+        # cProfile no admite perfiles anidados: se muestrea una solicitud a la vez.
+        if self.profile_hook is None or self._profiling or random.random() >= self.profile_sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return None
+        self._profiling = True
+        return profiler
+
+    def finish_profiler(self, profiler: cProfile.Profile, route: str, ms: float) -> None:
+        profiler.disable()
+        self._profiling = False
+        if ms < self.profile_min_ms or self.profile_hook is None:
+            return
+        try:
+            self.profile_hook(route, ms, pstats.Stats(profiler))
+        except Exception as exc:
+            logging.warning("El hook de perfilado falló: %s", exc)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {route: histogram.as_dict() for route, histogram in sorted(self.histograms.items())}
+
+
+route_latency = RouteLatency()
+
+
+class SecurityHeadersMiddleware:
+    """Middleware ASGI puro: agrega cabeceras precalculadas y, si se habilita, mide latencias.
+
+    A diferencia de ``BaseHTTPMiddleware`` no envuelve la respuesta en tareas ni streams.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        headers: Iterable[Tuple[str, str]] = (),
+        latency: RouteLatency = route_latency,
+    ) -> None:
+        self.app = app
+        self.headers: List[Tuple[bytes, bytes]] = [
+            (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+        ]
+        self.latency = latency
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                present = {name.lower() for name, _ in headers}
+                headers.extend(header for header in self.headers if header[0] not in present)
+                message["headers"] = headers
+            await send(message)
+
+        if not self.latency.enabled:
+            await self.app(scope, receive, send_with_headers)
+            return
+
+        profiler = self.latency.start_profiler()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            route = _route_name(scope)
+            self.latency.observe(route, ms)
+            if profiler is not None:
+                self.latency.finish_profiler(profiler, route, ms)
@@ -0,0 +1,190 @@
+"""Re-codifica los mensajes y entrenamientos guardados, y sus streams, con el codec indicado.
+
+Uso: python -m fitbot.migrate_codec --codec msgpack [--dry-run]
+
+Con ``--backfill-log`` en cambio crea los streams de paginación de las sesiones
+anteriores a ellos, a partir de sus listas.
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+from redis.asyncio.cluster import RedisCluster
+from redis.exceptions import WatchError
+
+from fitbot import codec
+from fitbot.redis_pool import REDIS_URL, build_client
+
+_PATTERNS: Dict[str, Callable[[List[codec.Raw], Any], List[codec.Raw]]] = {
+    "fitbot:session:*:messages": codec.reencode_messages,
+    "fitbot:session:*:workouts": codec.reencode_workouts,
+}
+_LOG_PATTERNS: Dict[str, Callable[[List[codec.Raw]], List[Dict[str, Any]]]] = {
+    "fitbot:session:*:messages": codec.decode_messages,
+    "fitbot:session:*:workouts": codec.decode_workouts,
+}
+
+
+def _text(key: Any) -> str:
+    return key.decode() if isinstance(key, bytes) else key
+
+
+def _require_standalone(conn: Any) -> None:
+    if isinstance(conn, RedisCluster):
+        raise RuntimeError(
+            "La migración usa transacciones WATCH/MULTI, que Redis Cluster no soporta. "
+            "Corréla contra cada nodo primario con REDIS_MODE=standalone y su URL."
+        )
+
+
+async def _migrate_key(conn: Any, key: Any, reencode: Callable, target: Any, dry_run: bool) -> Tuple[int, int, int]:
+    """Reescribe una lista y su stream ``<clave>:log`` en una transacción WATCH/MULTI.
+
+    Ambos conservan su TTL y el stream, los ids de sus entradas. Devuelve las claves
+    reescritas, las entradas escritas y las descartadas por no poder decodificarse.
+    """
+    log_key = _text(key) + ":log"
+    while True:
+        async with conn.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key, log_key)
+                raws = await pipe.lrange(key, 0, -1)
+                ttl = await pipe.pttl(key)
+                entries = await pipe.xrange(log_key)
+                log_ttl = await pipe.pttl(log_key)
+                payloads = reencode(raws, target)
+                log_payloads = []
+                for entry_id, fields in entries:
+                    encoded = reencode([fields[b"p"]], target)
+                    if encoded:
+                        log_payloads.append((entry_id, encoded[0]))
+                dropped = len(raws) - len(payloads) + len(entries) - len(log_payloads)
+                if dropped:
+                    logging.warning("%s: %s entradas no se pudieron decodificar y se descartan", _text(key), dropped)
+                keys = bool(payloads) + bool(log_payloads)
+                written = len(payloads) + len(log_payloads)
+                if dry_run or not written:
+                    await pipe.unwatch()
+                    return keys, written, dropped
+                pipe.multi()
+                if payloads:
+                    pipe.delete(key)
+                    pipe.rpush(key, *payloads)
+                    if ttl > 0:
+                        pipe.pexpire(key, ttl)
+                if log_payloads:
+                    pipe.delete(log_key)
+                    for entry_id, payload in log_payloads:
+                        pipe.xadd(log_key, {"p": payload}, id=entry_id)
+                    if log_ttl > 0:
+                        pipe.pexpire(log_key, log_ttl)
+                await pipe.execute()
+                return keys, written, dropped
+            except WatchError:
+                # Hubo una escritura concurrente en la sesión: se reintenta con los datos nuevos.
+                continue
+
+
+def _log_ids(raws: List[codec.Raw], decode: Callable[[List[codec.Raw]], List[Dict[str, Any]]]) -> List[str]:
+    """Ids de stream crecientes a partir de la fecha de cada entrada."""
+    ids: List[str] = []
+    last_ms, seq = 0, 0
+    for raw in raws:
+        decoded = decode([raw])
+        ms = max(codec._epoch(decoded[0]["created_at"]) * 1000 if decoded else 0, last_ms)
+        seq = seq + 1 if ms == last_ms else 0
+        if ms == 0 and seq == 0:
+            seq = 1  # 0-0 no es un id válido
+        last_ms = ms
+        ids.append(f"{ms}-{seq}")
+    return ids
+
+
+async def _backfill_key(conn: Any, key: Any, decode: Callable, dry_run: bool) -> int:
+    """Copia una lista a su stream ``<clave>:log`` si la sesión todavía no tiene uno."""
+    log_key = _text(key) + ":log"
+    while True:
+        async with conn.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key, log_key)
+                if await pipe.exists(log_key):
+                    await pipe.unwatch()
+                    return 0
+                raws = await pipe.lrange(key, 0, -1)
+                ttl = await pipe.pttl(key)
+                if dry_run or not raws:
+                    await pipe.unwatch()
+                    return len(raws)
+                pipe.multi()
+                for entry_id, raw in zip(_log_ids(raws, decode), raws):
+                    pipe.xadd(log_key, {"p": raw}, id=entry_id)
+                if ttl > 0:
+                    pipe.pexpire(log_key, ttl)
+                await pipe.execute()
+                return len(raws)
+            except WatchError:
+                continue
+
+
+async def backfill_logs(url: str, dry_run: bool = False, client: Any = None) -> Dict[str, int]:
+    conn = client if client is not None else build_client(url, decode_responses=False)
+    stats = {"keys": 0, "entries": 0}
+    try:
+        _require_standalone(conn)
+        for pattern, decode in _LOG_PATTERNS.items():
+            async for key in conn.scan_iter(match=pattern, count=500):
+                stats["entries"] += await _backfill_key(conn, key, decode, dry_run)
+                stats["keys"] += 1
+    finally:
+        if client is None:
+            await conn.aclose()
+    return stats
+
+
+async def migrate(url: str, codec_name: str, dry_run: bool = False, client: Any = None) -> Dict[str, int]:
+    target = codec.configured_codec(codec_name)
+    conn = client if client is not None else build_client(url, decode_responses=False)
+    stats = {"keys": 0, "entries": 0, "dropped": 0}
+    try:
+        _require_standalone(conn)
+        for pattern, reencode in _PATTERNS.items():
+            async for key in conn.scan_iter(match=pattern, count=500):
+                keys, written, dropped = await _migrate_key(conn, key, reencode, target, dry_run)
+                stats["keys"] += keys
+                stats["entries"] += written
+                stats["dropped"] += dropped
+    finally:
+        if client is None:
+            await conn.aclose()
+    return stats
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Migra el historial guardado en Redis a otro codec")
+    parser.add_argument("--url", default=REDIS_URL, help="URL de Redis (default: REDIS_URL)")
+    parser.add_argument("--codec", default=codec.CHAT_STORE_CODEC, choices=["json", "msgpack"])
+    parser.add_argument("--dry-run", action="store_true", help="Solo cuenta las entradas, no escribe")
+    parser.add_argument(
+        "--backfill-log", action="store_true", help="Crea los streams de paginación a partir de las listas"
+    )
+    args = parser.parse_args()
+
+    try:
+        if args.backfill_log:
+            stats = await backfill_logs(args.url, dry_run=args.dry_run)
+            logging.info("Índice de paginación: %s entradas en %s claves", stats["entries"], stats["keys"])
+            return
+        stats = await migrate(args.url, args.codec, dry_run=args.dry_run)
+    except RuntimeError as exc:
+        raise SystemExit(str(exc)) from None
+    action = "Se revisarían" if args.dry_run else "Se migraron"
+    logging.info("%s %s entradas en %s claves (codec %s)", action, stats["entries"], stats["keys"], args.codec)
+    if stats["dropped"]:
+        logging.warning("%s entradas no se pudieron decodificar y se descartaron", stats["dropped"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message)s")
+    asyncio.run(main())
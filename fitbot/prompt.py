@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fitbot import chatbot
+from fitbot.scheduler import llm_scheduler
+
+AI_CONTEXT_WINDOW = int(os.getenv("AI_CONTEXT_WINDOW", "8192"))
+AI_PROMPT_BUDGET = int(os.getenv("AI_PROMPT_BUDGET", "0")) or max(
+    1024, AI_CONTEXT_WINDOW - chatbot.AI_MAX_TOKENS - 256
+)
+AI_SUMMARY_MAX_TOKENS = int(os.getenv("AI_SUMMARY_MAX_TOKENS", "300"))
+
+SUMMARY_PROMPT = """
+Resumí la conversación entre un usuario y FitBot (entrenador personal) para usarla como memoria.
+Conservá metas, nivel de experiencia, equipamiento, lesiones o limitaciones, preferencias,
+rutinas acordadas y progreso reportado. Escribí en español, en viñetas breves,
+en menos de {words} palabras. Integrá el resumen previo si existe.
+""".strip()
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken es opcional; sin él se estima por caracteres.
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def count_message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message.get("content", "")) + 4
+
+
+def message_digest(message: Dict[str, str]) -> str:
+    raw = f"{message.get('role')}\n{message.get('content', '')}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class PromptPlan:
+    messages: List[Dict[str, str]]
+    overflow: List[Dict[str, str]]
+    tokens: int
+
+
+def system_message(summary: str = "", profile: str = "") -> Dict[str, str]:
+    content = chatbot.SYSTEM_PROMPT
+    if profile:
+        content += f"\n\nPerfil de entrenamiento del usuario (según sus registros): {profile}"
+    if summary:
+        content += f"\n\nResumen de la conversación previa con este usuario:\n{summary}"
+    return {"role": "system", "content": content}
+
+
+def build_prompt(
+    history: List[Dict[str, str]],
+    summary: str = "",
+    budget: int = AI_PROMPT_BUDGET,
+    profile: str = "",
+) -> PromptPlan:
+    """Arma el prompt con los turnos más recientes que entran en ``budget`` tokens.
+
+    Los turnos más viejos que no entran se devuelven en ``overflow`` para plegarlos
+    en el resumen. El último mensaje siempre se incluye.
+    """
+    system = system_message(summary, profile)
+    used = count_message_tokens(system)
+    kept: List[Dict[str, str]] = []
+    for message in reversed(history):
+        cost = count_message_tokens(message)
+        if kept and used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    overflow = list(history[: len(history) - len(kept)])
+    return PromptPlan(messages=[system] + kept, overflow=overflow, tokens=used)
+
+
+def drop_summarized(history: List[Dict[str, str]], last_digest: Optional[str]) -> List[Dict[str, str]]:
+    """Descarta del historial restaurado los mensajes que ya cubre el resumen."""
+    if not last_digest:
+        return list(history)
+    for index in range(len(history) - 1, -1, -1):
+        if message_digest(history[index]) == last_digest:
+            return list(history[index + 1 :])
+    return list(history)
+
+
+def _transcript(messages: List[Dict[str, str]]) -> str:
+    lines = []
+    for message in messages:
+        speaker = "Usuario" if message.get("role") == "user" else "FitBot"
+        lines.append(f"{speaker}: {message.get('content', '')}")
+    return "\n".join(lines)
+
+
+def _fallback_summary(previous: str, messages: List[Dict[str, str]]) -> str:
+    extract = "\n".join(
+        f"- {'Usuario' if m.get('role') == 'user' else 'FitBot'}: {m.get('content', '')[:160]}"
+        for m in messages
+    )
+    text = "\n".join(part for part in (previous, extract) if part)
+    limit = AI_SUMMARY_MAX_TOKENS * 4
+    return text[-limit:]
+
+
+async def summarize(previous: str, messages: List[Dict[str, str]], client_id: str) -> str:
+    prompt = [
+        {"role": "system", "content": SUMMARY_PROMPT.format(words=AI_SUMMARY_MAX_TOKENS * 3 // 4)},
+        {
+            "role": "user",
+            "content": f"Resumen previo:\n{previous or '(ninguno)'}\n\nMensajes nuevos:\n{_transcript(messages)}",
+        },
+    ]
+    try:
+        fragments = [delta async for delta in llm_scheduler.stream(f"summary:{client_id}", prompt)]
+    except Exception as exc:
+        logging.warning("No se pudo resumir la conversación de %s: %s", client_id, exc)
+        return _fallback_summary(previous, messages)
+    return "".join(fragments).strip() or _fallback_summary(previous, messages)
+
+
+SummaryApply = Callable[[str, str], Awaitable[None]]
+
+
+class ConversationSummarizer:
+    """Pliega turnos viejos en un resumen en segundo plano, una tarea por sesión."""
+
+    def __init__(self) -> None:
+        self._pending: Dict[str, List[Dict[str, str]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Digest del último turno encolado o en curso, hasta que su resumen se aplica.
+        self._last_digest: Dict[str, str] = {}
+
+    def pending_digest(self, client_id: str) -> Optional[str]:
+        return self._last_digest.get(client_id)
+
+    def schedule(
+        self,
+        client_id: str,
+        overflow: List[Dict[str, str]],
+        current_summary: Callable[[], str],
+        apply: SummaryApply,
+    ) -> None:
+        """Encola ``overflow``; ``apply(resumen, digest_del_último)`` recibe cada resultado."""
+        if not overflow:
+            return
+        self._pending.setdefault(client_id, []).extend(overflow)
+        self._last_digest[client_id] = message_digest(overflow[-1])
+        task = self._tasks.get(client_id)
+        if task is None or task.done():
+            self._tasks[client_id] = asyncio.create_task(self._run(client_id, current_summary, apply))
+
+    async def _run(self, client_id: str, current_summary: Callable[[], str], apply: SummaryApply) -> None:
+        # El resumen se encadena acá: si la sesión se desconecta, ``current_summary`` ya no
+        # ve lo que plegaron los lotes anteriores.
+        summary = current_summary()
+        try:
+            while self._pending.get(client_id):
+                batch = self._pending.pop(client_id)
+                summary = await summarize(summary, batch, client_id)
+                await apply(summary, message_digest(batch[-1]))
+        except Exception as exc:
+            logging.exception("Error actualizando el resumen de %s: %s", client_id, exc)
+        finally:
+            # Tras discard() puede haber otra tarea de la misma sesión: lo suyo no se toca.
+            if self._tasks.get(client_id) is asyncio.current_task():
+                self._tasks.pop(client_id, None)
+                self._pending.pop(client_id, None)
+                self._last_digest.pop(client_id, None)
+
+    def discard(self, client_id: str) -> None:
+        self._pending.pop(client_id, None)
+        self._last_digest.pop(client_id, None)
+        task = self._tasks.pop(client_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def drain(self) -> None:
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+summarizer = ConversationSummarizer()
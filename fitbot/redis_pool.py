@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import suppress
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+from redis.asyncio.cluster import RedisCluster
+from redis.asyncio.connection import parse_url
+from redis.asyncio.retry import Retry
+from redis.asyncio.sentinel import Sentinel
+from redis.backoff import EqualJitterBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MODE = os.getenv("REDIS_MODE", "standalone").lower()
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5.0"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2.0"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "15"))
+REDIS_COMMAND_RETRIES = int(os.getenv("REDIS_COMMAND_RETRIES", "2"))
+REDIS_RECONNECT_MIN_DELAY = float(os.getenv("REDIS_RECONNECT_MIN_DELAY", "0.5"))
+REDIS_RECONNECT_MAX_DELAY = float(os.getenv("REDIS_RECONNECT_MAX_DELAY", "30.0"))
+REDIS_SENTINELS = os.getenv("REDIS_SENTINELS", "")
+REDIS_SENTINEL_MASTER = os.getenv("REDIS_SENTINEL_MASTER", "mymaster")
+# En Cluster las claves de una sesión deben compartir slot: fitbot:session:{client_id}:...
+REDIS_HASH_TAGS = os.getenv("REDIS_HASH_TAGS", "1" if REDIS_MODE == "cluster" else "0").lower() in {
+    "1",
+    "true",
+    "yes",
+    "on",
+}
+
+
+def _parse_sentinels(raw: str) -> List[Tuple[str, int]]:
+    nodes = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":")
+        nodes.append((host or item, int(port) if host else 26379))
+    return nodes
+
+
+def _common_kwargs(decode_responses: bool = True) -> Dict[str, Any]:
+    return {
+        "decode_responses": decode_responses,
+        "encoding": "utf-8",
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "retry": Retry(EqualJitterBackoff(cap=1.0, base=0.05), REDIS_COMMAND_RETRIES),
+        "retry_on_error": [RedisConnectionError, RedisTimeoutError],
+    }
+
+
+def build_client(url: Optional[str] = None, mode: str = REDIS_MODE, decode_responses: bool = True) -> Any:
+    """Crea el cliente según ``REDIS_MODE`` (standalone, cluster o sentinel). No abre conexiones.
+
+    Con ``decode_responses=False`` las respuestas llegan como bytes (codecs binarios).
+    """
+    url = url or REDIS_URL
+    kwargs = _common_kwargs(decode_responses)
+    if mode == "cluster":
+        return RedisCluster.from_url(url, max_connections=REDIS_MAX_CONNECTIONS, **kwargs)
+    if mode == "sentinel":
+        sentinels = _parse_sentinels(REDIS_SENTINELS)
+        if not sentinels:
+            raise RuntimeError("REDIS_MODE=sentinel requiere REDIS_SENTINELS=host:puerto[,host:puerto]")
+        url_kwargs = parse_url(url)
+        auth = {key: url_kwargs[key] for key in ("username", "password") if url_kwargs.get(key)}
+        sentinel = Sentinel(
+            sentinels,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        )
+        return sentinel.master_for(
+            REDIS_SENTINEL_MASTER,
+            db=url_kwargs.get("db", 0),
+            max_connections=REDIS_MAX_CONNECTIONS,
+            **auth,
+            **kwargs,
+        )
+    if mode != "standalone":
+        raise RuntimeError(f"REDIS_MODE desconocido: {mode}")
+    return redis.from_url(url, max_connections=REDIS_MAX_CONNECTIONS, **kwargs)
+
+
+class RedisConnector:
+    """Mantiene el cliente compartido y vigila su salud con reconexión y backoff.
+
+    Mientras Redis está caído las operaciones fallan rápido (sin esperar el timeout
+    de conexión) hasta el próximo intento de reconexión.
+    """
+
+    def __init__(self, url: Optional[str] = None, client: Any = None, decode_responses: bool = True) -> None:
+        self.url = url or REDIS_URL
+        self.client = client if client is not None else build_client(self.url, decode_responses=decode_responses)
+        self.healthy = False
+        self._failures = 0
+        self._retry_at = 0.0
+        self._monitor: Optional[asyncio.Task] = None
+
+    def _backoff(self) -> float:
+        delay = min(REDIS_RECONNECT_MAX_DELAY, REDIS_RECONNECT_MIN_DELAY * (2 ** self._failures))
+        return random.uniform(delay / 2, delay)
+
+    def check_available(self) -> None:
+        if not self.healthy and self._failures and time.monotonic() < self._retry_at:
+            wait = self._retry_at - time.monotonic()
+            raise RuntimeError(f"Redis no disponible; próximo reintento en {wait:.1f}s")
+
+    async def ping(self) -> bool:
+        try:
+            await self.client.ping()
+        except Exception as exc:
+            self._failures += 1
+            self._retry_at = time.monotonic() + self._backoff()
+            if self.healthy or self._failures == 1:
+                logging.warning("Redis no responde (%s); reintentando con backoff", exc)
+            self.healthy = False
+            return False
+        if not self.healthy and self._failures:
+            logging.info("Conexión con Redis restablecida")
+        self.healthy = True
+        self._failures = 0
+        return True
+
+    async def _watch(self) -> None:
+        while True:
+            if self.healthy:
+                await asyncio.sleep(max(1, REDIS_HEALTH_CHECK_INTERVAL))
+            else:
+                await asyncio.sleep(max(0.0, self._retry_at - time.monotonic()))
+            await self.ping()
+
+    def start(self) -> None:
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.get_running_loop().create_task(self._watch())
+
+    async def close(self) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await self._monitor
+            self._monitor = None
+        await self.client.aclose()
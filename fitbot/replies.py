@@ -0,0 +1,40 @@
+import hashlib
+import json
+from typing import AsyncIterator, Dict, List, Optional
+
+from fitbot import chatbot
+from fitbot import response_cache
+from fitbot.scheduler import PositionCallback, llm_scheduler
+from fitbot.singleflight import SingleFlight
+
+flights = SingleFlight()
+
+
+def _flight_key(messages: List[Dict[str, str]]) -> str:
+    payload = json.dumps(
+        [chatbot.model_registry.current(), chatbot.AI_TEMPERATURE, messages],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def stream_reply(
+    client_id: str,
+    messages: List[Dict[str, str]],
+    on_position: Optional[PositionCallback] = None,
+) -> AsyncIterator[str]:
+    """Genera la respuesta del asistente.
+
+    Solicitudes idénticas en vuelo comparten un único stream; cada stream pasa
+    por la caché de respuestas y, si no hay acierto, por el planificador del LLM.
+    """
+
+    def produce(notify_position: PositionCallback) -> AsyncIterator[str]:
+        return response_cache.cached_stream(
+            messages,
+            lambda: llm_scheduler.stream(client_id, messages, on_position=notify_position),
+        )
+
+    async for delta in flights.stream(_flight_key(messages), produce, on_position=on_position):
+        yield delta
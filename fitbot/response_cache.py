@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from fitbot import chat_store
+from fitbot import chatbot
+
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1").lower() in {"1", "true", "yes", "on"}
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "86400"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000"))
+AI_CACHE_HISTORY_TAIL = int(os.getenv("AI_CACHE_HISTORY_TAIL", "2"))
+AI_CACHE_REPLAY_CHUNK = int(os.getenv("AI_CACHE_REPLAY_CHUNK", "24"))
+AI_CACHE_SIMILARITY = float(os.getenv("AI_CACHE_SIMILARITY", "0"))
+AI_CACHE_SIMILARITY_ENTRIES = int(os.getenv("AI_CACHE_SIMILARITY_ENTRIES", "2000"))
+
+_SPACES_RE = re.compile(r"\s+")
+_EDGE_PUNCT = "¿?¡!.,;: "
+_WORD_RE = re.compile(r"\S+\s*")
+_VECTOR_DIM = 1024
+
+Vector = Dict[int, float]
+
+_background: Set[asyncio.Task] = set()
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _SPACES_RE.sub(" ", text).strip(_EDGE_PUNCT)
+
+
+def _context_and_question(messages: List[Dict[str, str]]) -> Optional[Tuple[str, str]]:
+    if not messages or messages[-1].get("role") != "user":
+        return None
+    system = [m for m in messages if m.get("role") == "system"]
+    dialog = [m for m in messages[:-1] if m.get("role") != "system"]
+    tail = dialog[-AI_CACHE_HISTORY_TAIL:] if AI_CACHE_HISTORY_TAIL > 0 else []
+    context = json.dumps(
+        {
+            "model": chatbot.model_registry.current(),
+            "temperature": chatbot.AI_TEMPERATURE,
+            "system": [normalize(m.get("content", "")) for m in system],
+            "tail": [[m.get("role"), normalize(m.get("content", ""))] for m in tail],
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(context.encode("utf-8")).hexdigest(), normalize(messages[-1].get("content", ""))
+
+
+def _digest(context: str, question: str) -> str:
+    return hashlib.sha256(f"{context}\n{question}".encode("utf-8")).hexdigest()
+
+
+def _embed(text: str) -> Vector:
+    """Embedding local barato: trigramas de caracteres proyectados por hashing."""
+    padded = f"  {text}  "
+    vector: Vector = {}
+    for i in range(len(padded) - 2):
+        gram = padded[i : i + 3].encode("utf-8")
+        bucket = int.from_bytes(hashlib.blake2b(gram, digest_size=4).digest(), "big") % _VECTOR_DIM
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {k: v / norm for k, v in vector.items()}
+
+
+def _cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class SimilarityIndex:
+    """Índice en memoria (acotado, LRU) de preguntas cacheadas por contexto."""
+
+    def __init__(self, threshold: float, max_entries: int) -> None:
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, Vector]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def add(self, digest: str, context: str, question: str) -> None:
+        if not self.enabled:
+            return
+        self._entries[digest] = (context, _embed(question))
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, digest: str) -> None:
+        self._entries.pop(digest, None)
+
+    def nearest(self, context: str, question: str) -> Optional[str]:
+        if not self.enabled or not self._entries:
+            return None
+        query = _embed(question)
+        best, best_score = None, self.threshold
+        for digest, (entry_context, vector) in self._entries.items():
+            if entry_context != context:
+                continue
+            score = _cosine(query, vector)
+            if score >= best_score:
+                best, best_score = digest, score
+        if best is not None:
+            self._entries.move_to_end(best)
+        return best
+
+
+similarity_index = SimilarityIndex(AI_CACHE_SIMILARITY, AI_CACHE_SIMILARITY_ENTRIES)
+
+
+async def lookup(messages: List[Dict[str, str]]) -> Optional[str]:
+    parts = _context_and_question(messages) if AI_CACHE_ENABLED else None
+    if parts is None:
+        return None
+    context, question = parts
+    try:
+        cached = await chat_store.get_cached_reply(_digest(context, question))
+        if cached is not None:
+            return cached
+        similar = similarity_index.nearest(context, question)
+        if similar is None:
+            return None
+        cached = await chat_store.get_cached_reply(similar)
+        if cached is None:
+            similarity_index.discard(similar)
+        return cached
+    except Exception as exc:
+        logging.debug("Caché de respuestas no disponible: %s", exc)
+        return None
+
+
+async def store(messages: List[Dict[str, str]], content: str) -> None:
+    parts = _context_and_question(messages) if AI_CACHE_ENABLED else None
+    if parts is None or not content:
+        return
+    context, question = parts
+    digest = _digest(context, question)
+    try:
+        await chat_store.store_cached_reply(digest, content, AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES)
+    except Exception as exc:
+        logging.debug("No se pudo guardar la respuesta en caché: %s", exc)
+        return
+    similarity_index.add(digest, context, question)
+
+
+async def replay(content: str) -> AsyncIterator[str]:
+    """Reproduce una respuesta cacheada como si fuera un stream del modelo."""
+    buffer = ""
+    for word in _WORD_RE.findall(content):
+        buffer += word
+        if len(buffer) >= AI_CACHE_REPLAY_CHUNK:
+            yield buffer
+            buffer = ""
+            await asyncio.sleep(0)
+    if buffer:
+        yield buffer
+
+
+async def cached_stream(
+    messages: List[Dict[str, str]],
+    produce: Callable[[], AsyncIterator[str]],
+) -> AsyncIterator[str]:
+    """Sirve desde la caché si hay acierto; si no, delega en ``produce`` y guarda el resultado."""
+    cached = await lookup(messages)
+    if cached is not None:
+        logging.debug("Respuesta servida desde caché")
+        async for delta in replay(cached):
+            yield delta
+        return
+
+    chunks: List[str] = []
+    async for delta in produce():
+        chunks.append(delta)
+        yield delta
+    # El guardado no debe demorar el cierre del stream para el cliente.
+    task = asyncio.create_task(store(messages, "".join(chunks).strip()))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
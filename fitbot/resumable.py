@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import secrets
+from contextlib import suppress
+from typing import Dict, List, Optional, Tuple
+
+from fitbot import chat_store
+
+RESUME_MEMORY_BYTES = int(os.getenv("RESUME_MEMORY_BYTES", "65536"))
+RESUME_TTL = int(os.getenv("RESUME_TTL", "600"))
+RESUME_GRACE = float(os.getenv("RESUME_GRACE", "30"))
+
+
+class ReplyLog:
+    """Fragmentos numerados (desde 1) de una respuesta en curso.
+
+    Se guardan en memoria; lo que excede ``RESUME_MEMORY_BYTES`` se vuelca a un stream
+    de Redis y se descarta de memoria. Con ``write_through`` se vuelca todo, para que
+    otro nodo pueda retomar la respuesta.
+    """
+
+    def __init__(self, stream_id: str, client_id: str, prompt: str, write_through: bool = False) -> None:
+        self.stream_id = stream_id
+        self.client_id = client_id
+        self.prompt = prompt
+        self.write_through = write_through
+        self.done = False
+        self.final = ""
+        self._base = 0
+        self._deltas: List[str] = []
+        self._size = 0
+        self._spilled = 0
+        self._spill_task: Optional[asyncio.Task] = None
+
+    @property
+    def seq(self) -> int:
+        return self._base + len(self._deltas)
+
+    def append(self, delta: str) -> int:
+        self._deltas.append(delta)
+        self._size += len(delta)
+        if self.write_through or self._size > RESUME_MEMORY_BYTES:
+            self._schedule_spill()
+        return self.seq
+
+    def _schedule_spill(self) -> None:
+        if self._spill_task is None or self._spill_task.done():
+            self._spill_task = asyncio.create_task(self._spill())
+
+    async def _spill(self) -> None:
+        while self._spilled < self.seq:
+            first = self._spilled - self._base
+            entries = [(self._base + index + 1, delta) for index, delta in enumerate(self._deltas) if index >= first]
+            try:
+                await chat_store.append_reply_deltas(self.stream_id, entries, RESUME_TTL)
+            except Exception as exc:
+                logging.warning("No se pudo volcar el stream %s a Redis: %s", self.stream_id, exc)
+                return
+            self._spilled = entries[-1][0]
+            # Solo se libera memoria de lo que ya está en Redis.
+            while self._size > RESUME_MEMORY_BYTES and self._base < self._spilled:
+                self._size -= len(self._deltas.pop(0))
+                self._base += 1
+
+    async def since(self, offset: int) -> Tuple[str, int]:
+        """Texto emitido después de ``offset`` y el número del último fragmento incluido."""
+        parts: List[str] = []
+        while offset < self._base:
+            older = await chat_store.read_reply_deltas(self.stream_id, offset)
+            if not older:
+                break
+            upto = min(self._base, older[-1][0])
+            parts.extend(delta for seq, delta in older if seq <= upto)
+            offset = upto
+        parts.extend(self._deltas[max(0, offset - self._base) :])
+        return "".join(parts), self.seq
+
+    async def close(self) -> None:
+        if self._spill_task is not None:
+            with suppress(Exception):
+                await self._spill_task
+
+
+class ResumableStreams:
+    """Registro local de respuestas retomables, indexado por ``stream_id``."""
+
+    def __init__(self) -> None:
+        self._logs: Dict[str, ReplyLog] = {}
+
+    def get(self, stream_id: str) -> Optional[ReplyLog]:
+        return self._logs.get(stream_id)
+
+    async def open(self, client_id: str, prompt: str, write_through: bool = False) -> ReplyLog:
+        log = ReplyLog(secrets.token_urlsafe(12), client_id, prompt, write_through)
+        self._logs[log.stream_id] = log
+        if write_through:
+            try:
+                await chat_store.start_reply_stream(log.stream_id, client_id, prompt, RESUME_TTL)
+            except Exception as exc:
+                logging.warning("No se pudo registrar el stream %s en Redis: %s", log.stream_id, exc)
+        return log
+
+    async def finish(self, log: ReplyLog, final: str) -> None:
+        log.final = final
+        log.done = True
+        await log.close()
+        if log.write_through:
+            with suppress(Exception):
+                await chat_store.finish_reply_stream(log.stream_id)
+        # Se conserva un rato para que un cliente que se reconecta sepa que terminó.
+        asyncio.get_running_loop().call_later(RESUME_GRACE, self._logs.pop, log.stream_id, None)
+
+
+streams = ResumableStreams()
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+from fitbot import chatbot
+from fitbot import metrics
+
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_RPM_LIMIT = int(os.getenv("AI_RPM_LIMIT", "30"))
+AI_TPM_LIMIT = int(os.getenv("AI_TPM_LIMIT", "6000"))
+AI_QUEUE_MAX = int(os.getenv("AI_QUEUE_MAX", "100"))
+AI_QUEUE_MAX_PER_CLIENT = int(os.getenv("AI_QUEUE_MAX_PER_CLIENT", "3"))
+AI_EXPECTED_COMPLETION_TOKENS = int(
+    os.getenv("AI_EXPECTED_COMPLETION_TOKENS", str(min(chatbot.AI_MAX_TOKENS, 300)))
+)
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class SchedulerBusy(RuntimeError):
+    """La cola de solicitudes al proveedor está llena."""
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(m.get("content", "")) + 4 for m in messages)
+
+
+class TokenBucket:
+    """Presupuesto por minuto que se repone de forma continua. ``limit <= 0`` lo deshabilita."""
+
+    def __init__(self, limit_per_minute: int) -> None:
+        self.capacity = float(limit_per_minute)
+        self.tokens = self.capacity
+        self._rate = self.capacity / 60.0
+        self._updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta poder gastar ``amount`` (0 si alcanza ya)."""
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self._rate
+
+    def take(self, amount: float) -> None:
+        if self.enabled:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        if self.enabled:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass(eq=False)
+class _Waiter:
+    client_id: str
+    tokens: int
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    position: int = 0
+    granted: bool = False
+
+
+class LLMScheduler:
+    """Limita las completions en vuelo y reparte los turnos en round-robin por client_id."""
+
+    def __init__(
+        self,
+        max_concurrency: int = AI_MAX_CONCURRENCY,
+        rpm_limit: int = AI_RPM_LIMIT,
+        tpm_limit: int = AI_TPM_LIMIT,
+        max_queue: int = AI_QUEUE_MAX,
+        max_queue_per_client: int = AI_QUEUE_MAX_PER_CLIENT,
+    ) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit)
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._active = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.client_id)
+        if self.max_queue and self.queue_depth() >= self.max_queue:
+            raise SchedulerBusy("Cola global del proveedor llena")
+        if queue is not None and self.max_queue_per_client and len(queue) >= self.max_queue_per_client:
+            raise SchedulerBusy(f"Demasiadas solicitudes pendientes para {waiter.client_id}")
+        if queue is None:
+            queue = self._queues[waiter.client_id] = deque()
+        queue.append(waiter)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.client_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[waiter.client_id]
+        self._dispatch()
+
+    def _schedule_wakeup(self, delay: float) -> None:
+        if self._timer is not None:
+            return
+
+        def wake() -> None:
+            self._timer = None
+            self._dispatch()
+
+        self._timer = asyncio.get_running_loop().call_later(delay, wake)
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrency and self._queues:
+            client_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            delay = max(self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+            if delay > 0:
+                self._schedule_wakeup(delay)
+                break
+            queue.popleft()
+            # Round-robin: el cliente atendido pasa al final de la ronda.
+            del self._queues[client_id]
+            if queue:
+                self._queues[client_id] = queue
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self._active += 1
+            waiter.granted = True
+            waiter.changed.set()
+        self._update_positions()
+        metrics.LLM_QUEUE_DEPTH.set(self.queue_depth())
+        metrics.LLM_ACTIVE.set(self._active)
+
+    def _update_positions(self) -> None:
+        queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+        depth = max((len(queue) for queue in queues), default=0)
+        for turn in range(depth):
+            for queue in queues:
+                if turn < len(queue):
+                    position += 1
+                    waiter = queue[turn]
+                    if waiter.position != position:
+                        waiter.position = position
+                        waiter.changed.set()
+
+    async def acquire(
+        self,
+        client_id: str,
+        tokens: int,
+        on_position: Optional[PositionCallback] = None,
+    ) -> None:
+        """Espera un turno; ``on_position`` recibe la posición en cola cada vez que cambia."""
+        waiter = _Waiter(client_id=client_id, tokens=tokens)
+        self._enqueue(waiter)
+        self._dispatch()
+        reported = 0
+        try:
+            while not waiter.granted:
+                await waiter.changed.wait()
+                waiter.changed.clear()
+                if not waiter.granted and on_position is not None and waiter.position != reported:
+                    reported = waiter.position
+                    await on_position(reported)
+        except BaseException:
+            if waiter.granted:
+                self.requests.refund(1)
+                self.release(tokens, 0)
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self, reserved_tokens: int, used_tokens: int) -> None:
+        self._active = max(0, self._active - 1)
+        if reserved_tokens > used_tokens:
+            self.tokens.refund(reserved_tokens - used_tokens)
+        elif used_tokens > reserved_tokens:
+            self.tokens.take(used_tokens - reserved_tokens)
+        self._dispatch()
+
+    async def stream(
+        self,
+        client_id: str,
+        messages: List[Dict[str, str]],
+        on_position: Optional[PositionCallback] = None,
+    ) -> AsyncIterator[str]:
+        """Versión planificada de :func:`chatbot.astream_chat_completion`."""
+        prompt_tokens = estimate_prompt_tokens(messages)
+        reserved = prompt_tokens + AI_EXPECTED_COMPLETION_TOKENS
+        await self.acquire(client_id, reserved, on_position)
+        used = prompt_tokens
+        try:
+            async for delta in chatbot.astream_chat_completion(messages):
+                used += estimate_tokens(delta)
+                yield delta
+        finally:
+            self.release(reserved, used)
+            logging.debug(
+                "Completion de %s terminada (tokens≈%s, activas=%s, en cola=%s)",
+                client_id,
+                used,
+                self._active,
+                self.queue_depth(),
+            )
+
+
+llm_scheduler = LLMScheduler()
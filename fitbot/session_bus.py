@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import secrets
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fitbot.redis_pool import REDIS_MODE, build_client
+
+WS_CLUSTER_MODE = os.getenv("WS_CLUSTER_MODE", "0").lower() in {"1", "true", "yes", "on"}
+
+_CHANNEL_FMT = "fitbot:session:{client_id}:events"
+
+Deliver = Callable[[str, str], Awaitable[None]]
+
+
+def _text(value: Any) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class SessionBus:
+    """Reparte frames de una sesión entre nodos con Redis pub/sub.
+
+    Cada nodo se suscribe al canal de los ``client_id`` que tienen al menos un socket
+    local; los mensajes publicados por el propio nodo se ignoran al recibirlos.
+    """
+
+    def __init__(self, deliver: Deliver, client: Any = None) -> None:
+        self.node_id = secrets.token_hex(6)
+        self._deliver = deliver
+        self._client = client
+        self._owns_client = client is None
+        self._pubsub: Any = None
+        self._channels: Dict[str, str] = {}
+        self._subscribed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def channel(client_id: str) -> str:
+        return _CHANNEL_FMT.format(client_id=client_id)
+
+    async def start(self) -> None:
+        if self._client is None:
+            # PUBLISH se propaga a todo el Cluster, así que alcanza con un nodo cualquiera.
+            self._client = build_client(mode="standalone" if REDIS_MODE == "cluster" else REDIS_MODE)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._task = asyncio.create_task(self._listen())
+        logging.info("Bus de sesiones activo (nodo %s)", self.node_id)
+
+    async def subscribe(self, client_id: str) -> None:
+        channel = self.channel(client_id)
+        self._channels[channel] = client_id
+        await self._pubsub.subscribe(channel)
+        self._subscribed.set()
+
+    async def unsubscribe(self, client_id: str) -> None:
+        channel = self.channel(client_id)
+        if self._channels.pop(channel, None) is not None:
+            with suppress(Exception):
+                await self._pubsub.unsubscribe(channel)
+
+    async def publish(self, client_id: str, frame: str) -> None:
+        await self._client.publish(self.channel(client_id), f"{self.node_id} {frame}")
+
+    async def _listen(self) -> None:
+        while True:
+            await self._subscribed.wait()
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logging.warning("Bus de sesiones sin conexión (%s); reintentando", exc)
+                await asyncio.sleep(1.0)
+                continue
+            if not message or message.get("type") != "message":
+                continue
+            origin, _, frame = _text(message["data"]).partition(" ")
+            client_id = self._channels.get(_text(message["channel"]))
+            if origin == self.node_id or client_id is None:
+                continue
+            try:
+                await self._deliver(client_id, frame)
+            except Exception as exc:
+                logging.warning("No se pudo reenviar un frame a %s: %s", client_id, exc)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await self._task
+            self._task = None
+        if self._pubsub is not None:
+            with suppress(Exception):
+                await self._pubsub.aclose()
+        if self._owns_client and self._client is not None:
+            with suppress(Exception):
+                await self._client.aclose()
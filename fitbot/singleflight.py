@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
+
+from fitbot.scheduler import PositionCallback
+
+Producer = Callable[[PositionCallback], AsyncIterator[str]]
+
+
+class _Flight:
+    """Una generación en curso con su buffer de repetición y sus suscriptores."""
+
+    def __init__(self) -> None:
+        self.deltas: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.position_callbacks: Set[PositionCallback] = set()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self) -> None:
+        await self._changed.wait()
+
+    async def broadcast_position(self, position: int) -> None:
+        for callback in list(self.position_callbacks):
+            # Un suscriptor caído no debe cortar la generación de los demás.
+            with suppress(Exception):
+                await callback(position)
+
+
+class SingleFlight:
+    """Agrupa solicitudes idénticas concurrentes sobre un único stream upstream."""
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, _Flight] = {}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def _run(self, key: str, flight: _Flight, produce: Producer) -> None:
+        try:
+            async for delta in produce(flight.broadcast_position):
+                flight.deltas.append(delta)
+                flight.notify()
+        except asyncio.CancelledError:
+            # Nunca se propaga un CancelledError a los suscriptores: no lo cancelaron a ellos.
+            flight.error = RuntimeError("flight cancelled")
+        except Exception as exc:
+            flight.error = exc
+        finally:
+            flight.done = True
+            flight.notify()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def stream(
+        self,
+        key: str,
+        produce: Producer,
+        on_position: Optional[PositionCallback] = None,
+    ) -> AsyncIterator[str]:
+        """Itera los fragmentos de ``key``; quien llega tarde recibe primero los ya emitidos."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, produce))
+        else:
+            logging.debug("Solicitud idéntica en curso; se comparte el stream (%s)", key[:12])
+        flight.subscribers += 1
+        if on_position is not None:
+            flight.position_callbacks.add(on_position)
+
+        index = 0
+        try:
+            while True:
+                while index < len(flight.deltas):
+                    yield flight.deltas[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            flight.position_callbacks.discard(on_position)
+            if flight.subscribers == 0 and flight.task is not None and not flight.done:
+                # Se saca del índice antes de cancelar para que un pedido idéntico que llegue
+                # mientras la tarea termina arranque una generación nueva.
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
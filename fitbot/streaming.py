@@ -0,0 +1,133 @@
+import asyncio
+import os
+import time
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Mapping
+
+WS_FLUSH_MS = int(os.getenv("WS_FLUSH_MS", "30"))
+WS_FLUSH_BYTES = int(os.getenv("WS_FLUSH_BYTES", "1024"))
+WS_FLUSH_MAX_MS = int(os.getenv("WS_FLUSH_MAX_MS", "250"))
+WS_FLUSH_MAX_BYTES = int(os.getenv("WS_FLUSH_MAX_BYTES", "16384"))
+
+_END = object()
+# Fragmentos que se adelantan al socket; con la cola llena la generación espera.
+_QUEUE_SIZE = 64
+
+
+@dataclass(frozen=True)
+class FlushSettings:
+    """Ventana de agrupación de fragmentos; ``window_ms=0`` envía cada fragmento tal cual."""
+
+    window_ms: int = WS_FLUSH_MS
+    max_bytes: int = WS_FLUSH_BYTES
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"flush_ms": self.window_ms, "flush_bytes": self.max_bytes}
+
+
+def _clamp(raw: Any, default: int, low: int, high: int) -> int:
+    try:
+        value = int(raw)
+    except (TypeError, ValueError):
+        return default
+    return max(low, min(high, value))
+
+
+def negotiate(params: Mapping[str, str]) -> FlushSettings:
+    """Toma ``flush_ms``/``flush_bytes`` pedidos por el cliente, acotados a los límites del servidor."""
+    return FlushSettings(
+        window_ms=_clamp(params.get("flush_ms"), WS_FLUSH_MS, 0, WS_FLUSH_MAX_MS),
+        max_bytes=_clamp(params.get("flush_bytes"), WS_FLUSH_BYTES, 1, WS_FLUSH_MAX_BYTES),
+    )
+
+
+@dataclass
+class FrameStats:
+    replies: int = 0
+    frames: int = 0
+    deltas: int = 0
+    bytes: int = 0
+
+    def record(self, frames: int, deltas: int, size: int) -> None:
+        self.replies += 1
+        self.frames += frames
+        self.deltas += deltas
+        self.bytes += size
+
+    def as_dict(self) -> Dict[str, float]:
+        replies = max(1, self.replies)
+        return {
+            "replies": self.replies,
+            "frames": self.frames,
+            "deltas": self.deltas,
+            "bytes": self.bytes,
+            "frames_per_reply": round(self.frames / replies, 2),
+            "deltas_per_frame": round(self.deltas / max(1, self.frames), 2),
+        }
+
+
+frame_stats = FrameStats()
+
+
+async def coalesce(deltas: AsyncIterator[str], settings: FlushSettings) -> AsyncIterator[str]:
+    """Agrupa fragmentos por ventana de tiempo y por tamaño.
+
+    El primer fragmento y los que llegan después de una pausa mayor que la ventana
+    salen de inmediato; en ráfagas se junta lo recibido hasta que vence la ventana
+    o se alcanza ``max_bytes``.
+    """
+    if settings.window_ms <= 0:
+        async for delta in deltas:
+            yield delta
+        return
+
+    window = settings.window_ms / 1000
+    queue: asyncio.Queue = asyncio.Queue(_QUEUE_SIZE)
+    failure: List[BaseException] = []
+    stopping = False
+
+    async def pump() -> None:
+        try:
+            async for delta in deltas:
+                await queue.put(delta)
+        except asyncio.CancelledError as exc:
+            if stopping:
+                raise
+            # Se canceló el upstream, no este consumidor: no es un final exitoso.
+            failure.append(exc)
+        except Exception as exc:
+            failure.append(exc)
+        if not stopping:
+            await queue.put(_END)
+
+    task = asyncio.create_task(pump())
+    pending: List[str] = []
+    size = 0
+    last_flush = float("-inf")
+    try:
+        while True:
+            timeout = None if not pending else max(0.0, last_flush + window - time.monotonic())
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+            if item is _END:
+                break
+            if item:
+                pending.append(item)
+                size += len(item)
+            now = time.monotonic()
+            if pending and (item is None or size >= settings.max_bytes or now - last_flush >= window):
+                yield "".join(pending)
+                pending, size, last_flush = [], 0, now
+        if pending:
+            yield "".join(pending)
+        if failure:
+            raise failure[0]
+    finally:
+        if not task.done():
+            stopping = True
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
@@ -1,8 +1,13 @@
 import argparse
 import asyncio
+import codecs
 import getpass
+import json
 import sys
-from typing import List
+from contextlib import suppress
+from typing import Any, Dict, List, Optional, Tuple
+
+from fitbot.tcp import protocol
 
 RESET = "\033[0m"
 BOLD = "\033[1m"
@@ -30,6 +35,9 @@ FAILURE_MARKERS = [
     "necesitás indicar",
 ]
 
+# Los frames con el historial o respuestas largas superan el límite por defecto de 64 KiB.
+FRAME_LIMIT = 4 * 1024 * 1024
+
 
 def _prompt_initial_command() -> str:
     menu = (
@@ -115,12 +123,15 @@ async def run_client(host: str, port: int, auto: bool = True) -> None:
         print("Modo manual: escribí /guest, /register <usuario> <clave> o /login <usuario> <clave>.")
 
     async def recv_task() -> None:
+        # Se imprime lo que llega sin esperar el fin de línea: las respuestas vienen por fragmentos.
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
         while True:
-            data = await reader.readline()
+            data = await reader.read(4096)
             if not data:
+                print(decoder.decode(b"", final=True), end="")
                 print("[Servidor desconectado]")
                 break
-            print(data.decode("utf-8", errors="replace"), end="")
+            print(decoder.decode(data), end="", flush=True)
 
     async def send_task() -> None:
         loop = asyncio.get_running_loop()
@@ -138,6 +149,91 @@ async def run_client(host: str, port: int, auto: bool = True) -> None:
     await writer.wait_closed()
 
 
+async def open_framed(host: str, port: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Conecta y negocia el protocolo de frames JSON; descarta la bienvenida en texto."""
+    reader, writer = await asyncio.open_connection(host, port, limit=FRAME_LIMIT)
+    writer.write((protocol.NEGOTIATE + "\n").encode("utf-8"))
+    await writer.drain()
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("El servidor cerró la conexión antes del saludo")
+        if line.startswith(b"{") and protocol.decode(line).get("type") == "hello":
+            return reader, writer
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("El servidor cerró la conexión")
+    return protocol.decode(line)
+
+
+async def run_batch(
+    host: str,
+    port: int,
+    prompts: List[str],
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    register: bool = False,
+    out=None,
+) -> int:
+    """Envía todos los mensajes en una misma conexión y escribe una línea JSON por respuesta.
+
+    Devuelve 0 si todas las respuestas llegaron bien, 1 si alguna falló y 2 si falló el login.
+    """
+    out = out or sys.stdout
+    reader, writer = await open_framed(host, port)
+    try:
+        if username:
+            auth = {"id": 0, "op": "register" if register else "login", "username": username, "password": password}
+        else:
+            auth = {"id": 0, "op": "guest"}
+        writer.write(protocol.encode(auth))
+        await writer.drain()
+        frame = await _read_frame(reader)
+        if not frame.get("ok"):
+            print(json.dumps({"error": frame.get("error", "auth_failed")}), file=out)
+            writer.write(protocol.encode({"id": 1, "op": "quit"}))
+            await writer.drain()
+            await _read_frame(reader)
+            return 2
+
+        # Todos los pedidos salen juntos; el servidor los responde en orden.
+        for index, text in enumerate(prompts, start=1):
+            writer.write(protocol.encode({"id": index, "op": "chat", "text": text}))
+        writer.write(protocol.encode({"id": len(prompts) + 1, "op": "quit"}))
+        await writer.drain()
+
+        failures = 0
+        pending = len(prompts)
+        while pending:
+            frame = await _read_frame(reader)
+            kind = frame.get("type")
+            if kind not in {"done", "error"} or not isinstance(frame.get("id"), int):
+                continue
+            prompt_text = prompts[frame["id"] - 1] if 0 < frame["id"] <= len(prompts) else None
+            result: Dict[str, Any] = {"id": frame["id"], "prompt": prompt_text}
+            if kind == "done":
+                result["reply"] = frame.get("text", "")
+            else:
+                failures += 1
+                result["error"] = frame.get("error")
+            print(json.dumps(result, ensure_ascii=False), file=out, flush=True)
+            pending -= 1
+        return 1 if failures else 0
+    finally:
+        writer.close()
+        with suppress(Exception):
+            await writer.wait_closed()
+
+
+def _read_prompts(path: str) -> List[str]:
+    handle = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with handle:
+        return [line.strip() for line in handle if line.strip()]
+
+
 if __name__ == "__main__":  
     parser = argparse.ArgumentParser(description="Cliente TCP simple para FitBot")
     parser.add_argument("host", nargs="?", default="127.0.0.1", help="Host del servidor")
@@ -147,6 +243,22 @@ if __name__ == "__main__":
         action="store_true",
         help="No enviar comandos automáticos (manejá todo desde la consola)",
     )
+    parser.add_argument(
+        "--batch",
+        metavar="ARCHIVO",
+        help="Modo no interactivo: envía cada línea del archivo (- = stdin) y escribe las respuestas en JSON",
+    )
+    parser.add_argument("--user", help="Usuario para --batch (sin esto se usa modo invitado)")
+    parser.add_argument("--password", help="Clave para --batch (si falta se pide por consola)")
+    parser.add_argument("--register", action="store_true", help="Con --batch, crear el usuario en lugar de loguearse")
     args = parser.parse_args()
 
+    if args.batch:
+        password = args.password
+        if args.user and password is None:
+            password = getpass.getpass("Clave: ")
+        code = asyncio.run(
+            run_batch(args.host, args.port, _read_prompts(args.batch), args.user, password, args.register)
+        )
+        sys.exit(code)
     asyncio.run(run_client(args.host, args.port, auto=not args.no_auto))
@@ -0,0 +1,122 @@
+"""Control de flujo del servidor TCP: límites por IP y escritura agrupada con buffer acotado."""
+
+import asyncio
+import os
+import time
+from typing import Dict, List, Tuple
+
+# Conexiones simultáneas y mensajes por segundo (con ráfaga) por IP; 0 = sin límite.
+# Los contadores son por proceso: con --workers el tope efectivo se multiplica.
+TCP_MAX_CONN_PER_IP = int(os.getenv("TCP_MAX_CONN_PER_IP", "20"))
+TCP_MSG_RATE = float(os.getenv("TCP_MSG_RATE", "5"))
+TCP_MSG_BURST = int(os.getenv("TCP_MSG_BURST", "20"))
+# Bytes pendientes de envío antes de esperar al cliente, y cuánto se lo espera.
+TCP_WRITE_BUFFER = int(os.getenv("TCP_WRITE_BUFFER", str(256 * 1024)))
+TCP_WRITE_TIMEOUT = float(os.getenv("TCP_WRITE_TIMEOUT", "30"))
+
+# Con más IPs que esto se descartan los buckets que ya se recargaron por completo.
+_MAX_TRACKED = 10000
+
+
+class RateLimiter:
+    """Token bucket por clave: ``rate`` por segundo con ráfagas de hasta ``burst``."""
+
+    def __init__(self, rate: float = TCP_MSG_RATE, burst: int = TCP_MSG_BURST) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def allow(self, key: str) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1.0
+        self._buckets[key] = (tokens - 1.0 if allowed else tokens, now)
+        if len(self._buckets) > _MAX_TRACKED:
+            self._prune(now)
+        return allowed
+
+    def _prune(self, now: float) -> None:
+        refill = self.burst / self.rate
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated >= refill:
+                del self._buckets[key]
+
+
+class ConnectionLimiter:
+    """Cuenta conexiones abiertas por IP."""
+
+    def __init__(self, limit: int = TCP_MAX_CONN_PER_IP) -> None:
+        self.limit = limit
+        self._open: Dict[str, int] = {}
+
+    def acquire(self, key: str) -> bool:
+        count = self._open.get(key, 0)
+        if 0 < self.limit <= count:
+            return False
+        self._open[key] = count + 1
+        return True
+
+    def release(self, key: str) -> None:
+        count = self._open.get(key, 0) - 1
+        if count > 0:
+            self._open[key] = count
+        else:
+            self._open.pop(key, None)
+
+
+class CoalescingWriter:
+    """Agrupa las escrituras de una misma vuelta del loop en un solo ``write``.
+
+    Solo espera al cliente cuando lo pendiente supera ``max_buffer``; si tampoco lee en
+    ``timeout`` segundos se corta la conexión, así un cliente lento no retiene memoria
+    ni frena la sesión indefinidamente.
+    """
+
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        max_buffer: int = TCP_WRITE_BUFFER,
+        timeout: float = TCP_WRITE_TIMEOUT,
+    ) -> None:
+        self.writer = writer
+        self.max_buffer = max_buffer
+        self.timeout = timeout
+        self._chunks: List[bytes] = []
+        self._size = 0
+        self._scheduled = False
+        self.writes = 0
+
+    def pending(self) -> int:
+        return self._size + self.writer.transport.get_write_buffer_size()
+
+    async def send(self, data: bytes) -> None:
+        if self.writer.is_closing():
+            raise ConnectionResetError("La conexión está cerrada")
+        self._chunks.append(data)
+        self._size += len(data)
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+        if self.pending() > self.max_buffer:
+            await self.drain()
+
+    def flush(self) -> None:
+        self._scheduled = False
+        if not self._chunks or self.writer.is_closing():
+            return
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        self.writes += 1
+        self.writer.write(data)
+
+    async def drain(self) -> None:
+        self.flush()
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.timeout or None)
+        except asyncio.TimeoutError:
+            self.writer.transport.abort()
+            raise ConnectionResetError("El cliente no lee lo que se le envía") from None
@@ -0,0 +1,45 @@
+"""Protocolo de frames JSON para clientes programáticos del servidor TCP.
+
+Después de conectarse, el cliente envía la línea ``/proto json``. El servidor responde
+con un frame ``hello`` y a partir de ahí cada línea es un objeto JSON. Los pedidos
+llevan ``id`` y ``op``; todas las respuestas repiten el ``id`` del pedido:
+
+    {"id": 1, "op": "login", "username": "ana", "password": "..."}
+    {"id": 1, "type": "auth", "ok": true, "client_id": "..."}
+    {"id": 2, "op": "chat", "text": "armame una rutina"}
+    {"id": 2, "type": "delta", "text": "Para "}
+    {"id": 2, "type": "done", "text": "Para empezar..."}
+
+Se pueden enviar varios pedidos sin esperar respuesta. Un pedido puede indicar
+``channel``: cada canal es una conversación independiente (con su propio login) y
+sus respuestas llevan el mismo ``channel``. Los pedidos de un canal se atienden en
+orden; los de canales distintos, en paralelo. ``{"op": "cancel", "target": 2}``
+corta el pedido 2 del canal (sin ``target``, el que esté en curso), que termina con
+``{"type": "error", "error": "cancelled"}``; una respuesta ya generada no se corta. Si
+la cola del canal está llena el pedido se rechaza con ``{"type": "error", "error": "busy"}``,
+y mientras el servidor drena, los ``chat`` nuevos con ``"error": "draining"``.
+"""
+
+import json
+from typing import Any, Dict
+
+VERSION = 1
+NEGOTIATE = "/proto json"
+DEFAULT_CHANNEL = ""
+OPS = ("guest", "register", "login", "chat", "clear", "log", "stats", "history", "cancel", "ping", "quit")
+AUTH_OPS = frozenset({"guest", "register", "login", "ping", "quit"})
+
+Frame = Dict[str, Any]
+
+
+def encode(frame: Frame) -> bytes:
+    # JSON escapa los saltos de línea, así que cada frame ocupa exactamente una línea.
+    return (json.dumps(frame, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def decode(line: bytes) -> Frame:
+    """Frame de una línea recibida; ValueError si no es un objeto JSON."""
+    frame = json.loads(line.decode("utf-8"))
+    if not isinstance(frame, dict):
+        raise ValueError("El frame debe ser un objeto JSON")
+    return frame
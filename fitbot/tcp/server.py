@@ -1,15 +1,26 @@
 import asyncio
 import hashlib
 import logging
-import multiprocessing as mp
+import os
 import secrets
+import signal
 import socket
+import tempfile
+import time
 from contextlib import suppress
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from fitbot import chat_store
 from fitbot import chatbot
+from fitbot import metrics
+from fitbot import prompt
+from fitbot import replies
+from fitbot import workouts
+from fitbot.scheduler import SchedulerBusy
+from fitbot.tcp import flow
+from fitbot.tcp import protocol
+from fitbot.tcp import supervisor
 
 RESET = "\033[0m"
 BOLD = "\033[1m"
@@ -33,20 +44,65 @@ WELCOME = (
     f"{COLOR_USER}/clear{RESET}{COLOR_INFO} borra el historial guardado y "
     f"{COLOR_USER}/quit{RESET}{COLOR_INFO} termina la sesión.{RESET}"
 )
-FALLBACK = f"{COLOR_ERROR}No pude generar respuesta ahora. Intentá nuevamente.{RESET}"
+TCP_METRICS_PORT = int(os.getenv("TCP_METRICS_PORT", "0"))
+# chunks: cada fragmento se escribe apenas llega; lines: solo líneas completas; off: respuesta entera.
+TCP_STREAM_MODE = os.getenv("TCP_STREAM_MODE", "chunks").lower()
+STREAM_MODES = ("chunks", "lines", "off")
+# Canales por conexión con frames JSON y respuestas que esa conexión genera a la vez.
+TCP_MAX_CHANNELS = int(os.getenv("TCP_MAX_CHANNELS", "32"))
+TCP_MAX_INFLIGHT = int(os.getenv("TCP_MAX_INFLIGHT", "4"))
+CHANNEL_QUEUE_SIZE = 64
+# Segundos sin recibir una línea completa antes de cerrar (0 = sin límite) y largo máximo de línea.
+TCP_IDLE_TIMEOUT = float(os.getenv("TCP_IDLE_TIMEOUT", "600"))
+TCP_MAX_LINE = int(os.getenv("TCP_MAX_LINE", str(16 * 1024)))
+HISTORY_PAGE_SIZE = 10
+
+FALLBACK_TEXT = "No pude generar respuesta ahora. Intentá nuevamente."
+FALLBACK = f"{COLOR_ERROR}{FALLBACK_TEXT}{RESET}"
+BUSY = f"{COLOR_WARN}Hay muchas consultas en curso. Esperá unos segundos y volvé a intentar.{RESET}"
+TOO_MANY_CONNECTIONS = "Demasiadas conexiones desde tu dirección. Intentá más tarde.\n"
+RATE_LIMITED = f"{COLOR_WARN}Estás enviando mensajes muy rápido; este no se procesó.{RESET}"
+IDLE_CLOSED = f"{COLOR_INFO}Sesión cerrada por inactividad.{RESET}"
+LINE_TOO_LONG = f"{COLOR_ERROR}Mensaje demasiado largo; se cierra la conexión.{RESET}"
+DRAINING = f"{COLOR_WARN}El servidor se está reiniciando; volvé a conectarte en unos segundos.{RESET}"
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
+@dataclass
+class LoadStats:
+    """Carga del proceso que el worker reporta al supervisor."""
+
+    connections: int = 0
+    replies_in_flight: int = 0
+    replies_total: int = 0
+    # Mientras arranca ya reporta, para que el supervisor no lo dé por colgado.
+    starting: bool = True
+    # Al drenar no se empiezan respuestas nuevas, así las que están en curso terminan.
+    draining: bool = False
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "connections": self.connections,
+            "replies_in_flight": self.replies_in_flight,
+            "replies_total": self.replies_total,
+            "starting": int(self.starting),
+            "draining": int(self.draining),
+        }
+
+
+load = LoadStats()
+connection_limiter = flow.ConnectionLimiter()
+message_limiter = flow.RateLimiter()
+# Tareas de las conexiones abiertas, para cerrarlas al terminar el drenado.
+_connections: Set["asyncio.Task[Any]"] = set()
+
+
 def _build_client_id() -> str:
     token = secrets.token_hex(6)
     return f"tcp-{token}"
 
 
-def _compose_messages(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    return [{"role": "system", "content": chatbot.SYSTEM_PROMPT}] + history
-
-
 def _hash_password(password: str) -> str:
     return hashlib.sha256(password.encode("utf-8")).hexdigest()
 
@@ -58,13 +114,44 @@ class SessionContext:
     persist_history: bool = False
     active: bool = False
     history: List[Dict[str, str]] = field(default_factory=list)
+    summary: str = ""
+    profile: str = ""
+    stream_mode: str = TCP_STREAM_MODE if TCP_STREAM_MODE in STREAM_MODES else "chunks"
+    # Cursores de /history por número de página.
+    history_cursors: Dict[int, Optional[str]] = field(default_factory=dict)
+
+    def begin(self, client_id: str, username: Optional[str] = None, persist: bool = False) -> None:
+        self.client_id = client_id
+        self.username = username
+        self.persist_history = persist
+        self.active = True
 
     def reset_history(self) -> None:
         self.history.clear()
+        self.summary = ""
+        self.history_cursors.clear()
+        if self.client_id:
+            prompt.summarizer.discard(self.client_id)
 
     def remember(self, role: str, content: str) -> None:
         self.history.append({"role": role, "content": content})
-        self.history[:] = self.history[-20:]
+
+    def forget_last(self, role: str, content: str) -> None:
+        """Quita el último mensaje si es ese (p. ej. el de una respuesta cancelada)."""
+        if self.history and self.history[-1] == {"role": role, "content": content}:
+            self.history.pop()
+
+    def build_prompt(self) -> List[Dict[str, str]]:
+        plan = prompt.build_prompt(self.history, self.summary, profile=self.profile)
+        if plan.overflow and self.client_id:
+            del self.history[: len(plan.overflow)]
+            prompt.summarizer.schedule(self.client_id, plan.overflow, lambda: self.summary, self._apply_summary)
+        return plan.messages
+
+    async def _apply_summary(self, summary: str, last_digest: str) -> None:
+        self.summary = summary
+        if self.persist_history and self.client_id:
+            await chat_store.set_summary(self.client_id, summary, last_digest)
 
 
 def _format_dialog(header: str, continuation: str, text: str) -> str:
@@ -76,18 +163,113 @@ def _format_dialog(header: str, continuation: str, text: str) -> str:
     return "\n".join(formatted)
 
 
-async def _generate_reply(history: List[Dict[str, str]]) -> str:
-    prompt = _compose_messages(history)
+class DialogStream:
+    """Da formato de ``_format_dialog`` a una respuesta que llega por fragmentos.
+
+    Descarta el espacio inicial, retiene el final hasta ver más texto (como ``strip``)
+    y agrega el prefijo de continuación a cada línea aunque el salto quede entre dos
+    fragmentos. Con ``line_buffered`` solo entrega líneas completas.
+    """
+
+    def __init__(self, header: str, continuation: str, line_buffered: bool = False) -> None:
+        self.header = header
+        self.continuation = continuation
+        self.line_buffered = line_buffered
+        self.started = False
+        self._pending = ""
+        self._unsent = ""
+
+    def feed(self, delta: str) -> str:
+        text = self._pending + delta.replace("\r\n", "\n").replace("\r", "\n")
+        out = ""
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self.started = True
+            out = f"{self.header}: "
+        body = text.rstrip()
+        self._pending = text[len(body) :]
+        if body:
+            first, *rest = body.split("\n")
+            out += first
+            out += "".join(f"\n{self.continuation} {line}" if line else f"\n{self.continuation}" for line in rest)
+        return self._emit(out)
+
+    def finish(self) -> str:
+        """Cierra la línea en curso; vacío si nunca llegó texto visible."""
+        self._pending = ""
+        if not self.started:
+            return ""
+        out, self._unsent = self._unsent + "\n", ""
+        return out
+
+    def _emit(self, out: str) -> str:
+        if not self.line_buffered:
+            return out
+        self._unsent += out
+        cut = self._unsent.rfind("\n") + 1
+        out, self._unsent = self._unsent[:cut], self._unsent[cut:]
+        return out
+
+
+async def _complete(ctx: SessionContext, on_delta, on_position) -> Tuple[str, Optional[str]]:
+    """Texto generado y, si falló, el motivo: ``busy``, ``error`` o ``empty``."""
+    messages = ctx.build_prompt()
     fragments: List[str] = []
+    load.replies_in_flight += 1
+    load.replies_total += 1
     try:
-        async for delta in chatbot.astream_chat_completion(prompt):
+        async for delta in replies.stream_reply(ctx.client_id or "tcp", messages, on_position=on_position):
             if delta:
                 fragments.append(delta)
+                await on_delta(delta)
+    except SchedulerBusy as exc:
+        logging.warning("Solicitud TCP de %s rechazada por la cola: %s", ctx.client_id, exc)
+        reason: Optional[str] = "busy"
+    except ConnectionError:
+        raise
     except Exception as exc:  
         logging.error("Error generando respuesta en modo TCP: %s", exc)
-        return FALLBACK
-    text = "".join(fragments).strip()
-    return text or FALLBACK
+        reason = "error"
+    else:
+        text = "".join(fragments).strip()
+        reason = None if text else "empty"
+    finally:
+        load.replies_in_flight -= 1
+    if reason is not None:
+        metrics.FALLBACK_REPLIES.labels("tcp", reason).inc()
+        return "", reason
+    return text, None
+
+
+async def _generate_reply(ctx: SessionContext, send_line, send_text=None) -> str:
+    """Genera la respuesta y la envía; con ``send_text`` la transmite mientras llega."""
+    stream = None
+    if send_text is not None and ctx.stream_mode != "off":
+        stream = DialogStream(BOT_TAG, BOT_CONT, line_buffered=ctx.stream_mode == "lines")
+
+    async def notify_queue(position: int) -> None:
+        await send_line(f"{INFO_TAG} {COLOR_INFO}En cola… posición {position}{RESET}")
+
+    async def on_delta(delta: str) -> None:
+        if stream is not None:
+            chunk = stream.feed(delta)
+            if chunk:
+                await send_text(chunk)
+
+    text, reason = await _complete(ctx, on_delta, notify_queue)
+    if reason is not None:
+        text = BUSY if reason == "busy" else FALLBACK
+        if stream is not None and stream.started:
+            await send_text(stream.finish())
+            await send_line(text)
+            return text
+    elif stream is not None:
+        await send_text(stream.finish())
+        return text
+    await send_line(_format_dialog(BOT_TAG, BOT_CONT, text))
+    return text
 
 
 async def _send_history(send_line, entries: List[Dict[str, str]]) -> None:
@@ -106,12 +288,85 @@ async def _send_history(send_line, entries: List[Dict[str, str]]) -> None:
     await send_line("")
 
 
+async def _show_history_page(ctx: SessionContext, arg: str, send_line) -> None:
+    if not (ctx.persist_history and ctx.client_id):
+        await send_line(f"{COLOR_INFO}El historial guardado solo está disponible con /login.{RESET}")
+        return
+    arg = arg.strip()
+    page = max(1, int(arg)) if arg.isdigit() else 1
+    client_id = ctx.client_id
+    try:
+        result = await chat_store.page_at(
+            lambda cursor: chat_store.get_history_page(client_id, cursor, limit=HISTORY_PAGE_SIZE),
+            page,
+            ctx.history_cursors,
+        )
+    except Exception as exc:  
+        logging.exception("Error leyendo historial de %s: %s", client_id, exc)
+        await send_line(f"{COLOR_ERROR}No pude leer el historial. Intentá más tarde.{RESET}")
+        return
+    if not result.items:
+        text = "No hay mensajes guardados." if page == 1 else "No hay más mensajes."
+        await send_line(f"{COLOR_INFO}{text}{RESET}")
+        return
+    await send_line(f"{INFO_TAG} Historial guardado (página {page})")
+    for item in result.items:
+        await send_line(f"{DIM}{item.get('created_at') or ''}{RESET}")
+        if item.get("role") == "user":
+            await send_line(_format_dialog(USER_TAG, USER_CONT, item.get("content", "")))
+        else:
+            await send_line(_format_dialog(BOT_TAG, BOT_CONT, item.get("content", "")))
+    if result.next_cursor:
+        await send_line(
+            f"{COLOR_INFO}Usá {COLOR_USER}/history {page + 1}{RESET}{COLOR_INFO} para ver mensajes anteriores.{RESET}"
+        )
+
+
+async def _log_workout(ctx: SessionContext, entry: str, send_line) -> None:
+    if not (ctx.persist_history and ctx.client_id):
+        await send_line(f"{COLOR_INFO}Para registrar entrenamientos iniciá sesión con /login.{RESET}")
+        return
+    if not entry:
+        await send_line(f"{COLOR_WARN}Uso: /log <actividad>  (ejemplo: /log pushups 3x10){RESET}")
+        return
+    try:
+        await chat_store.log_workout(ctx.client_id, entry)
+        ctx.profile = workouts.format_profile(await chat_store.get_workout_stats(ctx.client_id))
+    except Exception as exc:  
+        logging.exception("Error registrando entrenamiento de %s: %s", ctx.client_id, exc)
+        await send_line(f"{COLOR_ERROR}No pude guardar el registro. Intentá más tarde.{RESET}")
+        return
+    await send_line(f"{COLOR_SUCCESS}Registro guardado: {entry}{RESET}")
+
+
+async def _show_stats(ctx: SessionContext, send_line) -> None:
+    if not (ctx.persist_history and ctx.client_id):
+        await send_line(f"{COLOR_INFO}Las estadísticas solo están disponibles con /login.{RESET}")
+        return
+    try:
+        stats = await chat_store.get_workout_stats(ctx.client_id)
+    except Exception as exc:  
+        logging.exception("Error leyendo estadísticas de %s: %s", ctx.client_id, exc)
+        await send_line(f"{COLOR_ERROR}No pude leer tus estadísticas. Intentá más tarde.{RESET}")
+        return
+    ctx.profile = workouts.format_profile(stats)
+    await send_line(_format_dialog(BOT_TAG, BOT_CONT, workouts.format_stats(stats)))
+
+
+async def _set_stream_mode(ctx: SessionContext, mode: str, send_line) -> None:
+    if mode not in STREAM_MODES:
+        await send_line(
+            f"{COLOR_INFO}Modo actual: {ctx.stream_mode}. Uso: /stream chunks|lines|off "
+            f"(fragmentos al llegar, líneas completas o respuesta entera).{RESET}"
+        )
+        return
+    ctx.stream_mode = mode
+    await send_line(f"{COLOR_SUCCESS}Modo de respuesta: {mode}.{RESET}")
+
+
 async def _activate_guest(ctx: SessionContext, send_line) -> None:
-    ctx.client_id = _build_client_id()
-    ctx.username = None
-    ctx.persist_history = False
+    ctx.begin(_build_client_id())
     ctx.reset_history()
-    ctx.active = True
     await send_line("")
     await send_line(f"{COLOR_SUCCESS}Modo invitado activado. Esta conversación no se guardará.{RESET}")
     await send_line(f"{COLOR_INFO}Ya podés empezar a chatear.{RESET}")
@@ -119,11 +374,8 @@ async def _activate_guest(ctx: SessionContext, send_line) -> None:
 
 async def _register_user(username: str, password: str, ctx: SessionContext, send_line) -> None:
     client_id = await chat_store.register_user(username, _hash_password(password))
-    ctx.client_id = client_id
-    ctx.username = username
-    ctx.persist_history = True
+    ctx.begin(client_id, username, persist=True)
     ctx.reset_history()
-    ctx.active = True
     await send_line("")
     await send_line(f"{COLOR_SUCCESS}¡Bienvenido, {username}! Tu cuenta quedó creada.{RESET}")
     await send_line(
@@ -131,33 +383,51 @@ async def _register_user(username: str, password: str, ctx: SessionContext, send
     )
 
 
-async def _login_user(username: str, password: str, ctx: SessionContext, send_line) -> None:
+async def _check_login(username: str, password: str) -> Tuple[Optional[str], str]:
+    """``client_id`` del usuario, o None y el motivo: ``unknown_user`` o ``bad_password``."""
     record = await chat_store.get_user(username)
     if not record:
-        await send_line("Usuario inexistente. Registrate con /register.")
-        return
-
+        return None, "unknown_user"
     expected_hash = record.get("password_hash", "")
     if not expected_hash or expected_hash != _hash_password(password):
-        await send_line("Clave incorrecta. Intentá nuevamente.")
-        return
+        return None, "bad_password"
+    return record.get("client_id") or _build_client_id(), ""
+
 
-    client_id = record.get("client_id") or _build_client_id()
-    ctx.client_id = client_id
-    ctx.username = username
-    ctx.persist_history = True
+async def _restore_session(ctx: SessionContext) -> List[Dict[str, str]]:
+    """Carga historial, resumen y perfil guardados; devuelve los últimos mensajes."""
+    client_id = ctx.client_id
     try:
         await chat_store.upsert_session(client_id)
-        ctx.history = await chat_store.get_history(client_id, limit=20)
+        restored = await chat_store.get_history(client_id, limit=20)
+        stored_summary = await chat_store.get_summary(client_id)
+        ctx.profile = workouts.format_profile(await chat_store.get_workout_stats(client_id))
+        ctx.summary = stored_summary["text"]
+        ctx.history = prompt.drop_summarized(restored, stored_summary["last_digest"])
     except Exception as exc:  
         logging.exception("Error restaurando historial de %s: %s", client_id, exc)
+        restored = []
         ctx.reset_history()
-    ctx.active = True
+    return restored
+
+
+async def _login_user(username: str, password: str, ctx: SessionContext, send_line) -> None:
+    client_id, reason = await _check_login(username, password)
+    if client_id is None:
+        if reason == "unknown_user":
+            await send_line("Usuario inexistente. Registrate con /register.")
+        else:
+            await send_line("Clave incorrecta. Intentá nuevamente.")
+        return
+
+    ctx.begin(client_id, username, persist=True)
+    restored = await _restore_session(ctx)
     await send_line("")
     await send_line(f"{COLOR_SUCCESS}¡Hola de nuevo, {username}! Historial restaurado.{RESET}")
-    await _send_history(send_line, ctx.history)
+    await _send_history(send_line, restored)
     await send_line(
-        f"{COLOR_INFO}Cuando quieras, usá {COLOR_USER}/clear{RESET}{COLOR_INFO} para vaciar el historial o "
+        f"{COLOR_INFO}Cuando quieras, usá {COLOR_USER}/history{RESET}{COLOR_INFO} para ver mensajes anteriores, "
+        f"{COLOR_USER}/clear{RESET}{COLOR_INFO} para vaciar el historial o "
         f"{COLOR_USER}/quit{RESET}{COLOR_INFO} para salir.{RESET}"
     )
 
@@ -221,35 +491,403 @@ async def _clear_history(ctx: SessionContext, send_line) -> None:
         await send_line(f"{COLOR_INFO}Historial temporal reiniciado (modo invitado).{RESET}")
 
 
-async def _persist_message(ctx: SessionContext, role: str, content: str) -> None:
+async def _persist_turn(ctx: SessionContext, message: str, reply: str) -> None:
     if ctx.persist_history and ctx.client_id:
-        await chat_store.append_message(ctx.client_id, role, content)
+        await chat_store.append_messages(ctx.client_id, [("user", message), ("assistant", reply)])
+
+
+async def _framed_auth(ctx: SessionContext, op: str, request: protocol.Frame, reply) -> None:
+    if op == "guest":
+        ctx.begin(_build_client_id())
+        ctx.reset_history()
+        await reply({"type": "auth", "ok": True, "client_id": ctx.client_id, "persist": False})
+        return
+    username, password = request.get("username"), request.get("password")
+    if not (isinstance(username, str) and isinstance(password, str) and username and password):
+        await reply({"type": "auth", "ok": False, "error": "bad_request"})
+        return
+    if op == "register":
+        try:
+            client_id = await chat_store.register_user(username, _hash_password(password))
+        except ValueError:
+            await reply({"type": "auth", "ok": False, "error": "user_exists"})
+            return
+        ctx.begin(client_id, username, persist=True)
+        ctx.reset_history()
+        await reply({"type": "auth", "ok": True, "client_id": client_id, "persist": True})
+        return
+    client_id, reason = await _check_login(username, password)
+    if client_id is None:
+        await reply({"type": "auth", "ok": False, "error": reason})
+        return
+    ctx.begin(client_id, username, persist=True)
+    restored = await _restore_session(ctx)
+    await reply({"type": "auth", "ok": True, "client_id": client_id, "persist": True, "history": restored})
+
+
+async def _framed_chat(ctx: SessionContext, request: protocol.Frame, reply, on_generated=None) -> None:
+    """Genera y guarda el turno; ``on_generated`` avisa que ya no se puede cancelar."""
+    message = request.get("text")
+    if not isinstance(message, str) or not message.strip():
+        await reply({"type": "error", "error": "bad_request", "message": "Falta 'text'"})
+        return
+    message = message.strip()
+    if load.draining:
+        await reply({"type": "error", "error": "draining"})
+        return
+
+    async def on_delta(delta: str) -> None:
+        await reply({"type": "delta", "text": delta})
+
+    async def on_position(position: int) -> None:
+        await reply({"type": "queue", "position": position})
+
+    ctx.remember("user", message)
+    try:
+        text, reason = await _complete(ctx, on_delta, on_position)
+    except asyncio.CancelledError:
+        ctx.forget_last("user", message)
+        raise
+    if on_generated is not None:
+        on_generated()
+    if reason is not None:
+        # Igual que en modo texto, el historial guarda la respuesta de reemplazo.
+        ctx.remember("assistant", FALLBACK_TEXT)
+        await _persist_turn(ctx, message, FALLBACK_TEXT)
+        await reply({"type": "error", "error": reason})
+        return
+    ctx.remember("assistant", text)
+    await _persist_turn(ctx, message, text)
+    await reply({"type": "done", "text": text})
+
+
+async def _framed_request(ctx: SessionContext, op: str, request: protocol.Frame, reply, on_generated=None) -> None:
+    if op in {"guest", "register", "login"}:
+        await _framed_auth(ctx, op, request, reply)
+    elif op == "chat":
+        await _framed_chat(ctx, request, reply, on_generated)
+    elif op == "clear":
+        ctx.reset_history()
+        if ctx.persist_history and ctx.client_id:
+            await chat_store.clear_history(ctx.client_id)
+        await reply({"type": "result", "ok": True})
+    elif not (ctx.persist_history and ctx.client_id):
+        await reply({"type": "error", "error": "not_persistent", "message": "Requiere login"})
+    elif op == "log":
+        entry = request.get("entry")
+        if not isinstance(entry, str) or not entry.strip():
+            await reply({"type": "error", "error": "bad_request", "message": "Falta 'entry'"})
+            return
+        await chat_store.log_workout(ctx.client_id, entry.strip())
+        stats = await chat_store.get_workout_stats(ctx.client_id)
+        ctx.profile = workouts.format_profile(stats)
+        await reply({"type": "result", "ok": True, "data": {"workout": workouts.parse(entry).as_dict()}})
+    elif op == "stats":
+        stats = await chat_store.get_workout_stats(ctx.client_id)
+        ctx.profile = workouts.format_profile(stats)
+        await reply({"type": "result", "ok": True, "data": stats})
+    elif op == "history":
+        limit = request.get("limit") if isinstance(request.get("limit"), int) else HISTORY_PAGE_SIZE
+        cursor = request.get("cursor")
+        if cursor is not None and not isinstance(cursor, str):
+            await reply({"type": "error", "error": "bad_request", "message": "'cursor' debe ser un texto"})
+            return
+        try:
+            page = await chat_store.get_history_page(ctx.client_id, cursor, limit=limit)
+        except ValueError as exc:
+            await reply({"type": "error", "error": "bad_request", "message": str(exc)})
+            return
+        await reply({"type": "result", "ok": True, "data": page.as_dict()})
+
+
+async def _read_line(reader: asyncio.StreamReader, busy) -> bytes:
+    """``readline`` con ``TCP_IDLE_TIMEOUT``; no vence mientras ``busy()`` sea verdadero.
+
+    Lanza TimeoutError por inactividad y ValueError si la línea supera el límite del reader.
+    """
+    while True:
+        try:
+            return await asyncio.wait_for(reader.readline(), TCP_IDLE_TIMEOUT or None)
+        except asyncio.TimeoutError:
+            if not busy():
+                raise
+
+
+@dataclass
+class _Channel:
+    """Conversación lógica dentro de una conexión con frames JSON."""
+
+    ctx: SessionContext
+    queue: "asyncio.Queue[Optional[protocol.Frame]]" = field(default_factory=lambda: asyncio.Queue(CHANNEL_QUEUE_SIZE))
+    worker: Optional["asyncio.Task[None]"] = None
+    # Pedido en curso (id, tarea), ids en cola e ids en cola que ya se cancelaron.
+    current: Optional[Tuple[Any, "asyncio.Task[None]"]] = None
+    pending: Set[Any] = field(default_factory=set)
+    cancelled: Set[Any] = field(default_factory=set)
+
+    def cancel(self, target: Any) -> bool:
+        if self.current is not None and (target is None or self.current[0] == target):
+            self.current[1].cancel()
+            return True
+        if target is not None and target in self.pending:
+            self.cancelled.add(target)
+            return True
+        return False
+
+
+async def _run_channel(channel: _Channel, make_reply, inflight: asyncio.Semaphore) -> None:
+    """Atiende en orden los pedidos de un canal; los canales corren en paralelo."""
+    ctx = channel.ctx
+    while True:
+        request = await channel.queue.get()
+        if request is None:
+            return
+        request_id, op = request.get("id"), request["op"]
+        channel.pending.discard(request_id)
+        reply = make_reply(request)
+        if request_id in channel.cancelled:
+            channel.cancelled.discard(request_id)
+            await reply({"type": "error", "error": "cancelled"})
+            continue
+        if not ctx.active and op not in protocol.AUTH_OPS:
+            await reply({"type": "error", "error": "unauthenticated"})
+            continue
+
+        def generated() -> None:
+            # Con la respuesta ya generada, un cancel llegaría tarde: el turno se guarda
+            # y se responde ``done`` completo en vez de quedar a medias.
+            channel.current = None
+
+        async def dispatch() -> None:
+            if op == "chat":
+                # Limita cuántas respuestas genera a la vez una misma conexión.
+                async with inflight:
+                    await _framed_request(ctx, op, request, reply, generated)
+            else:
+                await _framed_request(ctx, op, request, reply)
+
+        task = asyncio.create_task(dispatch())
+        channel.current = (request_id, task)
+        try:
+            await asyncio.wait({task})
+        finally:
+            channel.current = None
+            if not task.done():
+                task.cancel()
+        if task.cancelled():
+            await reply({"type": "error", "error": "cancelled"})
+        elif isinstance(task.exception(), ConnectionError):
+            return
+        elif task.exception() is not None:
+            exc = task.exception()
+            logging.error("Error atendiendo el pedido %s (%s) de %s: %s", request_id, op, ctx.client_id, exc)
+            await reply({"type": "error", "error": "internal"})
+
+
+async def _serve_framed(
+    reader: asyncio.StreamReader,
+    out: flow.CoalescingWriter,
+    ctx: SessionContext,
+    peer: str = "",
+) -> None:
+    """Atiende la conexión con el protocolo de frames JSON (ver ``fitbot.tcp.protocol``).
+
+    Cada ``channel`` tiene su propia sesión; los pedidos de un canal se atienden en
+    orden y los de canales distintos en paralelo, con frames intercalados.
+    """
+    lock = asyncio.Lock()
+    inflight = asyncio.Semaphore(max(1, TCP_MAX_INFLIGHT))
+    channels: Dict[str, _Channel] = {}
+
+    async def send(frame: protocol.Frame) -> None:
+        data = protocol.encode(frame)
+        async with lock:
+            await out.send(data)
+
+    def make_reply(request: protocol.Frame):
+        tag: Dict[str, Any] = {"id": request.get("id")}
+        if "channel" in request:
+            tag["channel"] = request["channel"]
+
+        async def reply(frame: Dict[str, Any]) -> None:
+            await send({**tag, **frame})
+
+        return reply
+
+    def open_channel(name: str) -> Optional[_Channel]:
+        channel = channels.get(name)
+        if channel is None:
+            if len(channels) >= max(1, TCP_MAX_CHANNELS):
+                return None
+            # El canal por defecto conserva la sesión abierta antes de negociar.
+            channel = _Channel(ctx if name == protocol.DEFAULT_CHANNEL else SessionContext())
+            channel.worker = asyncio.create_task(_run_channel(channel, make_reply, inflight))
+            channels[name] = channel
+        return channel
+
+    async def drain_channels() -> None:
+        for channel in channels.values():
+            await channel.queue.put(None)
+        await asyncio.gather(*(channel.worker for channel in channels.values() if channel.worker))
+
+    await send(
+        {
+            "type": "hello",
+            "protocol": "json",
+            "version": protocol.VERSION,
+            "ops": list(protocol.OPS),
+            "max_channels": TCP_MAX_CHANNELS,
+            "max_inflight": TCP_MAX_INFLIGHT,
+        }
+    )
+    def busy() -> bool:
+        return any(channel.current or channel.pending for channel in channels.values())
+
+    try:
+        while True:
+            try:
+                data = await _read_line(reader, busy)
+            except asyncio.TimeoutError:
+                await send({"id": None, "type": "error", "error": "idle_timeout"})
+                return
+            except ValueError:
+                await send({"id": None, "type": "error", "error": "line_too_long", "limit": TCP_MAX_LINE})
+                return
+            if not data:
+                # Medio cierre: se terminan de responder los pedidos ya recibidos.
+                await drain_channels()
+                return
+            if not data.strip():
+                continue
+            try:
+                request = protocol.decode(data)
+            except ValueError as exc:
+                await send({"id": None, "type": "error", "error": "bad_frame", "message": str(exc)})
+                continue
+            op = request.get("op")
+            reply = make_reply(request)
+            if op not in protocol.OPS:
+                await reply({"type": "error", "error": "unknown_op", "message": str(op)})
+                continue
+            if op != "cancel" and not message_limiter.allow(peer):
+                await reply({"type": "error", "error": "rate_limited"})
+                continue
+            if op == "ping":
+                await reply({"type": "pong"})
+                continue
+            if op == "quit":
+                await drain_channels()
+                await reply({"type": "bye"})
+                return
+            name = str(request.get("channel", protocol.DEFAULT_CHANNEL))
+            if op == "cancel":
+                channel = channels.get(name)
+                target = request.get("target")
+                if channel is not None and channel.cancel(target):
+                    await reply({"type": "result", "ok": True, "data": {"target": target}})
+                else:
+                    await reply({"type": "error", "error": "not_found"})
+                continue
+            channel = open_channel(name)
+            if channel is None:
+                await reply({"type": "error", "error": "too_many_channels"})
+                continue
+            try:
+                # Nunca se espera acá: un canal con la cola llena no debe frenar la lectura
+                # de los demás (ni los ``cancel``).
+                channel.queue.put_nowait(request)
+            except asyncio.QueueFull:
+                await reply({"type": "error", "error": "busy"})
+                continue
+            channel.pending.add(request.get("id"))
+    finally:
+        for channel in channels.values():
+            if channel.worker is not None and not channel.worker.done():
+                channel.worker.cancel()
+            if channel.ctx is not ctx and channel.ctx.persist_history and channel.ctx.client_id:
+                with suppress(Exception):
+                    await chat_store.flush(channel.ctx.client_id)
 
 
 async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
     addr = writer.get_extra_info("peername")
+    peer = str(addr[0]) if isinstance(addr, tuple) else str(addr)
+    if not connection_limiter.acquire(peer):
+        logging.warning("Conexión de %s rechazada: demasiadas conexiones desde esa IP", addr)
+        with suppress(Exception):
+            writer.write(TOO_MANY_CONNECTIONS.encode("utf-8"))
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), 1)
+        return
     logging.info("Cliente TCP conectado: %s", addr)
 
     session = SessionContext()
+    metrics.TCP_SESSIONS.inc()
+    load.connections += 1
+    task = asyncio.current_task()
+    if task is not None:
+        _connections.add(task)
+
+    out = flow.CoalescingWriter(writer)
+
+    async def send_text(text: str) -> None:
+        await out.send(text.encode("utf-8", errors="replace"))
 
     async def send_line(text: str) -> None:
-        writer.write((text + "\n").encode("utf-8", errors="replace"))
-        await writer.drain()
+        await send_text(text + "\n")
 
-    await send_line(WELCOME)
-    await send_line("")
+    # Las líneas se leen aparte para poder atender /cancel mientras se genera una respuesta.
+    lines: "asyncio.Queue[Optional[str]]" = asyncio.Queue(CHANNEL_QUEUE_SIZE)
+    generating: List["asyncio.Task[str]"] = []
 
-    try:
+    async def notify(text: str) -> None:
+        with suppress(Exception):
+            await send_line("")
+            await send_line(text)
+
+    async def read_lines() -> None:
         while True:
-            data = await reader.readline()
+            try:
+                data = await _read_line(reader, lambda: bool(generating) or not lines.empty())
+            except asyncio.TimeoutError:
+                await notify(IDLE_CLOSED)
+                data = b""
+            except ValueError:
+                await notify(LINE_TOO_LONG)
+                data = b""
+            except ConnectionError:
+                data = b""
             if not data:
-                break
+                await lines.put(None)
+                return
             message = data.decode("utf-8", errors="replace").strip()
-            if not message:
+            if message.lower() == "/cancel" and generating:
+                generating[0].cancel()
+                continue
+            if message and not message_limiter.allow(peer):
+                await notify(RATE_LIMITED)
                 continue
+            if message:
+                await lines.put(message)
+            if message.lower() == protocol.NEGOTIATE:
+                return  # desde acá lee _serve_framed
+
+    line_reader = asyncio.create_task(read_lines())
+    try:
+        await send_line(WELCOME)
+        await send_line("")
+
+        while True:
+            message = await lines.get()
+            if message is None:
+                break
 
             lowered = message.lower()
 
+            if lowered == protocol.NEGOTIATE:
+                await _serve_framed(reader, out, session, peer)
+                break
+
             if not session.active:
                 await _handle_auth_command(message, session, send_line)
                 continue
@@ -264,25 +902,75 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
                 await _clear_history(session, send_line)
                 continue
 
-            await _persist_message(session, "user", message)
-            session.remember("user", message)
+            if lowered == "/log" or lowered.startswith("/log "):
+                await send_line("")
+                await _log_workout(session, message[len("/log") :].strip(), send_line)
+                continue
 
-            reply = await _generate_reply(session.history)
-            await _persist_message(session, "assistant", reply)
-            session.remember("assistant", reply)
+            if lowered == "/stats":
+                await send_line("")
+                await _show_stats(session, send_line)
+                continue
+
+            if lowered == "/history" or lowered.startswith("/history "):
+                await send_line("")
+                await _show_history_page(session, message[len("/history") :], send_line)
+                continue
+
+            if lowered == "/stream" or lowered.startswith("/stream "):
+                await send_line("")
+                await _set_stream_mode(session, lowered[len("/stream") :].strip(), send_line)
+                continue
+
+            if lowered == "/cancel":
+                await send_line(f"{COLOR_INFO}No hay ninguna respuesta en curso.{RESET}")
+                continue
+
+            if load.draining:
+                await send_line(DRAINING)
+                continue
 
+            session.remember("user", message)
             await send_line("")
-            await send_line(_format_dialog(BOT_TAG, BOT_CONT, reply))
+            turn = asyncio.create_task(_generate_reply(session, send_line, send_text))
+            generating.append(turn)
+            try:
+                await asyncio.wait({turn})
+            finally:
+                generating.clear()
+                if not turn.done():
+                    turn.cancel()
+            if turn.cancelled():
+                session.forget_last("user", message)
+                await send_line("")
+                await send_line(f"{COLOR_WARN}Respuesta cancelada.{RESET}")
+                continue
+            reply = turn.result()
+            session.remember("assistant", reply)
+            await _persist_turn(session, message, reply)
     except asyncio.CancelledError:
         pass
+    except ConnectionError as exc:
+        logging.info("Conexión con %s cortada: %s", addr, exc)
     except Exception as exc:  
         logging.exception("Error atendiendo a %s: %s", addr, exc)
         with suppress(Exception):
             await send_line("FitBot: Ocurrió un error inesperado. Intentalo más tarde.")
     finally:
+        line_reader.cancel()
+        metrics.TCP_SESSIONS.dec()
+        load.connections -= 1
+        _connections.discard(task)
+        connection_limiter.release(peer)
+        if session.persist_history and session.client_id:
+            with suppress(Exception):
+                await chat_store.flush(session.client_id)
         try:
+            out.flush()
             writer.close()
-            await writer.wait_closed()
+            await asyncio.wait_for(writer.wait_closed(), out.timeout or None)
+        except asyncio.TimeoutError:
+            writer.transport.abort()
         except Exception:
             pass
         logging.info("Cliente TCP desconectado: %s", addr)
@@ -310,44 +998,105 @@ def _detect_default_host() -> str:
     return "0.0.0.0"
 
 
-async def _serve(host: str, port: int, reuse_port: bool) -> None:
-    if not chatbot.is_client_available():
+def _send_report(reports, slot: int) -> None:
+    with suppress(Exception):
+        reports.put_nowait((os.getpid(), {"worker": slot, **load.as_dict()}))
+
+
+async def _report_load(reports, slot: int) -> None:
+    """Envía la carga al supervisor; cada reporte cuenta también como señal de vida."""
+    while True:
+        _send_report(reports, slot)
+        await asyncio.sleep(supervisor.TCP_WORKER_REPORT_INTERVAL)
+
+
+async def _drain(server: asyncio.AbstractServer, timeout: float) -> None:
+    """Deja de aceptar conexiones y turnos nuevos, espera las respuestas en curso y cierra el resto."""
+    load.draining = True
+    server.close()
+    deadline = time.monotonic() + timeout
+    logging.info("Drenando %s conexiones (%s respuestas en curso)…", load.connections, load.replies_in_flight)
+    while load.replies_in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if load.replies_in_flight:
+        logging.warning("Se cortan %s respuestas en curso al vencer el drenado", load.replies_in_flight)
+    connections = list(_connections)
+    for task in connections:
+        task.cancel()
+    await asyncio.gather(*connections, return_exceptions=True)
+
+
+async def _serve(
+    host: str,
+    port: int,
+    reuse_port: bool,
+    sock: Optional[socket.socket] = None,
+    reports=None,
+    slot: int = 0,
+) -> None:
+    # Redis o el proveedor pueden tardar en responder: el worker reporta desde antes.
+    reporter = asyncio.create_task(_report_load(reports, slot)) if reports is not None else None
+    # El catálogo de modelos se consulta en segundo plano (chatbot.startup), sin bloquear el arranque.
+    await chatbot.startup()
+    if not chatbot.AI_API_KEY:
         logging.warning("El proveedor de IA no está disponible. Asegurate de configurar AI_API_KEY.")
 
-    await chat_store.init_db()
-    effective_reuse = reuse_port
     try:
-        server = await asyncio.start_server(handle_client, host=host, port=port, reuse_port=reuse_port)
-    except (OSError, ValueError) as exc:
-        if reuse_port:
-            logging.warning("No se pudo habilitar reuse_port: %s. Reintento con reuse_port desactivado.", exc)
-            server = await asyncio.start_server(handle_client, host=host, port=port, reuse_port=False)
-            effective_reuse = False
-        else:
-            raise
-    addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets or [])
+        await chat_store.init_db()
+    except Exception as exc:
+        logging.error("No se pudo inicializar Redis (%s); se reintentará en segundo plano", exc)
+    effective_reuse = reuse_port
+    if sock is not None:
+        # Socket abierto por el master (sin SO_REUSEPORT): todos los workers aceptan del mismo.
+        server = await asyncio.start_server(handle_client, sock=sock, limit=TCP_MAX_LINE)
+        effective_reuse = False
+    else:
+        try:
+            server = await asyncio.start_server(
+                handle_client, host=host, port=port, reuse_port=reuse_port, limit=TCP_MAX_LINE
+            )
+        except (OSError, ValueError) as exc:
+            if reuse_port:
+                logging.warning("No se pudo habilitar reuse_port: %s. Reintento con reuse_port desactivado.", exc)
+                server = await asyncio.start_server(
+                    handle_client, host=host, port=port, reuse_port=False, limit=TCP_MAX_LINE
+                )
+                effective_reuse = False
+            else:
+                raise
+    addrs = ", ".join(str(item.getsockname()) for item in server.sockets or [])
     logging.info("Servidor TCP FitBot escuchando en %s (reuse_port=%s)", addrs, effective_reuse)
 
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError, RuntimeError, ValueError):
+            loop.add_signal_handler(sig, stop.set)
     try:
-        async with server:
-            await server.serve_forever()
+        await server.start_serving()
+        load.starting = False
+        if reports is not None:
+            # Sin esperar al próximo intervalo: el reinicio escalonado aguarda este aviso.
+            _send_report(reports, slot)
+        await stop.wait()
+        await _drain(server, supervisor.TCP_DRAIN_TIMEOUT)
     finally:
+        if reporter is not None:
+            reporter.cancel()
+        server.close()
+        with suppress(Exception):
+            await prompt.summarizer.drain()
+        await chatbot.shutdown()
         await chat_store.close()
 
 
-def _worker_entry(host: str, port: int, reuse_port: bool) -> None:
+def _worker_entry(slot: int, reports, host: str, port: int, reuse_port: bool, sock: Optional[socket.socket]) -> None:
     try:
-        asyncio.run(_serve(host, port, reuse_port))
+        asyncio.run(_serve(host, port, reuse_port, sock=sock, reports=reports, slot=slot))
     except KeyboardInterrupt:
         pass
 
 
-def _spawn_worker(ctx: mp.context.BaseContext, host: str, port: int, reuse_port: bool) -> mp.Process:
-    proc = ctx.Process(target=_worker_entry, args=(host, port, reuse_port), daemon=False)
-    proc.start()
-    return proc
-
-
 async def _run_single(host: str, port: int, reuse_port: bool) -> None:
     await _serve(host, port, reuse_port)
 
@@ -366,30 +1115,49 @@ async def main() -> None:
         default=1,
         help="Cantidad de workers paralelos (usa reuse_port para balancear, default: 1)",
     )
+    parser.add_argument(
+        "--shared-socket",
+        action="store_true",
+        help="El master abre el socket y lo comparte con los workers (automático si no hay SO_REUSEPORT)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=TCP_METRICS_PORT,
+        help="Puerto HTTP para exponer métricas Prometheus (0 = deshabilitado)",
+    )
     args = parser.parse_args()
 
     workers = max(1, args.workers)
-    reuse_port = workers > 1
+
+    if workers > 1 and args.metrics_port and not metrics.PROMETHEUS_MULTIPROC_DIR:
+        # Los workers se crean con spawn y heredan el entorno: escriben sus métricas acá.
+        metrics.PROMETHEUS_MULTIPROC_DIR = tempfile.mkdtemp(prefix="fitbot-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics.PROMETHEUS_MULTIPROC_DIR
+    if args.metrics_port:
+        metrics.start_exporter(args.metrics_port, args.host)
 
     if workers == 1:
         await _run_single(args.host, args.port, reuse_port=False)
         return
 
-    logging.info("Iniciando %s workers en %s:%s con reuse_port", workers, args.host, args.port)
-    ctx = mp.get_context("spawn")
-    procs = [_spawn_worker(ctx, args.host, args.port, reuse_port) for _ in range(workers)]
-
+    sock = None
+    if args.shared_socket or not supervisor.reuse_port_supported():
+        sock = supervisor.listen_socket(args.host, args.port)
+        logging.info("Iniciando %s workers en %s:%s con socket compartido", workers, args.host, args.port)
+    else:
+        logging.info("Iniciando %s workers en %s:%s con reuse_port", workers, args.host, args.port)
+    pool = supervisor.Supervisor(
+        _worker_entry,
+        workers,
+        args=(args.host, args.port, sock is None, sock),
+        on_exit=metrics.mark_process_dead,
+    )
     try:
-        for proc in procs:
-            proc.join()
-    except KeyboardInterrupt:
-        logging.info("Recibido CTRL+C, finalizando workers…")
-        for proc in procs:
-            proc.terminate()
+        await pool.run()
     finally:
-        for proc in procs:
-            if proc.is_alive():
-                proc.join()
+        if sock is not None:
+            sock.close()
 
 
 if __name__ == "__main__":  
@@ -0,0 +1,283 @@
+"""Supervisor de los workers del servidor TCP.
+
+Reinicia con backoff a los workers que terminan, reemplaza a los que dejan de reportar
+carga, drena todo con SIGTERM y hace reinicios escalonados con SIGHUP (el worker nuevo
+arranca y reporta antes de drenar al viejo, así nunca se pierde capacidad). SIGUSR1
+escribe en el log la carga de cada worker.
+"""
+
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import socket
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TCP_RESTART_BACKOFF = float(os.getenv("TCP_RESTART_BACKOFF", "0.5"))
+TCP_RESTART_BACKOFF_MAX = float(os.getenv("TCP_RESTART_BACKOFF_MAX", "30"))
+TCP_DRAIN_TIMEOUT = float(os.getenv("TCP_DRAIN_TIMEOUT", "30"))
+TCP_WORKER_REPORT_INTERVAL = float(os.getenv("TCP_WORKER_REPORT_INTERVAL", "5"))
+TCP_WORKER_HEALTH_TIMEOUT = float(os.getenv("TCP_WORKER_HEALTH_TIMEOUT", "30"))
+TCP_STATUS_LOG_INTERVAL = float(os.getenv("TCP_STATUS_LOG_INTERVAL", "60"))
+
+# Un worker que vivió más que esto se considera estable: su backoff vuelve a cero.
+_STABLE_AFTER = 30.0
+_POLL_INTERVAL = 0.2
+# Margen sobre TCP_DRAIN_TIMEOUT antes de matar a un worker que no termina.
+_KILL_GRACE = 5.0
+
+
+def reuse_port_supported() -> bool:
+    if not hasattr(socket, "SO_REUSEPORT"):
+        return False
+    try:
+        with socket.socket() as probe:
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    except OSError:
+        return False
+    return True
+
+
+def listen_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """Socket de escucha que el master abre una vez y comparten todos los workers."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def backoff_delay(failures: int, base: float = TCP_RESTART_BACKOFF, cap: float = TCP_RESTART_BACKOFF_MAX) -> float:
+    """Espera antes del reinicio número ``failures`` seguido (0 = sin espera)."""
+    if failures <= 0:
+        return 0.0
+    return min(cap, base * 2 ** (failures - 1))
+
+
+@dataclass
+class WorkerState:
+    slot: int
+    process: Any
+    started_at: float
+    last_report: Optional[float] = None
+    load: Dict[str, Any] = field(default_factory=dict)
+    # True cuando el master le pidió terminar: su salida no se reinicia.
+    retiring: bool = False
+
+    @property
+    def healthy(self) -> bool:
+        """Reportó que ya acepta conexiones; mientras arranca solo cuenta como vivo."""
+        return self.last_report is not None and not self.load.get("starting") and self.process.is_alive()
+
+
+class Supervisor:
+    def __init__(
+        self,
+        target: Callable[..., None],
+        workers: int,
+        args: Tuple[Any, ...] = (),
+        on_exit: Optional[Callable[[Optional[int]], None]] = None,
+        health_timeout: float = TCP_WORKER_HEALTH_TIMEOUT,
+        drain_timeout: float = TCP_DRAIN_TIMEOUT,
+    ) -> None:
+        self.target = target
+        self.workers = workers
+        self.args = args
+        self.on_exit = on_exit
+        self.health_timeout = health_timeout
+        self.drain_timeout = drain_timeout
+        self._ctx = mp.get_context("spawn")
+        self.reports = self._ctx.Queue()
+        self._slots: Dict[int, WorkerState] = {}
+        # Reemplazos en curso (reinicio escalonado) y workers que se están drenando.
+        self._candidates: Dict[int, WorkerState] = {}
+        self._retiring: List[WorkerState] = []
+        self._failures: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = asyncio.Event()
+        self._rolling: Optional["asyncio.Task[None]"] = None
+        self.restarts = 0
+
+    def _spawn(self, slot: int) -> WorkerState:
+        process = self._ctx.Process(target=self.target, args=(slot, self.reports, *self.args), daemon=False)
+        process.start()
+        logging.info("Worker %s iniciado (pid %s)", slot, process.pid)
+        return WorkerState(slot=slot, process=process, started_at=time.monotonic())
+
+    def _all(self) -> List[WorkerState]:
+        return [*self._slots.values(), *self._candidates.values(), *self._retiring]
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "slot": state.slot,
+                "pid": state.process.pid,
+                "alive": state.process.is_alive(),
+                "retiring": state.retiring,
+                "uptime_s": round(time.monotonic() - state.started_at, 1),
+                **state.load,
+            }
+            for state in sorted(self._all(), key=lambda item: item.slot)
+        ]
+
+    def log_status(self) -> None:
+        for item in self.status():
+            logging.info("Worker %s: %s", item["slot"], item)
+
+    def request_stop(self) -> None:
+        self._stopping.set()
+
+    def request_rolling_restart(self) -> None:
+        if self._rolling is not None and not self._rolling.done():
+            logging.info("Ya hay un reinicio escalonado en curso")
+            return
+        self._rolling = asyncio.create_task(self.rolling_restart())
+
+    def _collect_reports(self) -> None:
+        by_pid = {state.process.pid: state for state in self._all()}
+        while True:
+            try:
+                pid, load = self.reports.get_nowait()
+            except queue.Empty:
+                return
+            state = by_pid.get(pid)
+            if state is not None:
+                state.last_report = time.monotonic()
+                state.load = load
+
+    def _reap(self, state: WorkerState) -> None:
+        state.process.join(0)
+        if self.on_exit is not None:
+            self.on_exit(state.process.pid)
+
+    def _check(self) -> None:
+        now = time.monotonic()
+        for state in list(self._retiring):
+            if not state.process.is_alive():
+                self._retiring.remove(state)
+                self._reap(state)
+        for slot, state in list(self._candidates.items()):
+            if not state.process.is_alive():
+                del self._candidates[slot]
+                self._reap(state)
+        for slot in range(self.workers):
+            state = self._slots.get(slot)
+            if state is not None and not state.process.is_alive():
+                del self._slots[slot]
+                self._reap(state)
+                lived = now - state.started_at
+                self._failures[slot] = 1 if lived > _STABLE_AFTER else self._failures.get(slot, 0) + 1
+                delay = backoff_delay(self._failures[slot])
+                self._restart_at[slot] = now + delay
+                logging.warning(
+                    "Worker %s (pid %s) terminó con código %s; se reinicia en %.1fs",
+                    slot,
+                    state.process.pid,
+                    state.process.exitcode,
+                    delay,
+                )
+            elif state is not None and slot not in self._candidates:
+                last_seen = state.last_report or state.started_at
+                if now - last_seen > self.health_timeout:
+                    logging.error(
+                        "Worker %s (pid %s) no reporta hace %.0fs; se reemplaza", slot, state.process.pid, now - last_seen
+                    )
+                    state.process.kill()
+            elif state is None and slot not in self._candidates and now >= self._restart_at.get(slot, 0.0):
+                self._slots[slot] = self._spawn(slot)
+                self.restarts += 1
+
+    async def _wait_exit(self, state: WorkerState, timeout: float) -> None:
+        await asyncio.to_thread(state.process.join, timeout)
+        if state.process.is_alive():
+            logging.warning("Worker %s (pid %s) no terminó a tiempo; se mata", state.slot, state.process.pid)
+            state.process.kill()
+            await asyncio.to_thread(state.process.join, 5)
+
+    def _retire(self, state: WorkerState) -> None:
+        state.retiring = True
+        self._retiring.append(state)
+        if state.process.is_alive():
+            state.process.terminate()  # SIGTERM: el worker deja de aceptar y drena
+
+    async def rolling_restart(self) -> None:
+        """Reemplaza los workers de a uno; el nuevo tiene que reportar antes de drenar al viejo."""
+        logging.info("Reinicio escalonado de %s workers", self.workers)
+        for slot in range(self.workers):
+            if self._stopping.is_set():
+                return
+            candidate = self._spawn(slot)
+            self._candidates[slot] = candidate
+            deadline = time.monotonic() + self.health_timeout
+            while not candidate.healthy and candidate.process.is_alive() and time.monotonic() < deadline:
+                await asyncio.sleep(_POLL_INTERVAL)
+            if self._candidates.pop(slot, None) is None or not candidate.healthy:
+                logging.error("El reemplazo del worker %s no quedó sano; se cancela el reinicio escalonado", slot)
+                self._retire(candidate)
+                return
+            old = self._slots.get(slot)
+            self._slots[slot] = candidate
+            self._failures[slot] = 0
+            if old is not None:
+                self._retire(old)
+                await self._wait_exit(old, self.drain_timeout + _KILL_GRACE)
+        logging.info("Reinicio escalonado completo")
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        handlers = (
+            ("SIGTERM", self.request_stop),
+            ("SIGINT", self.request_stop),
+            ("SIGHUP", self.request_rolling_restart),
+            ("SIGUSR1", self.log_status),
+        )
+        for name, handler in handlers:
+            if hasattr(signal, name):
+                with suppress(NotImplementedError, RuntimeError, ValueError):
+                    loop.add_signal_handler(getattr(signal, name), handler)
+
+        for slot in range(self.workers):
+            self._slots[slot] = self._spawn(slot)
+        next_log = time.monotonic() + TCP_STATUS_LOG_INTERVAL
+        try:
+            while not self._stopping.is_set():
+                self._collect_reports()
+                self._check()
+                if TCP_STATUS_LOG_INTERVAL > 0 and time.monotonic() >= next_log:
+                    self.log_status()
+                    next_log = time.monotonic() + TCP_STATUS_LOG_INTERVAL
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._stopping.wait(), _POLL_INTERVAL)
+        finally:
+            await self.stop()
+            for name, _ in handlers:
+                if hasattr(signal, name):
+                    with suppress(NotImplementedError, RuntimeError, ValueError):
+                        loop.remove_signal_handler(getattr(signal, name))
+
+    async def stop(self) -> None:
+        """SIGTERM a todos los workers y espera que drenen, hasta ``drain_timeout``."""
+        self._stopping.set()
+        if self._rolling is not None and not self._rolling.done():
+            self._rolling.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._rolling
+        states = self._all()
+        self._slots.clear()
+        self._candidates.clear()
+        self._retiring.clear()
+        logging.info("Drenando %s workers (hasta %.0fs)…", len(states), self.drain_timeout)
+        for state in states:
+            state.retiring = True
+            if state.process.is_alive():
+                state.process.terminate()
+        await asyncio.gather(*(self._wait_exit(state, self.drain_timeout + _KILL_GRACE) for state in states))
+        for state in states:
+            self._reap(state)
@@ -0,0 +1,193 @@
+import os
+import re
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from zoneinfo import ZoneInfo
+
+    _tz: Any = ZoneInfo(os.getenv("STATS_TIMEZONE", "UTC"))
+except Exception:  # Sin base de zonas horarias se cuentan los días en UTC.
+    _tz = timezone.utc
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_TIME_UNITS = r"(h|hs|horas?|min|mins|minutos?|s|seg|segs|segundos?)"
+# "3x45s" (series con tiempo) va antes que "3x10" (series con repeticiones).
+_SETS_TIME_RE = re.compile(rf"\b(\d+)\s*[x×*]\s*{_NUMBER}\s*{_TIME_UNITS}\b", re.IGNORECASE)
+_SETS_REPS_RE = re.compile(r"\b(\d+)\s*(?:[x×*]|series?\s*(?:de)?)\s*(\d+)\b", re.IGNORECASE)
+_WEIGHT_RE = re.compile(rf"@?\s*{_NUMBER}\s*(kg|kgs|kilos?|lb|lbs)\b", re.IGNORECASE)
+_DISTANCE_RE = re.compile(rf"{_NUMBER}\s*(km|kms|mts|metros)\b", re.IGNORECASE)
+_DURATION_RE = re.compile(rf"{_NUMBER}\s*{_TIME_UNITS}\b", re.IGNORECASE)
+_REPS_RE = re.compile(r"\b(\d+)\s*(?:reps?|repeticiones)?\b", re.IGNORECASE)
+
+_SECONDS = {"h": 3600, "hs": 3600, "hora": 3600, "horas": 3600, "min": 60, "mins": 60, "minuto": 60, "minutos": 60}
+_LB_TO_KG = 0.45359237
+
+
+@dataclass
+class WorkoutRecord:
+    """Una entrada de ``/log`` interpretada. ``reps`` es por serie."""
+
+    exercise: str
+    sets: int = 0
+    reps: int = 0
+    weight_kg: float = 0.0
+    duration_s: int = 0
+    distance_km: float = 0.0
+
+    @property
+    def total_reps(self) -> int:
+        return self.sets * self.reps
+
+    @property
+    def volume_kg(self) -> float:
+        return round(self.total_reps * self.weight_kg, 2)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "volume_kg": self.volume_kg}
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", "."))
+
+
+def _seconds(value: float, unit: str) -> int:
+    return int(value * _SECONDS.get(unit.lower(), 1))
+
+
+def parse(entry: str) -> WorkoutRecord:
+    """Extrae series, repeticiones, peso, duración y distancia; lo que sobra es el ejercicio.
+
+    Acepta formas como ``pushups 3x10``, ``sentadilla 5x5 @100kg``, ``plancha 3x45s``
+    o ``correr 5km 30min``.
+    """
+    text = entry.strip()
+    record = WorkoutRecord(exercise="")
+
+    def take(pattern: "re.Pattern[str]") -> Optional["re.Match[str]"]:
+        nonlocal text
+        match = pattern.search(text)
+        if match is not None:
+            text = text[: match.start()] + " " + text[match.end() :]
+        return match
+
+    match = take(_SETS_TIME_RE)
+    if match is not None:
+        record.sets = int(match.group(1))
+        record.duration_s = record.sets * _seconds(_number(match.group(2)), match.group(3))
+    else:
+        match = take(_SETS_REPS_RE)
+        if match is not None:
+            record.sets, record.reps = int(match.group(1)), int(match.group(2))
+
+    match = take(_WEIGHT_RE)
+    if match is not None:
+        weight = _number(match.group(1))
+        record.weight_kg = round(weight * _LB_TO_KG if match.group(2).lower().startswith("lb") else weight, 2)
+
+    match = take(_DISTANCE_RE)
+    if match is not None:
+        distance = _number(match.group(1))
+        record.distance_km = distance if match.group(2).lower().startswith("km") else distance / 1000
+
+    while (match := take(_DURATION_RE)) is not None:
+        record.duration_s += _seconds(_number(match.group(1)), match.group(2))
+
+    if not record.sets and not record.duration_s and not record.distance_km:
+        match = take(_REPS_RE)
+        if match is not None:
+            record.sets, record.reps = 1, int(match.group(1))
+
+    exercise = re.sub(r"[@,;:\-]+", " ", text)
+    record.exercise = " ".join(exercise.lower().split()) or "actividad"
+    return record
+
+
+def local_day(ts: float) -> int:
+    """Ordinal del día de ``ts`` en ``STATS_TIMEZONE`` (para contar rachas)."""
+    return datetime.fromtimestamp(ts, _tz).date().toordinal()
+
+
+def current_day() -> int:
+    return local_day(datetime.now(timezone.utc).timestamp())
+
+
+def week_key(day: int) -> str:
+    year, week, _ = date.fromordinal(day).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def recent_weeks(day: int, count: int) -> List[str]:
+    return [week_key(day - 7 * offset) for offset in range(count)]
+
+
+def next_streak(last_day: int, streak: int, best: int, day: int) -> Tuple[int, int, int]:
+    """Nuevo (último día, racha, mejor racha) al registrar actividad en ``day``."""
+    if day == last_day:
+        pass
+    elif day == last_day + 1:
+        streak += 1
+    elif day > last_day:
+        streak = 1
+    else:
+        return last_day, streak, best  # entrada con fecha anterior: no cambia la racha
+    return day, streak, max(best, streak)
+
+
+def _kg(value: float) -> str:
+    return f"{value:,.0f}".replace(",", ".") + " kg"
+
+
+def _minutes(seconds: float) -> str:
+    return f"{seconds / 60:.0f} min"
+
+
+def format_profile(stats: Dict[str, Any]) -> str:
+    """Resumen compacto de las estadísticas para el prompt del sistema; vacío si no hay datos."""
+    if not stats.get("workouts"):
+        return ""
+    parts = [f"{stats['workouts']} entrenamientos registrados"]
+    parts.append(f"racha actual {stats['streak']} días (mejor {stats['best_streak']})")
+    weeks = stats.get("weeks", [])
+    if weeks:
+        parts.append(f"volumen esta semana {_kg(weeks[0]['volume_kg'])}")
+        if len(weeks) > 1:
+            parts.append(f"semana anterior {_kg(weeks[1]['volume_kg'])}")
+    records = stats.get("records", {})
+    best_lifts = [f"{item['exercise']} {_kg(item['value'])}" for item in records.get("weight", [])[:3]]
+    if best_lifts:
+        parts.append("récords de peso: " + ", ".join(best_lifts))
+    best_reps = [f"{item['exercise']} {item['value']:.0f} reps" for item in records.get("reps", [])[:3]]
+    if best_reps:
+        parts.append("récords de repeticiones: " + ", ".join(best_reps))
+    return "; ".join(parts) + "."
+
+
+def format_stats(stats: Dict[str, Any]) -> str:
+    """Texto para el comando ``/stats``."""
+    if not stats.get("workouts"):
+        return "Todavía no hay estadísticas. Registrá entrenamientos con /log (p. ej. /log sentadilla 4x8 60kg)."
+    lines = [
+        "Tus estadísticas:",
+        f"- Entrenamientos: {stats['workouts']} ({stats['sets']} series, {stats['reps']} repeticiones)",
+        f"- Racha: {stats['streak']} días (mejor: {stats['best_streak']})",
+        f"- Volumen total: {_kg(stats['volume_kg'])}",
+    ]
+    if stats.get("duration_s"):
+        lines.append(f"- Tiempo total: {_minutes(stats['duration_s'])}")
+    if stats.get("distance_km"):
+        lines.append(f"- Distancia total: {stats['distance_km']:.1f} km")
+    weeks = [f"{week['week']}: {_kg(week['volume_kg'])}" for week in stats.get("weeks", [])]
+    if weeks:
+        lines.append("- Volumen semanal: " + ", ".join(weeks))
+    records = stats.get("records", {})
+    for kind, label, fmt in (
+        ("weight", "Récords de peso", _kg),
+        ("reps", "Récords de repeticiones", lambda value: f"{value:.0f}"),
+        ("duration", "Récords de tiempo", _minutes),
+    ):
+        items = records.get(kind, [])
+        if items:
+            lines.append(f"- {label}: " + ", ".join(f"{item['exercise']} {fmt(item['value'])}" for item in items))
+    return "\n".join(lines)
@@ -12,9 +12,28 @@ document.addEventListener('DOMContentLoaded', function () {
     localStorage.setItem('fitbotClientId', clientId);
   }
 
+  // Ventana con la que el servidor agrupa los fragmentos del stream (la acota a sus límites).
+  const STREAM_FLUSH_MS = 40;
+  const STREAM_FLUSH_BYTES = 2048;
+
   let ws = null;
   let reconnectAttempts = 0;
   let isWaitingResponse = false;
+  // Respuesta en curso: al reconectar se pide lo que falta desde el último seq visto.
+  let currentStream = null;
+  try { currentStream = JSON.parse(localStorage.getItem('fitbotStream') || 'null'); } catch {}
+  let endedStreamId = null;
+  // Viven fuera de connect() para seguir agregando al mismo mensaje después de reconectar.
+  let streamingEl = null;
+  let streamingText = null;
+  // Lo que había en pantalla de la respuesta al pedir retomarla; stream_resume parte de ahí.
+  let resumeFrom = null;
+
+  function saveStream(stream) {
+    currentStream = stream;
+    if (stream) localStorage.setItem('fitbotStream', JSON.stringify(stream));
+    else localStorage.removeItem('fitbotStream');
+  }
 
   function setUIEnabled(enabled) {
     if (sendButton) sendButton.disabled = !enabled;
@@ -40,10 +59,23 @@ document.addEventListener('DOMContentLoaded', function () {
   function wsUrl() {
     const wsScheme = location.protocol === 'https:' ? 'wss' : 'ws';
     const wsHost = location.host || '127.0.0.1:8000';
-    return `${wsScheme}://${wsHost}/ws/${encodeURIComponent(clientId)}`;
+    let params = `flush_ms=${STREAM_FLUSH_MS}&flush_bytes=${STREAM_FLUSH_BYTES}`;
+    resumeFrom = null;
+    if (currentStream && currentStream.id) {
+      // Tras recargar la página no queda nada en pantalla: se pide la respuesta desde el principio.
+      if (!streamingEl) currentStream.seq = 0;
+      const offset = currentStream.seq || 0;
+      resumeFrom = { id: currentStream.id, bubble: streamingEl, base: streamingEl ? streamingText.data : '' };
+      params += `&resume=${encodeURIComponent(currentStream.id)}&offset=${offset}`;
+    }
+    return `${wsScheme}://${wsHost}/ws/${encodeURIComponent(clientId)}?${params}`;
   }
 
   function connect() {
+    // Al reconectar el historial ya está en pantalla: se ignoran los frames de historial.
+    const skipHistory = chatWindow.childElementCount > 0;
+    // Con historial paginado cada página llega antes (más vieja) que la anterior.
+    let historyTop = null;
     try {
       ws = new WebSocket(wsUrl());
     } catch {
@@ -55,9 +87,6 @@ document.addEventListener('DOMContentLoaded', function () {
       setConnected(true);
     };
 
-    let streamingEl = null;
-    let streamingBuffer = '';
-
     ws.onmessage = async function (event) {
       hideTypingIndicator();
       let text = null;
@@ -69,30 +98,85 @@ document.addEventListener('DOMContentLoaded', function () {
         try {
           const data = JSON.parse(raw);
           if (data && data.type === 'history' && Array.isArray(data.messages)) {
+            if (skipHistory) return;
             for (const m of data.messages) {
               addMessage(m.content, m.role === 'user' ? 'user' : 'bot');
             }
             updateScrollBtn();
             return;
           }
+          if (data && data.type === 'history_page' && Array.isArray(data.messages)) {
+            if (skipHistory || !data.messages.length) return;
+            const anchor = historyTop || chatWindow.firstChild;
+            const first = historyTop === null;
+            historyTop = null;
+            for (const m of data.messages) {
+              const el = addMessage(m.content, m.role === 'user' ? 'user' : 'bot', anchor);
+              if (!historyTop) historyTop = el;
+            }
+            if (first) chatWindow.scrollTop = chatWindow.scrollHeight;
+            updateScrollBtn();
+            return;
+          }
+          if (data && data.type === 'stream_config') {
+            return;
+          }
+          if (data && data.type === 'queue') {
+            showTypingIndicator(`En cola (posición ${data.position})…`);
+            return;
+          }
+          if (data && data.type === 'stream_start') {
+            // Con otra respuesta en curso (p. ej. enviada desde otra pestaña) esta llega
+            // completa en su stream_end, sin mezclarse en la misma burbuja.
+            if (!currentStream) saveStream({ id: data.stream_id, seq: 0 });
+            return;
+          }
+          if (data && data.type === 'stream_gone') {
+            if (currentStream && currentStream.id === data.stream_id) saveStream(null);
+            streamingEl = null;
+            streamingText = null;
+            return;
+          }
+          if (data && data.type === 'stream_resume') {
+            // Manda sobre cualquier fragmento en vivo que se haya adelantado: la burbuja se
+            // rehace desde lo que había en pantalla al reconectar.
+            const from = resumeFrom && resumeFrom.id === data.stream_id ? resumeFrom : { bubble: null, base: '' };
+            resumeFrom = null;
+            if (!from.bubble) {
+              if (streamingEl) streamingEl.remove();
+              streamingEl = null;
+              if (data.prompt) addMessage(data.prompt, 'user');
+            }
+            showStreamBubble();
+            streamingText.data = from.base + normalize(data.delta || '');
+            saveStream({ id: data.stream_id, seq: data.seq || 0 });
+            isWaitingResponse = true;
+            setUIEnabled(false);
+            updateScrollBtn();
+            return;
+          }
           if (data && data.type === 'stream') {
-            if (!streamingEl) {
-              streamingEl = document.createElement('div');
-              streamingEl.className = 'd-flex justify-content-start';
-              streamingEl.innerHTML = `
-                <div class="p-2 rounded bg-secondary text-white" style="max-width: 80%;">
-                  <div id="stream-content" style="white-space: pre-wrap"></div>
-                </div>`;
-              chatWindow.appendChild(streamingEl);
-              chatWindow.scrollTop = chatWindow.scrollHeight;
+            if (data.stream_id && currentStream && data.stream_id !== currentStream.id) return;
+            if (data.seq && currentStream) {
+              if (data.seq <= currentStream.seq) return;
+              currentStream.seq = data.seq;
+              saveStream(currentStream);
             }
-            streamingBuffer += normalize(data.delta || '');
-            const el = streamingEl.querySelector('#stream-content');
-            if (el) el.textContent = streamingBuffer;
+            showStreamBubble();
+            // Agrega solo el fragmento nuevo en lugar de reescribir todo el texto.
+            streamingText.appendData(normalize(data.delta || ''));
             updateScrollBtn();
             return;
           }
           if (data && data.type === 'stream_end') {
+            if (data.stream_id && data.stream_id === endedStreamId) return;
+            if (data.stream_id && currentStream && data.stream_id !== currentStream.id) {
+              addMessage(data.content || '', 'bot');
+              updateScrollBtn();
+              return;
+            }
+            endedStreamId = data.stream_id || null;
+            saveStream(null);
             const html = DOMPurify.sanitize(marked.parse(normalize(data.content || '')));
             if (streamingEl) {
               const c = streamingEl.querySelector('#stream-content');
@@ -101,7 +185,7 @@ document.addEventListener('DOMContentLoaded', function () {
               addMessage(data.content || '', 'bot');
             }
             streamingEl = null;
-            streamingBuffer = '';
+            streamingText = null;
             isWaitingResponse = false;
             setUIEnabled(true);
             updateScrollBtn();
@@ -143,6 +227,20 @@ document.addEventListener('DOMContentLoaded', function () {
     };
   }
 
+  function showStreamBubble() {
+    if (streamingEl) return;
+    streamingEl = document.createElement('div');
+    streamingEl.className = 'd-flex justify-content-start';
+    streamingEl.innerHTML = `
+      <div class="p-2 rounded bg-secondary text-white" style="max-width: 80%;">
+        <div id="stream-content" style="white-space: pre-wrap"></div>
+      </div>`;
+    streamingText = document.createTextNode('');
+    streamingEl.querySelector('#stream-content').appendChild(streamingText);
+    chatWindow.appendChild(streamingEl);
+    chatWindow.scrollTop = chatWindow.scrollHeight;
+  }
+
   function scheduleReconnect() {
     const t = Math.min(30000, 500 * Math.pow(2, reconnectAttempts));
     reconnectAttempts += 1;
@@ -166,7 +264,7 @@ document.addEventListener('DOMContentLoaded', function () {
       .replace(/\\n/g, '\n');
   }
 
-  function addMessage(content, sender) {
+  function addMessage(content, sender, before) {
     const messageWrapper = document.createElement('div');
     if (sender === 'user') {
       messageWrapper.className = 'd-flex justify-content-end';
@@ -188,22 +286,35 @@ document.addEventListener('DOMContentLoaded', function () {
       wrap.appendChild(inner);
       messageWrapper.appendChild(wrap);
     }
+    if (before) {
+      // Mensajes viejos que se insertan arriba: se conserva la posición de lectura.
+      const fromBottom = chatWindow.scrollHeight - chatWindow.scrollTop;
+      chatWindow.insertBefore(messageWrapper, before);
+      chatWindow.scrollTop = chatWindow.scrollHeight - fromBottom;
+      return messageWrapper;
+    }
     const nearBottom = isNearBottom();
     chatWindow.appendChild(messageWrapper);
     if (nearBottom) scrollToBottomSmooth();
+    return messageWrapper;
   }
 
-  function showTypingIndicator() {
-    if (document.getElementById('typing-indicator')) return;
-    const w = document.createElement('div');
-    w.id = 'typing-indicator';
-    w.className = 'd-flex justify-content-start';
-    w.innerHTML = `
-      <div class="p-2 rounded bg-secondary text-white">
-        <div class="typing-indicator-dots"><span></span><span></span><span></span></div>
-      </div>`;
-    chatWindow.appendChild(w);
-    chatWindow.scrollTop = chatWindow.scrollHeight;
+  function showTypingIndicator(label) {
+    let w = document.getElementById('typing-indicator');
+    if (!w) {
+      w = document.createElement('div');
+      w.id = 'typing-indicator';
+      w.className = 'd-flex justify-content-start';
+      w.innerHTML = `
+        <div class="p-2 rounded bg-secondary text-white">
+          <div class="typing-indicator-dots"><span></span><span></span><span></span></div>
+          <small class="typing-indicator-label"></small>
+        </div>`;
+      chatWindow.appendChild(w);
+      chatWindow.scrollTop = chatWindow.scrollHeight;
+    }
+    const l = w.querySelector('.typing-indicator-label');
+    if (l) l.textContent = label || '';
   }
   function hideTypingIndicator() {
     const i = document.getElementById('typing-indicator');
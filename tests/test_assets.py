@@ -0,0 +1,45 @@
+from fastapi.testclient import TestClient
+
+from fitbot.app import app, static_assets
+
+
+def test_index_is_fingerprinted_and_revalidated():
+    client = TestClient(app)
+    r = client.get('/')
+    assert r.status_code == 200
+    assert r.headers['cache-control'] == 'no-cache'
+    version = static_assets.get('script.js').version
+    assert f'/static/script.js?v={version}' in r.text
+
+    r304 = client.get('/', headers={'If-None-Match': r.headers['etag']})
+    assert r304.status_code == 304
+
+
+def test_static_assets_compression_and_immutable_cache():
+    client = TestClient(app)
+    script = static_assets.get('script.js')
+    r = client.get(f'/static/script.js?v={script.version}', headers={'Accept-Encoding': 'gzip'})
+    assert r.status_code == 200
+    assert r.headers['content-encoding'] == 'gzip'
+    assert 'immutable' in r.headers['cache-control']
+    assert r.content == script.content
+
+    plain = client.get('/static/script.js', headers={'Accept-Encoding': 'identity'})
+    assert plain.headers['cache-control'] == 'no-cache'
+    assert 'content-encoding' not in plain.headers
+    assert client.get('/static/nada.js').status_code == 404
+
+
+def test_video_byte_ranges():
+    client = TestClient(app)
+    video = static_assets.get('abstract_background2.mp4')
+    size = len(video.content)
+    r = client.get('/static/abstract_background2.mp4', headers={'Range': 'bytes=100-199'})
+    assert r.status_code == 206
+    assert r.headers['content-range'] == f'bytes 100-199/{size}'
+    assert r.content == video.content[100:200]
+
+    tail = client.get('/static/abstract_background2.mp4', headers={'Range': 'bytes=-10'})
+    assert tail.content == video.content[-10:]
+    bad = client.get('/static/abstract_background2.mp4', headers={'Range': f'bytes={size}-'})
+    assert bad.status_code == 416
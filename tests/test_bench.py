@@ -0,0 +1,50 @@
+import json
+import os
+
+import httpx
+import pytest
+
+from fitbot.bench import load, mock_llm
+
+
+def test_percentile_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert load.percentile(values, 0.50) == 50.0
+    assert load.percentile(values, 0.99) == 99.0
+    assert load.percentile([], 0.95) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_mock_llm_streams_openai_chunks():
+    settings = mock_llm.MockSettings(tokens_per_sec=1000, first_token_ms=0, reply_tokens=5)
+    app = mock_llm.create_app(settings)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://mock") as client:
+        body = {"model": mock_llm.MOCK_MODEL, "messages": [], "stream": True}
+        response = await client.post("/v1/chat/completions", json=body)
+        events = [line[len("data: ") :] for line in response.text.splitlines() if line.startswith("data: ")]
+        assert events[-1] == "[DONE]"
+        chunks = [json.loads(event) for event in events[:-1]]
+        text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+        assert len(text.split()) == 5
+        assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+        assert (await client.get("/stats")).json()["streamed_tokens"] == 5
+
+
+@pytest.mark.asyncio
+async def test_tcp_run_reports_latencies():
+    args = load.build_parser().parse_args(
+        ["tcp", "--clients", "2", "--turns", "1", "--tokens-per-sec", "2000", "--first-token-ms", "5"]
+    )
+    from fitbot import chatbot
+    from fitbot.tcp import server
+
+    env_before = {name: os.environ.get(name) for name in load._BENCH_ENV}
+    globals_before = (chatbot.AI_BASE_URL, chatbot.AI_API_KEY, chatbot.AI_MODEL, server.message_limiter)
+    summary = await load.run(args)
+    assert summary["turns"] == 2 and summary["errors"] == 0
+    assert summary["e2e_p99_ms"] > 0
+    assert summary["redis_ops_source"] == "chat_store_ops"
+    # Nada del benchmark queda apuntando al mock para los tests que siguen.
+    assert {name: os.environ.get(name) for name in load._BENCH_ENV} == env_before
+    assert (chatbot.AI_BASE_URL, chatbot.AI_API_KEY, chatbot.AI_MODEL, server.message_limiter) == globals_before
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 import fakeredis.aioredis
 
@@ -28,3 +30,86 @@ async def test_chat_store_roundtrip():
     await client.flushall()
     await client.close()
     await chat_store.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_coalesces_and_caps(monkeypatch):
+    monkeypatch.setattr(chat_store, 'CHAT_HISTORY_MAX', 3)
+    monkeypatch.setattr(chat_store, 'CHAT_FLUSH_INTERVAL', 60.0)
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await chat_store.init_db(client=client)
+    cid = 'buffered'
+    await chat_store.upsert_session(cid)
+    await chat_store.append_messages(cid, [('user', f'm{i}') for i in range(5)])
+    assert await client.llen('fitbot:session:buffered:messages') == 0
+
+    await chat_store.flush(cid)
+    assert await client.lrange('fitbot:session:buffered:messages', 0, -1) != []
+    assert await client.llen('fitbot:session:buffered:messages') == 3
+    assert await client.sismember('fitbot:sessions', cid)
+    assert await client.ttl('fitbot:session:buffered:messages') > 0
+
+    await chat_store.append_message(cid, 'assistant', 'pendiente')
+    hist = await chat_store.get_history(cid)
+    assert [m['content'] for m in hist] == ['m3', 'm4', 'pendiente']
+
+    await chat_store.log_workouts(cid, ['a', 'b'])
+    await chat_store.close()
+    assert await client.llen('fitbot:session:buffered:workouts') == 2
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_history_pages_follow_cursor_and_time_range():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await chat_store.init_db(client=client)
+    cid = 'veterano'
+    await chat_store.append_messages(cid, [('user', f'm{i}') for i in range(25)])
+
+    first = await chat_store.get_history_page(cid, limit=10)
+    assert [m['content'] for m in first.items] == [f'm{i}' for i in range(15, 25)]
+    second = await chat_store.get_history_page(cid, cursor=first.next_cursor, limit=10)
+    assert [m['content'] for m in second.items] == [f'm{i}' for i in range(5, 15)]
+    last = await chat_store.get_history_page(cid, cursor=second.next_cursor, limit=10)
+    assert len(last.items) == 5 and last.next_cursor is None
+
+    cursors = {}
+    fetch = lambda cursor: chat_store.get_history_page(cid, cursor, limit=10)
+    assert (await chat_store.page_at(fetch, 2, cursors)).items == second.items
+    assert cursors[2] == first.next_cursor
+    assert (await chat_store.page_at(fetch, 4, cursors)).items == []
+
+    created_ms = int(last.items[0]['id'].split('-')[0])
+    assert (await chat_store.get_history_page(cid, until=created_ms / 1000 - 1)).items == []
+    assert len((await chat_store.get_history_page(cid, since=created_ms / 1000, limit=100)).items) == 25
+    with pytest.raises(ValueError):
+        await chat_store.get_history_page(cid, cursor='nope')
+
+    await chat_store.log_workouts(cid, ['a', 'b', 'c'])
+    workouts = await chat_store.get_workouts_page(cid, limit=2)
+    assert [w['entry'] for w in workouts.items] == ['b', 'c'] and workouts.next_cursor
+
+    await chat_store.clear_history(cid)
+    assert (await chat_store.get_history_page(cid)).items == []
+    await chat_store.close()
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_serializes_per_client_only():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await chat_store.init_db(client=client)
+    buffer = chat_store.WriteBehindBuffer(flush_interval=60.0)
+    buffer.add('a', messages=['x'])
+    async with buffer._locked(['a']):
+        # Con el volcado de 'a' en curso, otra sesión lee sin esperar.
+        results = await asyncio.wait_for(buffer.execute('b', lambda pipe: pipe.llen('k')), 1)
+        assert results == [0]
+        blocked = asyncio.create_task(buffer.execute('a'))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+    await blocked
+    assert buffer.pending() == 0
+    assert buffer._locks == {}
+    await chat_store.close()
+    await client.aclose()
@@ -0,0 +1,212 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from fitbot import chatbot
+
+
+@pytest.mark.asyncio
+async def test_shared_client_lifecycle(monkeypatch):
+    monkeypatch.setattr(chatbot, "AI_API_KEY", "test-key")
+    await chatbot.startup()
+    first = chatbot.get_async_client()
+    assert chatbot.get_async_client() is first
+    await chatbot.shutdown()
+    assert chatbot.get_async_client() is not first
+    await chatbot.shutdown()
+
+
+def test_connection_stats_ratio():
+    stats = chatbot.ConnectionStats()
+    stats.record(reused=False)
+    stats.record(reused=True)
+    stats.record(reused=True)
+    data = stats.as_dict()
+    assert data["requests"] == 3
+    assert data["new_connections"] == 1
+    assert data["reuse_ratio"] == pytest.approx(0.667)
+
+
+@pytest.mark.asyncio
+async def test_model_registry_serves_stale_while_revalidating(monkeypatch):
+    monkeypatch.setattr(chatbot, "AI_API_KEY", "test-key")
+    calls = []
+    catalogs = [["gemma2-9b-it"], ["llama-3.1-8b-instant"]]
+
+    async def fake_list():
+        calls.append(1)
+        return catalogs[min(len(calls), len(catalogs)) - 1]
+
+    monkeypatch.setattr(chatbot, "_list_available_models", fake_list)
+    registry = chatbot.ModelRegistry(ttl=0.0)
+    assert await registry.resolve() == "gemma2-9b-it"
+    assert registry.available
+
+    # Vencido: devuelve el valor anterior y revalida en segundo plano.
+    assert await registry.resolve() == "gemma2-9b-it"
+    await registry.refresh()
+    assert registry.resolved == "llama-3.1-8b-instant"
+
+    registry.invalidate("llama-3.1-8b-instant")
+    assert registry.resolved is None
+    await registry.stop()
+
+
+class _FakeStream:
+    def __init__(self, deltas):
+        self._deltas = list(deltas)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._deltas:
+            raise StopAsyncIteration
+        return self._deltas.pop(0)
+
+    async def close(self):
+        self.closed = True
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def _rate_limited():
+    import httpx
+    from openai import RateLimitError
+
+    request = httpx.Request("POST", "https://example.test/chat/completions")
+    return RateLimitError("rate limited", response=httpx.Response(429, request=request), body=None)
+
+
+@pytest.mark.asyncio
+async def test_failover_to_next_model_before_first_token(monkeypatch):
+    monkeypatch.setattr(chatbot, "AI_API_KEY", "test-key")
+    monkeypatch.setattr(chatbot, "AI_RETRY_BASE_DELAY", 0.0)
+    registry = chatbot.ModelRegistry()
+    registry._available = ("llama-3.1-8b-instant", "gemma2-9b-it")
+    registry._resolved = "llama-3.1-8b-instant"
+    registry._checked_at = time.monotonic()
+    monkeypatch.setattr(chatbot, "model_registry", registry)
+    tried = []
+
+    async def fake_open(model, messages):
+        tried.append(model)
+        if model == "llama-3.1-8b-instant":
+            raise _rate_limited()
+        stream = _FakeStream([_chunk("mundo")])
+        return chatbot._OpenedStream(model, "hola ", stream, stream)
+
+    monkeypatch.setattr(chatbot, "_open_stream", fake_open)
+    text = "".join([d async for d in chatbot.astream_chat_completion([{"role": "user", "content": "hi"}])])
+    assert text == "hola mundo"
+    assert tried == ["llama-3.1-8b-instant", "gemma2-9b-it"]
+    assert registry.candidates()[0] == "gemma2-9b-it"
+
+
+@pytest.mark.asyncio
+async def test_hedge_keeps_first_stream_to_start(monkeypatch):
+    monkeypatch.setattr(chatbot, "AI_HEDGE_ENABLED", True)
+    monkeypatch.setattr(chatbot, "AI_HEDGE_MIN_DELAY", 0.01)
+    slow = _FakeStream([])
+
+    async def fake_open(model, messages):
+        if model == "slow":
+            try:
+                await asyncio.sleep(1)
+            finally:
+                await slow.close()
+        stream = _FakeStream([])
+        return chatbot._OpenedStream(model, "ok", stream, stream)
+
+    monkeypatch.setattr(chatbot, "_open_stream", fake_open)
+    opened = await chatbot._open_with_hedge(["slow", "fast"], [])
+    assert opened.model == "fast"
+    assert slow.closed
+
+
+def _not_found():
+    import httpx
+    from openai import NotFoundError
+
+    request = httpx.Request("POST", "https://example.test/chat/completions")
+    return NotFoundError("model decommissioned", response=httpx.Response(404, request=request), body=None)
+
+
+@pytest.mark.asyncio
+async def test_decommissioned_model_fails_over(monkeypatch):
+    monkeypatch.setattr(chatbot, "AI_API_KEY", "test-key")
+    monkeypatch.setattr(chatbot, "AI_RETRY_BASE_DELAY", 0.0)
+    registry = chatbot.ModelRegistry()
+    registry._available = ("llama-3.1-8b-instant", "gemma2-9b-it")
+    registry._resolved = "llama-3.1-8b-instant"
+    registry._checked_at = time.monotonic()
+    monkeypatch.setattr(chatbot, "model_registry", registry)
+    tried = []
+
+    async def fake_open(model, messages):
+        tried.append(model)
+        if model == "llama-3.1-8b-instant":
+            raise _not_found()
+        stream = _FakeStream([])
+        return chatbot._OpenedStream(model, "ok", stream, stream)
+
+    monkeypatch.setattr(chatbot, "_open_stream", fake_open)
+    text = "".join([d async for d in chatbot.astream_chat_completion([{"role": "user", "content": "hi"}])])
+    assert text == "ok"
+    assert tried == ["llama-3.1-8b-instant", "gemma2-9b-it"]
+    assert registry.candidates()[0] == "gemma2-9b-it"
+
+
+@pytest.mark.asyncio
+async def test_hedge_failure_blames_hedge_model_and_closes_extra_stream(monkeypatch):
+    monkeypatch.setattr(chatbot, "AI_HEDGE_ENABLED", True)
+    monkeypatch.setattr(chatbot, "AI_HEDGE_MIN_DELAY", 0.01)
+    release = asyncio.Event()
+    streams = []
+
+    async def fake_open(model, messages):
+        await release.wait()
+        if model == "hedge":
+            raise _rate_limited()
+        stream = _FakeStream([])
+        streams.append(stream)
+        return chatbot._OpenedStream(model, "ok", stream, stream)
+
+    monkeypatch.setattr(chatbot, "_open_stream", fake_open)
+    failures = []
+    task = asyncio.create_task(chatbot._open_with_hedge(["primary", "hedge"], [], failures))
+    await asyncio.sleep(0.05)
+    release.set()
+    opened = await task
+    assert opened.model == "primary"
+    assert [model for model, _ in failures] == ["hedge"]
+
+    # Los dos intentos abren en la misma vuelta: solo se conserva uno.
+    release.clear()
+    task = asyncio.create_task(chatbot._open_with_hedge(["a", "b"], []))
+    await asyncio.sleep(0.05)
+    streams.clear()
+    release.set()
+    opened = await task
+    assert len(streams) == 2
+    assert [stream.closed for stream in streams].count(True) == 1
+    assert not opened.stream.closed
+
+
+@pytest.mark.asyncio
+async def test_empty_catalog_keeps_previous_model_and_logs(monkeypatch, caplog):
+    async def empty_catalog():
+        return []
+
+    monkeypatch.setattr(chatbot, "_list_available_models", empty_catalog)
+    registry = chatbot.ModelRegistry()
+    registry._resolved = "llama-3.1-8b-instant"
+    with caplog.at_level("WARNING"):
+        await registry.refresh()
+    assert registry.resolved == "llama-3.1-8b-instant"
+    assert "no publicó modelos" in caplog.text
@@ -0,0 +1,85 @@
+import json
+
+import fakeredis.aioredis
+import pytest
+
+from fitbot import chat_store, codec, migrate_codec
+
+
+def test_msgpack_records_are_compact_and_readable():
+    binary = codec.MsgpackCodec(compression="zlib", compress_min=64)
+    reply = "Sentadillas 4x8 con descanso de 90 segundos. " * 40
+    legacy = json.dumps({"role": "user", "content": "hola", "created_at": "2024-05-01T10:00:00+00:00"})
+    raws = [legacy.encode(), binary.encode_message("assistant", reply, 1714557600)]
+
+    assert len(raws[1]) < len(json.dumps({"role": "assistant", "content": reply}))
+    messages = codec.decode_messages(raws + [b"\x7fbasura"])
+    assert [m["role"] for m in messages] == ["user", "assistant"]
+    assert messages[1]["content"] == reply
+    assert messages[1]["created_at"].startswith("2024-05-01T10:00:00")
+
+
+@pytest.mark.asyncio
+async def test_migration_reencodes_lists_and_keeps_ttl():
+    server = fakeredis.FakeServer()
+    client = fakeredis.aioredis.FakeRedis(server=server)
+    await chat_store.init_db(client=client)
+    await chat_store.append_messages("mig", [("user", "hola"), ("assistant", "¡Hola!")], client=client)
+    await chat_store.log_workout("mig", "remo 3x12", client=client)
+    key = chat_store._messages_key("mig")
+    log_key = chat_store._messages_log_key("mig")
+    assert (await client.lindex(key, 0)).startswith(b"{")
+    await client.rpush(key, b"\x7fbasura")
+    ids = [entry_id for entry_id, _ in await client.xrange(log_key)]
+
+    stats = await migrate_codec.migrate("", "msgpack", client=client)
+    assert stats == {"keys": 4, "entries": 6, "dropped": 1}
+    assert (await client.lindex(key, 0))[:1] == b"\x01"
+    assert (await client.xrange(log_key))[0][1][b"p"][:1] == b"\x01"
+    assert [entry_id for entry_id, _ in await client.xrange(log_key)] == ids
+    assert await client.ttl(key) > 0 and await client.ttl(log_key) > 0
+    history = await chat_store.get_history("mig")
+    assert history == [{"role": "user", "content": "hola"}, {"role": "assistant", "content": "¡Hola!"}]
+    assert (await chat_store.get_workouts("mig"))[0]["entry"] == "remo 3x12"
+
+    # De vuelta a JSON, chat_store lee con decode_responses=True: los streams no pueden quedar en binario.
+    assert await migrate_codec.migrate("", "json", client=client) == {"keys": 4, "entries": 6, "dropped": 0}
+    await chat_store.init_db(client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    page = await chat_store.get_history_page("mig", limit=5)
+    assert [item["content"] for item in page.items] == ["hola", "¡Hola!"]
+    assert (await chat_store.get_workouts_page("mig")).items[0]["entry"] == "remo 3x12"
+
+    await client.flushall()
+    await chat_store.close()
+
+
+@pytest.mark.asyncio
+async def test_backfill_builds_log_for_legacy_lists():
+    client = fakeredis.aioredis.FakeRedis()
+    await chat_store.init_db(client=client)
+    key = chat_store._messages_key("viejo")
+    legacy = codec.JsonCodec()
+    await client.rpush(key, *(legacy.encode_message("user", f"m{i}", 1700000000 + i // 2) for i in range(4)))
+
+    stats = await migrate_codec.backfill_logs("", client=client)
+    assert stats == {"keys": 1, "entries": 4}
+    page = await chat_store.get_history_page("viejo", limit=3)
+    assert [item["content"] for item in page.items] == ["m1", "m2", "m3"]
+    assert [item["id"] for item in page.items] == ["1700000000000-1", "1700000001000-0", "1700000001000-1"]
+    # Con el stream ya creado no se vuelve a copiar.
+    assert await migrate_codec.backfill_logs("", client=client) == {"keys": 1, "entries": 0}
+
+    await client.flushall()
+    await chat_store.close()
+
+
+@pytest.mark.asyncio
+async def test_migration_refuses_redis_cluster():
+    from redis.asyncio.cluster import RedisCluster
+
+    cluster = RedisCluster.from_url("redis://127.0.0.1:7000")
+    with pytest.raises(RuntimeError, match="Cluster"):
+        await migrate_codec.migrate("", "msgpack", client=cluster)
+    with pytest.raises(RuntimeError, match="Cluster"):
+        await migrate_codec.backfill_logs("", client=cluster)
+    await cluster.aclose()
@@ -0,0 +1,80 @@
+import fakeredis.aioredis
+import pytest
+
+from fitbot import app as app_module
+from fitbot import chat_store
+from fitbot.history_cache import HistoryCache, history_cache
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_json(self, payload):
+        self.frames.append(payload)
+
+
+def _messages(*contents):
+    return [{'role': 'user', 'content': content} for content in contents]
+
+
+def test_cache_evicts_least_recently_used_by_bytes():
+    cache = HistoryCache(max_bytes=1200, max_entries=10)
+    cache.store('a', 1, _messages('x' * 300), complete=True)
+    cache.store('b', 1, _messages('y' * 300), complete=True)
+    assert cache.lookup('a', 10) is not None  # 'a' pasa a ser la más reciente
+    cache.store('c', 1, _messages('z' * 300), complete=True)
+
+    assert cache.lookup('b', 10) is None
+    assert cache.lookup('a', 10) is not None and cache.lookup('c', 10) is not None
+    assert cache.stats()['bytes'] <= 1200
+
+
+def test_cache_append_tracks_version_and_tail():
+    cache = HistoryCache(max_bytes=10_000, max_entries=3)
+    cache.store('a', 5, _messages('m1', 'm2'), complete=True)
+    cache.append('a', _messages('m3', 'm4'), max_len=0)
+
+    entry = cache.lookup('a', 3)
+    assert entry.version == 7
+    assert [m['content'] for m in entry.messages] == ['m2', 'm3', 'm4']
+    # Ya no tiene todo el historial: no alcanza para pedir más de lo que guarda.
+    assert cache.lookup('a', 4) is None
+
+
+@pytest.mark.asyncio
+async def test_get_history_served_from_cache_until_version_changes():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await chat_store.init_db(client=client)
+    await chat_store.append_messages('ana', [('user', 'hola'), ('assistant', 'hola!')])
+
+    assert [m['content'] for m in await chat_store.get_history('ana')] == ['hola', 'hola!']
+    hits = history_cache.hits
+    await chat_store.append_message('ana', 'user', 'rutina?')
+    assert [m['content'] for m in await chat_store.get_history('ana', limit=2)] == ['hola!', 'rutina?']
+    assert history_cache.hits == hits + 1
+
+    # Otro proceso escribe directo en Redis: la versión cambia y se vuelve a leer.
+    await chat_store.append_message('ana', 'assistant', 'desde otro nodo', client=client)
+    history = await chat_store.get_history('ana')
+    assert history[-1]['content'] == 'desde otro nodo'
+    assert history_cache.hits == hits + 1
+
+    await chat_store.clear_history('ana', client=client)
+    assert await chat_store.get_history('ana') == []
+    await chat_store.close()
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_paged_history_goes_newest_first():
+    socket = FakeSocket()
+    history = _messages('m1', 'm2', 'm3', 'm4', 'm5')
+    await app_module._send_history_pages(socket, history, 2)
+
+    assert [[m['content'] for m in frame['messages']] for frame in socket.frames] == [
+        ['m4', 'm5'],
+        ['m2', 'm3'],
+        ['m1'],
+    ]
+    assert [frame['more'] for frame in socket.frames] == [True, True, False]
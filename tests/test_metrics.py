@@ -0,0 +1,32 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from fitbot import chat_store, metrics
+from fitbot.app import app
+
+pytest.importorskip('prometheus_client')
+
+
+def _sample(name, **labels):
+    from prometheus_client import REGISTRY
+
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_redis_ops_are_timed():
+    import fakeredis.aioredis
+
+    before = _sample('fitbot_redis_op_seconds_count', op='get_history')
+    await chat_store.init_db(client=fakeredis.aioredis.FakeRedis(decode_responses=True))
+    await chat_store.get_history('metricas')
+    await chat_store.close()
+    assert _sample('fitbot_redis_op_seconds_count', op='get_history') == before + 1
+
+
+def test_metrics_endpoint_exposes_fitbot_metrics():
+    metrics.FALLBACK_REPLIES.labels('ws', 'error').inc()
+    r = TestClient(app).get('/metrics')
+    assert r.status_code == 200
+    assert 'fitbot_fallback_replies_total{reason="error",transport="ws"}' in r.text
+    assert 'fitbot_ws_sessions' in r.text
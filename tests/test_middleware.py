@@ -0,0 +1,35 @@
+from fastapi.testclient import TestClient
+
+from fitbot import middleware
+from fitbot.app import app
+
+
+def test_security_headers_are_added_once():
+    client = TestClient(app)
+    r = client.get('/health')
+    assert r.headers['x-content-type-options'] == 'nosniff'
+    assert "default-src 'self'" in r.headers['content-security-policy']
+    assert r.headers.get_list('referrer-policy') == ['no-referrer']
+
+
+def test_route_latency_histogram_and_profiler_hook(monkeypatch):
+    sampled = []
+    latency = middleware.route_latency
+    monkeypatch.setattr(latency, 'enabled', True)
+    monkeypatch.setattr(latency, 'profile_sample_rate', 1.0)
+    monkeypatch.setattr(latency, 'profile_min_ms', 0.0)
+    monkeypatch.setattr(latency, 'profile_hook', lambda route, ms, stats: sampled.append(route))
+    monkeypatch.setattr(latency, 'histograms', {})
+    client = TestClient(app)
+    for _ in range(3):
+        client.get('/health')
+
+    body = client.get('/health').json()
+    assert body['http_latency']['GET /health']['count'] == 3
+    assert sampled[:3] == ['GET /health'] * 3
+
+    hist = middleware.LatencyHistogram()
+    for ms in [1] * 90 + [100] * 10:
+        hist.observe(ms)
+    summary = hist.as_dict()
+    assert summary['p50_ms'] <= 1.2 and 90 <= summary['p99_ms'] <= 120
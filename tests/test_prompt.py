@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from fitbot import prompt
+
+
+def _turns(n, size=400):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i}:" + "x" * size}
+        for i in range(n)
+    ]
+
+
+def test_build_prompt_fits_budget_and_reports_overflow():
+    history = _turns(20)
+    plan = prompt.build_prompt(history, budget=1000)
+    assert plan.messages[0]["role"] == "system"
+    assert plan.tokens <= 1000
+    assert plan.messages[-1] == history[-1]
+    assert plan.overflow + plan.messages[1:] == history
+
+
+def test_build_prompt_always_keeps_last_message():
+    history = _turns(1, size=20000)
+    plan = prompt.build_prompt(history, budget=100)
+    assert plan.messages[1:] == history
+    assert plan.overflow == []
+
+
+def test_summary_goes_into_system_message():
+    plan = prompt.build_prompt(_turns(2, size=10), summary="- Meta: correr 10k")
+    assert "correr 10k" in plan.messages[0]["content"]
+
+
+def test_drop_summarized_skips_covered_prefix():
+    history = _turns(6, size=10)
+    digest = prompt.message_digest(history[2])
+    assert prompt.drop_summarized(history, digest) == history[3:]
+    assert prompt.drop_summarized(history, "desconocido") == history
+
+
+@pytest.mark.asyncio
+async def test_summarizer_folds_overflow_off_the_hot_path(monkeypatch):
+    seen = []
+
+    async def fake_summarize(previous, messages, client_id):
+        await asyncio.sleep(0)
+        seen.append(len(messages))
+        return f"{previous}+{len(messages)}"
+
+    monkeypatch.setattr(prompt, "summarize", fake_summarize)
+    summarizer = prompt.ConversationSummarizer()
+    state = {"summary": "", "digest": ""}
+
+    async def apply(summary, digest):
+        state.update(summary=summary, digest=digest)
+
+    history = _turns(4, size=10)
+    summarizer.schedule("c1", history[:2], lambda: state["summary"], apply)
+    summarizer.schedule("c1", history[2:3], lambda: state["summary"], apply)
+    await summarizer.drain()
+
+    assert state["summary"] == "+3"
+    assert state["digest"] == prompt.message_digest(history[2])
+
+
+@pytest.mark.asyncio
+async def test_reloaded_history_does_not_refold_pending_turns(monkeypatch):
+    from fitbot import app as app_module
+    from fitbot import chat_store
+
+    release = asyncio.Event()
+    folded = []
+
+    async def fake_summarize(previous, messages, client_id):
+        await release.wait()
+        folded.extend(m["content"] for m in messages)
+        return "resumen"
+
+    async def fake_set_summary(client_id, summary, last_digest):
+        pass
+
+    monkeypatch.setattr(prompt, "summarize", fake_summarize)
+    monkeypatch.setattr(prompt, "summarizer", prompt.ConversationSummarizer())
+    monkeypatch.setattr(chat_store, "set_summary", fake_set_summary)
+    history = _turns(12, size=4 * prompt.AI_PROMPT_BUDGET // 6)
+
+    app_module.manager.set_history("reload", history)
+    app_module._build_prompt("reload")
+    await asyncio.sleep(0)
+    # Con el bus, el turno siguiente recarga de Redis el historial completo.
+    app_module.manager.set_history("reload", history + _turns(1, size=10))
+    app_module._build_prompt("reload")
+    release.set()
+    await prompt.summarizer.drain()
+
+    assert folded and len(folded) == len(set(folded))
+
+
+@pytest.mark.asyncio
+async def test_summary_chains_batches_after_disconnect(monkeypatch):
+    from fitbot import app as app_module
+    from fitbot import chat_store
+
+    release = asyncio.Event()
+    stored = []
+
+    async def fake_summarize(previous, messages, client_id):
+        await release.wait()
+        return f"{previous}+{len(messages)}"
+
+    async def fake_set_summary(client_id, summary, last_digest):
+        stored.append(summary)
+
+    class Socket:
+        async def accept(self):
+            pass
+
+    monkeypatch.setattr(prompt, "summarize", fake_summarize)
+    monkeypatch.setattr(prompt, "summarizer", prompt.ConversationSummarizer())
+    monkeypatch.setattr(chat_store, "set_summary", fake_set_summary)
+    socket = Socket()
+    await app_module.manager.connect(socket, "chain")
+    app_module.manager.set_summary("chain", "previo")
+    app_module.manager.set_history("chain", _turns(12, size=4 * prompt.AI_PROMPT_BUDGET // 6))
+    app_module._build_prompt("chain")
+    await asyncio.sleep(0)
+    app_module.manager.history("chain").extend(_turns(4, size=4 * prompt.AI_PROMPT_BUDGET // 6))
+    app_module._build_prompt("chain")
+    await app_module.manager.disconnect(socket)
+    release.set()
+    await prompt.summarizer.drain()
+
+    assert len(stored) == 2
+    assert stored[1].startswith(stored[0] + "+") and stored[0].startswith("previo+")
+
+
+@pytest.mark.asyncio
+async def test_discarded_run_keeps_the_session_scheduled_after_it(monkeypatch):
+    release = asyncio.Event()
+    seen = []
+
+    async def fake_summarize(previous, messages, client_id):
+        await release.wait()
+        seen.append(messages[0]["content"])
+        return "resumen"
+
+    async def apply(summary, digest):
+        pass
+
+    monkeypatch.setattr(prompt, "summarize", fake_summarize)
+    summarizer = prompt.ConversationSummarizer()
+    history = _turns(2, size=10)
+    summarizer.schedule("c1", history[:1], lambda: "", apply)
+    await asyncio.sleep(0)
+    summarizer.discard("c1")
+    summarizer.schedule("c1", history[1:], lambda: "", apply)
+    await asyncio.sleep(0)
+    assert summarizer.pending_digest("c1") == prompt.message_digest(history[1])
+    release.set()
+    await summarizer.drain()
+
+    assert seen == [history[1]["content"]]
+    assert summarizer.pending_digest("c1") is None
@@ -0,0 +1,40 @@
+import pytest
+
+from fitbot import redis_pool
+
+
+class _FlakyClient:
+    def __init__(self):
+        self.up = False
+
+    async def ping(self):
+        if not self.up:
+            raise ConnectionError("down")
+        return True
+
+    async def aclose(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_connector_fails_fast_until_reconnected():
+    fake = _FlakyClient()
+    connector = redis_pool.RedisConnector(client=fake)
+    assert not await connector.ping()
+    with pytest.raises(RuntimeError):
+        connector.check_available()
+
+    fake.up = True
+    assert await connector.ping()
+    connector.check_available()
+    await connector.close()
+
+
+def test_parse_sentinels():
+    assert redis_pool._parse_sentinels("a:1, b ,c:3") == [("a", 1), ("b", 26379), ("c", 3)]
+
+
+def test_build_client_sentinel_requires_nodes(monkeypatch):
+    monkeypatch.setattr(redis_pool, "REDIS_SENTINELS", "")
+    with pytest.raises(RuntimeError):
+        redis_pool.build_client("redis://localhost:6379/0", mode="sentinel")
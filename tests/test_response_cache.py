@@ -0,0 +1,79 @@
+import asyncio
+
+import fakeredis.aioredis
+import pytest
+
+from fitbot import chat_store
+from fitbot import response_cache
+
+
+def _prompt(question):
+    return [
+        {"role": "system", "content": "Sos FitBot"},
+        {"role": "user", "content": question},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_exact_hit_is_replayed_as_stream(monkeypatch):
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await chat_store.init_db(client=client)
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        for delta in ["Rutina ", "de ", "3 días: lunes, miércoles y viernes."]:
+            yield delta
+
+    first = [d async for d in response_cache.cached_stream(_prompt("Rutina para principiantes 3 días?"), produce)]
+    await asyncio.gather(*response_cache._background)
+    second = [
+        d async for d in response_cache.cached_stream(_prompt("  rutina para PRINCIPIANTES 3 días "), produce)
+    ]
+
+    assert calls == [1]
+    assert "".join(second) == "".join(first)
+    assert len(second) > 1
+
+    await client.aclose()
+    await chat_store.close()
+
+
+@pytest.mark.asyncio
+async def test_cache_is_keyed_by_the_model_in_use(monkeypatch):
+    from fitbot import chatbot
+
+    registry = chatbot.ModelRegistry()
+    registry._resolved = "llama-3.1-8b-instant"
+    monkeypatch.setattr(chatbot, "model_registry", registry)
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await chat_store.init_db(client=client)
+    prompt = _prompt("Cuántas series de sentadilla?")
+
+    await response_cache.store(prompt, "Cuatro series.")
+    assert await response_cache.lookup(prompt) == "Cuatro series."
+    # Tras un failover el modelo en uso cambia: no se sirven respuestas del anterior.
+    registry.mark_failed("llama-3.1-8b-instant")
+    assert registry.current() != "llama-3.1-8b-instant"
+    assert await response_cache.lookup(prompt) is None
+
+    await client.aclose()
+    await chat_store.close()
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_caps_entries():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    for i in range(5):
+        await chat_store.store_cached_reply(f"d{i}", f"r{i}", ttl=60, max_entries=3, client=client)
+    assert await client.zcard("fitbot:cache:replies") == 3
+    assert await chat_store.get_cached_reply("d0", client=client) is None
+    assert await chat_store.get_cached_reply("d4", client=client) == "r4"
+    await client.aclose()
+
+
+def test_similarity_index_matches_paraphrase():
+    index = response_cache.SimilarityIndex(threshold=0.8, max_entries=10)
+    index.add("abc", "ctx", response_cache.normalize("cuánta proteína necesito por día"))
+    assert index.nearest("ctx", response_cache.normalize("Cuánta proteína necesito al día?")) == "abc"
+    assert index.nearest("otro", response_cache.normalize("cuánta proteína necesito por día")) is None
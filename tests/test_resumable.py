@@ -0,0 +1,143 @@
+import fakeredis.aioredis
+import pytest
+
+from fitbot import app as app_module
+from fitbot import chat_store, resumable
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, payload):
+        self.frames.append(payload)
+
+    async def send_text(self, text):
+        self.frames.append(text)
+
+
+@pytest.mark.asyncio
+async def test_reply_log_spills_to_redis_and_replays_from_offset(monkeypatch):
+    monkeypatch.setattr(resumable, 'RESUME_MEMORY_BYTES', 8)
+    await chat_store.init_db(client=fakeredis.aioredis.FakeRedis(decode_responses=True))
+    log = await resumable.streams.open('ana', 'hola')
+    for delta in ['uno ', 'dos ', 'tres ', 'cuatro']:
+        log.append(delta)
+    await log.close()
+
+    assert log._base > 0  # lo viejo ya no está en memoria
+    assert await log.since(0) == ('uno dos tres cuatro', 4)
+    assert await log.since(2) == ('tres cuatro', 4)
+    await resumable.streams.finish(log, 'uno dos tres cuatro')
+    await chat_store.close()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_gets_missing_deltas_then_live_frames():
+    log = await resumable.streams.open('beto', 'rutina de piernas')
+    log.append('Sentadillas ')
+    log.append('4x8, ')
+
+    socket = FakeSocket()
+    await app_module.manager.connect(socket, 'beto')
+    await app_module._resume_stream(socket, 'beto', log.stream_id, 1)
+    assert socket.frames[0] == {
+        'type': 'stream_resume',
+        'stream_id': log.stream_id,
+        'prompt': 'rutina de piernas',
+        'delta': '4x8, ',
+        'seq': 2,
+    }
+
+    await app_module.manager.broadcast('beto', {'type': 'stream', 'delta': 'zancadas', 'seq': log.append('zancadas')})
+    assert socket.frames[-1] == '{"type":"stream","delta":"zancadas","seq":3}'
+
+    other = FakeSocket()
+    await app_module._resume_stream(other, 'intruso', log.stream_id, 0)
+    assert other.frames == [{'type': 'stream_gone', 'stream_id': log.stream_id}]
+    await app_module.manager.disconnect(socket)
+
+
+@pytest.mark.asyncio
+async def test_live_frames_wait_for_stream_resume_on_reconnect():
+    log = await resumable.streams.open('dani', 'rutina de hombros')
+    log.append('Press ')
+
+    socket = FakeSocket()
+    await app_module.manager.connect(socket, 'dani', hold=True)
+    # Mientras carga el historial el modelo sigue generando y el frame en vivo no debe adelantarse.
+    await app_module.manager.broadcast(
+        'dani', {'type': 'stream', 'stream_id': log.stream_id, 'delta': 'militar ', 'seq': log.append('militar ')}
+    )
+    await app_module.manager.send_json(socket, {'type': 'history_page', 'messages': [], 'more': False})
+    await app_module._resume_stream(socket, 'dani', log.stream_id, 0)
+    live = {'type': 'stream', 'stream_id': log.stream_id, 'delta': '4x10', 'seq': log.append('4x10')}
+    await app_module.manager.broadcast('dani', live)
+
+    assert [frame['type'] if isinstance(frame, dict) else frame for frame in socket.frames] == [
+        'history_page',
+        'stream_resume',
+        f'{{"type":"stream","stream_id":"{log.stream_id}","delta":"4x10","seq":3}}',
+    ]
+    assert socket.frames[1]['delta'] == 'Press militar ' and socket.frames[1]['seq'] == 2
+    await resumable.streams.finish(log, 'Press militar 4x10')
+    await app_module.manager.disconnect(socket)
+
+
+@pytest.mark.asyncio
+async def test_remote_resume_replays_held_bus_frames_after_stream_resume(monkeypatch):
+    async def reply_stream(stream_id):
+        return {'client_id': 'eli', 'prompt': 'core', 'done': '0'}
+
+    async def reply_deltas(stream_id, offset):
+        return [(2, 'Plancha ')]
+
+    monkeypatch.setattr(chat_store, 'get_reply_stream', reply_stream)
+    monkeypatch.setattr(chat_store, 'read_reply_deltas', reply_deltas)
+    socket = FakeSocket()
+    await app_module.manager.connect(socket, 'eli', hold=True)
+    # Frames de otro nodo que llegan por el bus antes de terminar la puesta al día.
+    for seq, delta in [(2, 'Plancha '), (3, '3x30s')]:
+        frame = f'{{"type":"stream","stream_id":"remoto","delta":"{delta}","seq":{seq}}}'
+        await app_module.manager.deliver('eli', frame)
+    await app_module._resume_stream(socket, 'eli', 'remoto', 1)
+
+    assert socket.frames == [
+        {'type': 'stream_resume', 'stream_id': 'remoto', 'prompt': 'core', 'delta': 'Plancha ', 'seq': 2},
+        '{"type":"stream","stream_id":"remoto","delta":"3x30s","seq":3}',
+    ]
+    await app_module.manager.disconnect(socket)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_reply_still_finishes_its_log(monkeypatch):
+    import asyncio
+
+    from fitbot import replies, streaming
+
+    started = asyncio.Event()
+
+    async def stuck_reply(client_id, messages, on_position=None):
+        yield 'Plancha '
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(replies, 'stream_reply', stuck_reply)
+    socket = FakeSocket()
+    await app_module.manager.connect(socket, 'caro')
+    settings = streaming.FlushSettings(window_ms=0)
+    task = asyncio.create_task(app_module._stream_assistant_reply(socket, 'caro', 'core', [], settings))
+    await asyncio.wait_for(started.wait(), 1)
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    log = next(log for log in resumable.streams._logs.values() if log.client_id == 'caro')
+    assert log.done and log.final == 'Plancha'
+    stream_frames = [frame for frame in socket.frames if '"type":"stream"' in frame]
+    assert stream_frames and all(log.stream_id in frame for frame in stream_frames)
+    await app_module.manager.disconnect(socket)
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from fitbot.scheduler import LLMScheduler, SchedulerBusy
+
+
+@pytest.mark.asyncio
+async def test_round_robin_across_clients():
+    scheduler = LLMScheduler(max_concurrency=1, rpm_limit=0, tpm_limit=0)
+    order = []
+    positions = {}
+
+    await scheduler.acquire("busy", 1)
+
+    async def request(client_id: str, tag: str) -> None:
+        async def on_position(pos: int) -> None:
+            positions.setdefault(tag, []).append(pos)
+
+        await scheduler.acquire(client_id, 1, on_position)
+        order.append(tag)
+        await asyncio.sleep(0)
+        scheduler.release(1, 1)
+
+    tasks = [
+        asyncio.create_task(request("a", "a1")),
+        asyncio.create_task(request("a", "a2")),
+        asyncio.create_task(request("b", "b1")),
+    ]
+    await asyncio.sleep(0.01)
+    assert scheduler.queue_depth() == 3
+    scheduler.release(1, 1)
+    await asyncio.gather(*tasks)
+
+    assert order == ["a1", "b1", "a2"]
+    # b1 entra por delante de a2 aunque llegó después (una solicitud por cliente y ronda).
+    assert positions["a2"][:3] == [2, 3, 2]
+
+
+@pytest.mark.asyncio
+async def test_per_client_queue_limit():
+    scheduler = LLMScheduler(max_concurrency=1, rpm_limit=0, tpm_limit=0, max_queue_per_client=1)
+    await scheduler.acquire("a", 1)
+    waiting = asyncio.create_task(scheduler.acquire("a", 1))
+    await asyncio.sleep(0)
+    with pytest.raises(SchedulerBusy):
+        await scheduler.acquire("a", 1)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert scheduler.queue_depth() == 0
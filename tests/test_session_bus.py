@@ -0,0 +1,61 @@
+import asyncio
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+
+from fitbot.app import ConnectionManager
+from fitbot.session_bus import SessionBus
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.frames.append(text)
+
+
+async def _node(server):
+    manager = ConnectionManager()
+    manager.bus = SessionBus(manager.deliver, client=fakeredis.aioredis.FakeRedis(server=server))
+    await manager.bus.start()
+    return manager
+
+
+async def _wait_for(predicate):
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError('timeout esperando el frame')
+
+
+@pytest.mark.asyncio
+async def test_frames_fan_out_to_every_socket_of_the_client():
+    server = fakeredis.FakeServer()
+    node_a, node_b = await _node(server), await _node(server)
+    tab_a, tab_a2, tab_b, other = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+    await node_a.connect(tab_a, 'ana')
+    await node_a.connect(tab_a2, 'ana')
+    await node_b.connect(tab_b, 'ana')
+    await node_b.connect(other, 'beto')
+
+    await node_a.broadcast('ana', {'type': 'stream', 'delta': 'hola'}, exclude=tab_a2)
+    await _wait_for(lambda: tab_b.frames)
+
+    assert tab_a.frames == ['{"type":"stream","delta":"hola"}']
+    assert tab_a2.frames == []
+    assert tab_b.frames == tab_a.frames
+    assert other.frames == []
+
+    await node_b.disconnect(tab_b)
+    await node_a.broadcast('ana', {'type': 'stream_end', 'content': 'hola'})
+    await asyncio.sleep(0.05)
+    assert len(tab_b.frames) == 1
+
+    await node_a.close_bus()
+    await node_b.close_bus()
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from fitbot.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_late_subscriber_gets_replay_and_live_deltas():
+    flights = SingleFlight()
+    calls = []
+    release = asyncio.Event()
+
+    async def produce(notify_position):
+        calls.append(1)
+        yield "uno "
+        await release.wait()
+        yield "dos"
+
+    async def collect():
+        return [d async for d in flights.stream("k", produce)]
+
+    first = asyncio.create_task(collect())
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(collect())
+    await asyncio.sleep(0.01)
+    assert flights.in_flight() == 1
+    release.set()
+
+    assert await first == ["uno ", "dos"]
+    assert await second == ["uno ", "dos"]
+    assert calls == [1]
+    assert flights.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_upstream_cancelled_when_last_subscriber_leaves():
+    flights = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def produce(notify_position):
+        try:
+            yield "a"
+            await asyncio.sleep(10)
+        finally:
+            cancelled.set()
+
+    stream = flights.stream("k", produce)
+    assert await stream.__anext__() == "a"
+    await stream.aclose()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_join_right_after_last_subscriber_leaves_starts_new_flight():
+    flights = SingleFlight()
+    calls = []
+
+    async def produce(notify_position):
+        calls.append(1)
+        yield "a"
+        await asyncio.sleep(0.01)
+        yield "b"
+
+    stream = flights.stream("k", produce)
+    assert await stream.__anext__() == "a"
+    await stream.aclose()
+    # Sin ceder el loop: la tarea cancelada todavía no corrió su finally.
+    assert flights.in_flight() == 0
+    assert [d async for d in flights.stream("k", produce)] == ["a", "b"]
+    assert calls == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_upstream_cancellation_surfaces_as_regular_error():
+    flights = SingleFlight()
+
+    async def produce(notify_position):
+        yield "a"
+        raise asyncio.CancelledError()
+
+    with pytest.raises(RuntimeError):
+        [d async for d in flights.stream("k", produce)]
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from fitbot import streaming
+
+
+async def _burst_then_pause():
+    for delta in ("a", "b", "c", "d"):
+        yield delta
+    await asyncio.sleep(0.08)
+    yield "e"
+
+
+async def _collect(deltas, settings):
+    return [batch async for batch in streaming.coalesce(deltas, settings)]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_batches_bursts_and_flushes_after_pause():
+    batches = await _collect(_burst_then_pause(), streaming.FlushSettings(window_ms=30, max_bytes=1024))
+    # El primer fragmento sale de inmediato; la ráfaga se agrupa; tras la pausa sale solo.
+    assert batches == ["a", "bcd", "e"]
+
+    by_size = await _collect(_burst_then_pause(), streaming.FlushSettings(window_ms=30, max_bytes=2))
+    assert "".join(by_size) == "abcde" and len(by_size) == 4
+
+
+@pytest.mark.asyncio
+async def test_coalesce_propagates_errors_after_pending_data():
+    async def failing():
+        yield "hola"
+        yield " mundo"
+        raise RuntimeError("upstream caído")
+
+    received = []
+    with pytest.raises(RuntimeError):
+        async for batch in streaming.coalesce(failing(), streaming.FlushSettings(window_ms=50)):
+            received.append(batch)
+    assert "".join(received) == "hola mundo"
+
+
+@pytest.mark.asyncio
+async def test_coalesce_passes_upstream_cancellation_through():
+    async def cancelled():
+        yield "cortada"
+        raise asyncio.CancelledError()
+
+    received = []
+    with pytest.raises(asyncio.CancelledError):
+        async for batch in streaming.coalesce(cancelled(), streaming.FlushSettings(window_ms=50)):
+            received.append(batch)
+    assert received == ["cortada"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_backpressures_a_slow_consumer(monkeypatch):
+    monkeypatch.setattr(streaming, "_QUEUE_SIZE", 4)
+    produced = []
+
+    async def endless():
+        while True:
+            produced.append(1)
+            yield "x"
+
+    stream = streaming.coalesce(endless(), streaming.FlushSettings(window_ms=50))
+    assert await stream.__anext__() == "x"
+    await asyncio.sleep(0.05)
+    # Sin nadie leyendo, el productor se frena al llenarse la cola.
+    assert len(produced) <= 4 + 2
+    await stream.aclose()
+
+
+def test_negotiate_clamps_client_settings():
+    settings = streaming.negotiate({"flush_ms": "5000", "flush_bytes": "abc"})
+    assert settings.window_ms == streaming.WS_FLUSH_MAX_MS
+    assert settings.max_bytes == streaming.WS_FLUSH_BYTES
+    assert streaming.negotiate({"flush_ms": "0"}).window_ms == 0
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+
+from fitbot.tcp import server, supervisor
+
+
+def test_backoff_doubles_up_to_cap():
+    assert supervisor.backoff_delay(0, 0.5, 4) == 0.0
+    assert [supervisor.backoff_delay(n, 0.5, 4) for n in range(1, 6)] == [0.5, 1.0, 2.0, 4.0, 4.0]
+
+
+async def _until(predicate, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'tiempo agotado esperando a los workers'
+        await asyncio.sleep(0.05)
+
+
+@pytest.mark.asyncio
+async def test_supervisor_restarts_and_rolls_workers_on_shared_socket(monkeypatch):
+    # Los workers se crean con spawn y leen estas variables al importar.
+    monkeypatch.setenv('TCP_WORKER_REPORT_INTERVAL', '0.1')
+    monkeypatch.setenv('TCP_DRAIN_TIMEOUT', '2')
+    monkeypatch.setenv('AI_API_KEY', '')
+    monkeypatch.setenv('REDIS_URL', 'redis://127.0.0.1:1/0')
+    monkeypatch.setattr(supervisor, 'TCP_RESTART_BACKOFF', 0.1)
+    sock = supervisor.listen_socket('127.0.0.1', 0)
+    port = sock.getsockname()[1]
+    pool = supervisor.Supervisor(server._worker_entry, 2, args=('127.0.0.1', port, False, sock), drain_timeout=2)
+    runner = asyncio.create_task(pool.run())
+    try:
+        await _until(lambda: len(pool.status()) == 2 and all(item.get('worker') is not None for item in pool.status()))
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        assert 'FitBot'.encode() in await asyncio.wait_for(reader.readline(), 10)
+        writer.close()
+
+        first = {item['slot']: item['pid'] for item in pool.status()}
+        os.kill(first[0], signal.SIGKILL)
+        await _until(lambda: pool.restarts == 1 and pool._slots.get(0) and pool._slots[0].healthy)
+        assert pool._slots[0].process.pid != first[0]
+
+        before = {slot: state.process.pid for slot, state in pool._slots.items()}
+        await pool.rolling_restart()
+        after = {slot: state.process.pid for slot, state in pool._slots.items()}
+        assert set(after) == {0, 1} and not set(after.values()) & set(before.values())
+        assert all(state.healthy for state in pool._slots.values())
+    finally:
+        pool.request_stop()
+        await asyncio.wait_for(runner, 30)
+        sock.close()
+    assert pool.status() == []
+
+
+@pytest.mark.asyncio
+async def test_slow_starting_worker_is_not_replaced(monkeypatch):
+    # Redis acepta la conexión pero nunca contesta: init_db no termina dentro del health timeout.
+    async def silent(reader, writer):
+        await reader.read()
+
+    redis = await asyncio.start_server(silent, '127.0.0.1', 0)
+    redis_port = redis.sockets[0].getsockname()[1]
+    monkeypatch.setenv('TCP_WORKER_REPORT_INTERVAL', '0.1')
+    monkeypatch.setenv('AI_API_KEY', '')
+    monkeypatch.setenv('REDIS_URL', f'redis://127.0.0.1:{redis_port}/0')
+    sock = supervisor.listen_socket('127.0.0.1', 0)
+    port = sock.getsockname()[1]
+    pool = supervisor.Supervisor(
+        server._worker_entry, 1, args=('127.0.0.1', port, False, sock), health_timeout=3, drain_timeout=2
+    )
+    runner = asyncio.create_task(pool.run())
+    try:
+        await _until(lambda: pool._slots.get(0) and pool._slots[0].last_report is not None)
+        state = pool._slots[0]
+        await asyncio.sleep(2 * pool.health_timeout)
+        assert pool._slots[0] is state and state.process.is_alive() and pool.restarts == 0
+        assert state.load['starting'] == 1 and not state.healthy
+    finally:
+        pool.request_stop()
+        await asyncio.wait_for(runner, 30)
+        sock.close()
+        redis.close()
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from fitbot.tcp import flow, server
+
+
+def test_rate_limiter_allows_bursts_then_refills(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(flow.time, 'monotonic', lambda: now[0])
+    limiter = flow.RateLimiter(rate=1, burst=2)
+    assert [limiter.allow('ip') for _ in range(3)] == [True, True, False]
+    assert limiter.allow('otra')
+    now[0] += 1.0
+    assert limiter.allow('ip') and not limiter.allow('ip')
+
+
+def test_connection_limiter_counts_per_ip():
+    limiter = flow.ConnectionLimiter(limit=2)
+    assert limiter.acquire('a') and limiter.acquire('a') and not limiter.acquire('a')
+    assert limiter.acquire('b')
+    limiter.release('a')
+    assert limiter.acquire('a')
+
+
+@pytest_asyncio.fixture
+async def socket_pair():
+    accepted = asyncio.Queue()
+
+    async def on_connect(reader, writer):
+        await accepted.put((reader, writer))
+
+    listener = await asyncio.start_server(on_connect, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    client = await asyncio.open_connection('127.0.0.1', port)
+    peer = await accepted.get()
+    yield client, peer
+    for _, writer in (client, peer):
+        writer.transport.abort()
+    listener.close()
+    await listener.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_writes_in_one_loop_turn_are_coalesced(socket_pair):
+    (reader, _), (_, writer) = socket_pair
+    out = flow.CoalescingWriter(writer)
+    for index in range(10):
+        await out.send(f'línea {index}\n'.encode())
+    await asyncio.sleep(0)
+    assert out.writes == 1
+    received = b''
+    while received.count(b'\n') < 10:
+        received += await asyncio.wait_for(reader.read(4096), 5)
+    assert received.decode().splitlines()[-1] == 'línea 9'
+
+
+@pytest.mark.asyncio
+async def test_slow_reader_is_disconnected(socket_pair):
+    _, (_, writer) = socket_pair
+    out = flow.CoalescingWriter(writer, max_buffer=1024, timeout=0.2)
+    with pytest.raises(ConnectionResetError):
+        for _ in range(1000):
+            await out.send(b'x' * 65536)
+    assert writer.is_closing()
+
+
+async def _session(port, payload=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    if payload:
+        writer.write(payload)
+        await writer.drain()
+    received = b''
+    while chunk := await asyncio.wait_for(reader.read(4096), 5):
+        received += chunk
+    writer.close()
+    return received.decode('utf-8', errors='replace')
+
+
+@pytest.mark.asyncio
+async def test_server_enforces_connection_and_line_limits(monkeypatch):
+    monkeypatch.setattr(server, 'connection_limiter', flow.ConnectionLimiter(limit=1))
+    monkeypatch.setattr(server, 'message_limiter', flow.RateLimiter(rate=0.001, burst=1))
+    monkeypatch.setattr(server, 'TCP_IDLE_TIMEOUT', 0.3)
+    listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0, limit=256)
+    port = listener.sockets[0].getsockname()[1]
+
+    first = asyncio.create_task(_session(port, b'/guest\nhola\n'))
+    await asyncio.sleep(0.1)
+    assert 'Demasiadas conexiones' in await _session(port)
+    text = await first
+    assert 'muy rápido' in text and 'inactividad' in text
+
+    monkeypatch.setattr(server, 'message_limiter', flow.RateLimiter())
+    assert 'demasiado largo' in await _session(port, b'x' * 1000 + b'\n')
+
+    listener.close()
+    await listener.wait_closed()
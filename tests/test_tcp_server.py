@@ -0,0 +1,324 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from fitbot import replies
+from fitbot.tcp import flow, server
+
+REPLY = "  Hola!\nHacé 3 series.\n\n- sentadilla\n- plancha  \n"
+
+
+@pytest.fixture(autouse=True)
+def fresh_limits(monkeypatch):
+    monkeypatch.setattr(server, 'connection_limiter', flow.ConnectionLimiter())
+    monkeypatch.setattr(server, 'message_limiter', flow.RateLimiter())
+    monkeypatch.setattr(server, 'load', server.LoadStats())
+
+
+def _split(text, size):
+    return [text[index : index + size] for index in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, len(REPLY)])
+def test_dialog_stream_matches_format_dialog(size):
+    expected = server._format_dialog('B', '|', REPLY.strip()) + '\n'
+    for line_buffered in (False, True):
+        stream = server.DialogStream('B', '|', line_buffered=line_buffered)
+        chunks = [stream.feed(delta) for delta in _split(REPLY, size)] + [stream.finish()]
+        assert ''.join(chunks) == expected
+        if line_buffered:
+            assert all(chunk.endswith('\n') for chunk in chunks if chunk)
+
+
+def test_dialog_stream_without_text_emits_nothing():
+    stream = server.DialogStream('B', '|')
+    assert stream.feed('  \n') == ''
+    assert stream.finish() == ''
+
+
+@pytest.mark.asyncio
+async def test_reply_is_written_before_generation_ends(monkeypatch):
+    release = asyncio.Event()
+
+    async def fake_stream_reply(client_id, messages, on_position=None):
+        yield 'Primera parte'
+        await release.wait()
+        yield ' y final'
+
+    monkeypatch.setattr(replies, 'stream_reply', fake_stream_reply)
+    listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'/guest\nhola\n')
+    await writer.drain()
+
+    received = b''
+    while b'Primera parte' not in received:
+        received += await asyncio.wait_for(reader.read(1024), 5)
+    assert b'y final' not in received
+    release.set()
+    while not received.endswith(b'final\n'):
+        received += await asyncio.wait_for(reader.read(1024), 5)
+    assert server.BOT_TAG.encode() + b': Primera parte y final\n' in received
+
+    writer.write(b'/quit\n')
+    while await asyncio.wait_for(reader.read(1024), 5):
+        pass
+    writer.close()
+    listener.close()
+    await listener.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_framed_protocol_pipelines_requests(monkeypatch):
+    import fakeredis.aioredis
+
+    from fitbot import chat_store
+    from fitbot.tcp import client as tcp_client, protocol
+
+    async def fake_stream_reply(client_id, messages, on_position=None):
+        yield 'Eco: '
+        yield messages[-1]['content']
+
+    monkeypatch.setattr(replies, 'stream_reply', fake_stream_reply)
+    redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await chat_store.init_db(client=redis_client)
+    listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+
+    reader, writer = await tcp_client.open_framed('127.0.0.1', port)
+    requests = [
+        {'id': 1, 'op': 'chat', 'text': 'antes del login'},
+        {'id': 2, 'op': 'register', 'username': 'ana', 'password': 'clave'},
+        {'id': 3, 'op': 'chat', 'text': 'uno'},
+        {'id': 4, 'op': 'chat', 'text': 'dos'},
+        {'id': 5, 'op': 'log', 'entry': 'sentadilla 3x10 50kg'},
+        {'id': 6, 'op': 'history', 'limit': 2},
+        {'id': 8, 'op': 'history', 'cursor': 123},
+        {'id': 7, 'op': 'quit'},
+    ]
+    writer.write(b''.join(protocol.encode(frame) for frame in requests))
+    await writer.drain()
+    frames = []
+    while True:
+        line = await asyncio.wait_for(reader.readline(), 5)
+        if not line:
+            break
+        frames.append(protocol.decode(line))
+
+    by_id = {}
+    for frame in frames:
+        by_id.setdefault(frame['id'], []).append(frame)
+    assert by_id[1] == [{'id': 1, 'type': 'error', 'error': 'unauthenticated'}]
+    assert by_id[2][0]['ok'] is True
+    assert [frame['type'] for frame in by_id[3]] == ['delta', 'delta', 'done']
+    assert by_id[4][-1] == {'id': 4, 'type': 'done', 'text': 'Eco: dos'}
+    assert by_id[5][0]['data']['workout']['weight_kg'] == 50.0
+    assert [item['content'] for item in by_id[6][0]['data']['items']] == ['dos', 'Eco: dos']
+    assert by_id[8][0]['error'] == 'bad_request'
+    assert by_id[7] == [{'id': 7, 'type': 'bye'}]
+    writer.close()
+
+    out = io.StringIO()
+    code = await tcp_client.run_batch('127.0.0.1', port, ['hola', 'chau'], 'ana', 'clave', out=out)
+    assert code == 0
+    assert [json.loads(line)['reply'] for line in out.getvalue().splitlines()] == ['Eco: hola', 'Eco: chau']
+    assert await tcp_client.run_batch('127.0.0.1', port, ['x'], 'ana', 'mala', out=io.StringIO()) == 2
+
+    listener.close()
+    await listener.wait_closed()
+    await chat_store.close()
+    await redis_client.aclose()
+
+
+async def _read_frames(reader, until):
+    from fitbot.tcp import protocol
+
+    frames = []
+    while not until(frames):
+        line = await asyncio.wait_for(reader.readline(), 5)
+        assert line, 'el servidor cerró la conexión'
+        frames.append(protocol.decode(line))
+    return frames
+
+
+@pytest.mark.asyncio
+async def test_channels_run_concurrently_and_cancel(monkeypatch):
+    from fitbot.tcp import client as tcp_client, protocol
+
+    gates = {'lento': asyncio.Event(), 'rapido': asyncio.Event()}
+    gates['rapido'].set()
+
+    async def fake_stream_reply(client_id, messages, on_position=None):
+        text = messages[-1]['content']
+        yield f'{text}:'
+        await gates[text].wait()
+        yield 'ok'
+
+    monkeypatch.setattr(replies, 'stream_reply', fake_stream_reply)
+    listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await tcp_client.open_framed('127.0.0.1', port)
+    requests = [
+        {'id': 1, 'channel': 'a', 'op': 'guest'},
+        {'id': 2, 'channel': 'b', 'op': 'guest'},
+        {'id': 3, 'channel': 'a', 'op': 'chat', 'text': 'lento'},
+        {'id': 4, 'channel': 'a', 'op': 'chat', 'text': 'rapido'},
+        {'id': 5, 'channel': 'b', 'op': 'chat', 'text': 'rapido'},
+    ]
+    writer.write(b''.join(protocol.encode(frame) for frame in requests))
+    await writer.drain()
+
+    # El canal b responde aunque el a siga generando.
+    frames = await _read_frames(reader, lambda got: any(f['id'] == 5 and f['type'] == 'done' for f in got))
+    assert all(f['channel'] == 'b' for f in frames if f['id'] == 5)
+    assert not any(f['id'] in (3, 4) and f['type'] == 'done' for f in frames)
+
+    writer.write(protocol.encode({'id': 6, 'channel': 'a', 'op': 'cancel', 'target': 4}))
+    writer.write(protocol.encode({'id': 7, 'channel': 'a', 'op': 'cancel'}))
+    await writer.drain()
+    frames = await _read_frames(reader, lambda got: any(f['id'] == 4 and f['type'] == 'error' for f in got))
+    by_id = {f['id']: f for f in frames if f['type'] != 'delta'}
+    assert by_id[3]['error'] == 'cancelled' and by_id[4]['error'] == 'cancelled'
+    assert by_id[6]['ok'] and by_id[7]['ok']
+
+    writer.write(protocol.encode({'id': 8, 'op': 'chat', 'text': 'x'}))
+    writer.write(protocol.encode({'id': 9, 'op': 'quit'}))
+    await writer.drain()
+    frames = await _read_frames(reader, lambda got: got and got[-1]['type'] == 'bye')
+    assert {'id': 8, 'type': 'error', 'error': 'unauthenticated'} in frames
+    writer.close()
+    listener.close()
+    await listener.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_text_mode_cancel_stops_reply(monkeypatch):
+    release = asyncio.Event()
+
+    async def fake_stream_reply(client_id, messages, on_position=None):
+        yield 'Empiezo'
+        await release.wait()
+        yield ' y termino'
+
+    monkeypatch.setattr(replies, 'stream_reply', fake_stream_reply)
+    listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'/guest\nhola\n')
+    await writer.drain()
+    received = b''
+    while b'Empiezo' not in received:
+        received += await asyncio.wait_for(reader.read(1024), 5)
+    writer.write(b'/cancel\n/quit\n')
+    await writer.drain()
+    while True:
+        chunk = await asyncio.wait_for(reader.read(1024), 5)
+        if not chunk:
+            break
+        received += chunk
+    assert 'Respuesta cancelada'.encode() in received
+    assert b'termino' not in received
+    writer.close()
+    listener.close()
+    await listener.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_reply_in_flight(monkeypatch):
+    release = asyncio.Event()
+
+    async def fake_stream_reply(client_id, messages, on_position=None):
+        yield 'Parte'
+        await release.wait()
+        yield ' final'
+
+    monkeypatch.setattr(replies, 'stream_reply', fake_stream_reply)
+    listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'/guest\nhola\n')
+    await writer.drain()
+    received = b''
+    while b'Parte' not in received:
+        received += await asyncio.wait_for(reader.read(1024), 5)
+
+    other_reader, other_writer = await asyncio.open_connection('127.0.0.1', port)
+    other_writer.write(b'/guest\n')
+    await other_writer.drain()
+    drain = asyncio.create_task(server._drain(listener, timeout=5))
+    await asyncio.sleep(0.2)
+    assert not drain.done() and server.load.replies_in_flight == 1
+    # Las sesiones abiertas no empiezan respuestas nuevas mientras se drena.
+    other_writer.write(b'otra consulta\n')
+    await other_writer.drain()
+    seen = b''
+    while 'reiniciando'.encode() not in seen:
+        seen += await asyncio.wait_for(other_reader.read(1024), 5)
+    assert server.load.replies_in_flight == 1
+    release.set()
+    await asyncio.wait_for(drain, 5)
+    while chunk := await asyncio.wait_for(reader.read(1024), 5):
+        received += chunk
+    assert b'Parte final\n' in received
+    assert server.load.connections == 0
+    writer.close()
+    other_writer.close()
+
+
+@pytest.mark.asyncio
+async def test_cancel_after_generation_keeps_turn_and_full_queue_answers_busy(monkeypatch):
+    from fitbot.tcp import client as tcp_client, protocol
+
+    persisting, release = asyncio.Event(), asyncio.Event()
+    gate = asyncio.Event()
+
+    async def fake_stream_reply(client_id, messages, on_position=None):
+        if messages[-1]['content'] == 'espera':
+            await gate.wait()
+        yield 'listo'
+
+    async def slow_persist(ctx, message, reply):
+        persisting.set()
+        await release.wait()
+
+    monkeypatch.setattr(replies, 'stream_reply', fake_stream_reply)
+    monkeypatch.setattr(server, '_persist_turn', slow_persist)
+    monkeypatch.setattr(server, 'CHANNEL_QUEUE_SIZE', 1)
+    listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await tcp_client.open_framed('127.0.0.1', port)
+    writer.write(protocol.encode({'id': 1, 'op': 'guest'}))
+    writer.write(protocol.encode({'id': 2, 'op': 'chat', 'text': 'hola'}))
+    await writer.drain()
+    await asyncio.wait_for(persisting.wait(), 5)
+
+    # La respuesta ya se generó: el cancel llega tarde y el turno se completa.
+    writer.write(protocol.encode({'id': 3, 'op': 'cancel'}))
+    await writer.drain()
+    frames = await _read_frames(reader, lambda got: any(f['id'] == 3 for f in got))
+    release.set()
+    frames += await _read_frames(reader, lambda got: any(f['id'] == 2 and f['type'] == 'done' for f in got))
+    assert {'id': 3, 'type': 'error', 'error': 'not_found'} in frames
+    assert not any(f['id'] == 2 and f['type'] == 'error' for f in frames)
+
+    # Con la cola del canal llena se responde ``busy`` sin dejar de leer otros pedidos.
+    writer.write(protocol.encode({'id': 10, 'op': 'chat', 'text': 'espera'}))
+    await writer.drain()
+    await asyncio.sleep(0.05)
+    requests = [{'id': 11, 'op': 'chat', 'text': 'espera'}, {'id': 12, 'op': 'chat', 'text': 'espera'}]
+    requests.append({'id': 20, 'op': 'ping'})
+    writer.write(b''.join(protocol.encode(frame) for frame in requests))
+    await writer.drain()
+    frames = await _read_frames(reader, lambda got: any(f['id'] == 20 for f in got))
+    assert {'id': 12, 'type': 'error', 'error': 'busy'} in frames
+    gate.set()
+    writer.write(protocol.encode({'id': 21, 'op': 'quit'}))
+    await writer.drain()
+    frames = await _read_frames(reader, lambda got: got and got[-1]['type'] == 'bye')
+    assert [f['id'] for f in frames if f['type'] == 'done'] == [10, 11]
+    writer.close()
+    listener.close()
+    await listener.wait_closed()
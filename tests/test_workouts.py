@@ -0,0 +1,66 @@
+import fakeredis.aioredis
+import pytest
+
+from fitbot import chat_store, prompt, workouts
+
+
+@pytest.mark.parametrize(
+    'entry, expected',
+    [
+        ('pushups 3x10', {'exercise': 'pushups', 'sets': 3, 'reps': 10}),
+        ('Sentadilla 5x5 @100kg', {'exercise': 'sentadilla', 'sets': 5, 'reps': 5, 'weight_kg': 100.0}),
+        ('press banca 3 series de 8 80 kg', {'exercise': 'press banca', 'sets': 3, 'reps': 8, 'weight_kg': 80.0}),
+        ('plancha 3x45s', {'exercise': 'plancha', 'sets': 3, 'reps': 0, 'duration_s': 135}),
+        ('correr 5km 30min', {'exercise': 'correr', 'distance_km': 5.0, 'duration_s': 1800}),
+        ('dominadas 12', {'exercise': 'dominadas', 'sets': 1, 'reps': 12}),
+    ],
+)
+def test_parse_extracts_structured_fields(entry, expected):
+    record = workouts.parse(entry).as_dict()
+    assert {key: record[key] for key in expected} == expected
+
+
+def test_streak_counts_consecutive_days():
+    assert workouts.next_streak(0, 0, 0, 100) == (100, 1, 1)
+    assert workouts.next_streak(100, 1, 1, 101) == (101, 2, 2)
+    assert workouts.next_streak(101, 2, 2, 101) == (101, 2, 2)
+    assert workouts.next_streak(101, 2, 2, 105) == (105, 1, 2)
+    assert workouts.next_streak(105, 1, 2, 103) == (105, 1, 2)
+
+
+@pytest.mark.asyncio
+async def test_log_updates_aggregates_read_in_one_pass():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await chat_store.init_db(client=client)
+    await chat_store.log_workouts('eva', ['sentadilla 5x5 100kg', 'sentadilla 3x3 90kg', 'dominadas 12'])
+
+    stats = await chat_store.get_workout_stats('eva')
+    assert stats['workouts'] == 3
+    assert stats['volume_kg'] == 2500 + 810
+    assert stats['streak'] == 1 and stats['best_streak'] == 1
+    assert stats['weeks'][0]['volume_kg'] == 3310 and stats['weeks'][0]['workouts'] == 3
+    assert stats['records']['weight'] == [{'exercise': 'sentadilla', 'value': 100.0}]
+    assert stats['records']['reps'][0] == {'exercise': 'dominadas', 'value': 12.0}
+
+    profile = workouts.format_profile(stats)
+    assert 'sentadilla 100 kg' in profile
+    system = prompt.build_prompt([{'role': 'user', 'content': 'hola'}], profile=profile).messages[0]
+    assert profile in system['content']
+    assert workouts.format_stats(stats).startswith('Tus estadísticas')
+
+    await chat_store.close()
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_stats_script_tracks_streak_across_days():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    record = [workouts.parse('plancha 60s')]
+    day = 86400
+    for now in (10 * day, 11 * day, 11 * day + 60, 9 * day, 14 * day):
+        await chat_store._update_workout_stats(client, 'leo', record, now)
+    stats_key, _, _ = chat_store._stats_keys('leo')
+    stats = await client.hgetall(stats_key)
+    assert (stats['streak'], stats['best_streak'], stats['workouts']) == ('1', '2', '5')
+    assert stats['last_day'] == str(workouts.local_day(14 * day))
+    await client.aclose()